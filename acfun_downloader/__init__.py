@@ -1,4 +1,12 @@
 # 在 plugins/bilibili_downloader/__init__.py 中
+import os
+import sys
+
+# python -m acfun_downloader 启动命令行模式时，本包在 __main__ 之前导入（此时 sys.argv[0] 为 "-m"），
+# 这种情况下插件模块不导入QtWidgets
+if sys.argv[:1] == ["-m"]:
+    os.environ.setdefault("DOWNLOADER_HEADLESS", "1")
+
 from .plugin import AcfunDownloaderPlugin
 
 # 导出插件类，使插件管理器能够找到它
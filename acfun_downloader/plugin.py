@@ -1,12 +1,38 @@
 # 在 plugins/acfun_downloader/plugin.py 中
 import re
 import os
+import sys
+import json
+import time
+import threading
+import shutil
 import subprocess
-from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QFormLayout, QLabel, 
-                            QLineEdit, QPushButton, QMessageBox, QProgressBar, 
-                            QGroupBox, QDialog, QHBoxLayout)
-from PyQt5.QtCore import QThread, pyqtSignal, Qt, QSize
-from PyQt5.QtGui import QIcon
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, urljoin, parse_qs
+from PyQt5.QtCore import QThread, QTimer, pyqtSignal, Qt, QSize
+
+# 以命令行方式运行（python -m acfun_downloader）时不导入界面模块，没有图形环境的服务器上也能启动
+if not os.environ.get("DOWNLOADER_HEADLESS"):
+    from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QFormLayout, QLabel, 
+                                QPushButton, QMessageBox, QProgressBar, 
+                                QGroupBox, QDialog, QHBoxLayout, QPlainTextEdit,
+                                QSpinBox, QTableWidget, QTableWidgetItem, QHeaderView,
+                                QAbstractItemView, QCheckBox, QListWidget, QListWidgetItem)
+    from PyQt5.QtGui import QIcon
+
+# 各插件共用的组件在插件目录下的 downloader_common 包中，先把插件目录加入路径
+PLUGINS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PLUGINS_DIR not in sys.path:
+    sys.path.append(PLUGINS_DIR)
+from downloader_common import (ProcessSupervisor, ytdlp_cli_args, get_ytdlp_pool, format_size,
+                               format_duration, format_progress_message, ProgressAggregator, DownloadJournal,
+                               remove_partial_files, get_bandwidth_manager, ADAPTIVE_PROBE_SECONDS,
+                               get_measured_throughput, set_measured_throughput, ThroughputMeter,
+                               choose_within_budget, get_postprocess_pool, file_sha256, get_download_archive,
+                               ArchiveScanThread, parse_url_list, DownloadQueue, PREFETCH_LIMIT,
+                               describe_prefetched_metadata, MetadataPrefetcher, build_headless_parser,
+                               run_headless)
 
 # 导入插件基类
 try:
@@ -16,116 +42,826 @@ except ImportError:
     class PluginBase:
         def __init__(self, app_instance=None):
             self.app = app_instance
+
+
+def video_key_from_url(url):
+    """用AcFun视频号(含分P)或番剧剧集号作为去重键，同一视频的不同链接形式视为重复"""
+    match = re.search(r'acfun\.cn/v/(ac\d+(?:_\d+)?)', url, re.IGNORECASE) or \
+        re.search(r'acfun\.cn/bangumi/(aa\d+(?:_\d+_\d+)?)', url, re.IGNORECASE)
+    if match:
+        return match.group(1).lower()
+    return DownloadQueue.normalize_url(url)
+
+
+ACFUN_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Referer': 'https://www.acfun.cn/'
+}
+
+
+# 番剧剧集页链接 aa{番剧ID}_{分组ID}_{剧集ID} 的中间段。页面中的 bangumiList 只给出番剧ID和剧集ID，
+# 站内番剧剧集页链接的这一段都是同一个固定值，只能按常量拼接
+ACFUN_BANGUMI_GROUP_ID = 36188
+
+
+def create_http_session(pool_size=16, headers=None):
+    """创建连接池足够容纳所有并行分片请求的 requests.Session"""
+    from requests.adapters import HTTPAdapter
+    
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(headers or ACFUN_HEADERS)
+    return session
+
+
+def extract_page_json(page, name):
+    """取出页面中 window.<name> = {...} 赋值的JSON对象，找不到时返回None"""
+    match = re.search(r'window\.%s\s*=\s*' % re.escape(name), page)
+    if not match:
+        return None
+    try:
+        return json.JSONDecoder().raw_decode(page, match.end())[0]
+    except ValueError:
+        return None
+
+
+def fetch_acfun_play_info(url, session):
+    """解析视频页面，返回 {"title", "duration", "representations"}，失败返回None
+
+    representations 是 ksPlayJson 中各清晰度的m3u8信息，已按画质从高到低排序。
+    """
+    response = session.get(url, timeout=10)
+    response.raise_for_status()
+    page = response.text
+    data = extract_page_json(page, "videoInfo")
+    if data:
+        video_info = data.get("currentVideoInfo") or {}
+        title = data.get("title")
+        video_list = data.get("videoList") or []
+        if len(video_list) > 1:
+            # 多P视频在标题后加上分P名称
+            for index, part in enumerate(video_list, 1):
+                if part.get("id") == video_info.get("id"):
+                    title = f"{title} P{index:02d} {part.get('title', '')}"
+                    break
+    else:
+        data = extract_page_json(page, "bangumiData")
+        if not data:
+            return None
+        ac_index = parse_qs(urlparse(url).query).get("ac")
+        video_info = data.get("hlVideoInfo" if ac_index else "currentVideoInfo") or {}
+        title = video_info.get("title") if ac_index else data.get("showTitle")
+    
+    try:
+        play_json = json.loads(video_info.get("ksPlayJson") or "{}")
+        representations = play_json["adaptationSet"][0]["representation"]
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+    representations = sorted(
+        (r for r in representations if r.get("url")),
+        key=lambda r: (r.get("height") or 0, r.get("avgBitrate") or r.get("maxBitrate") or 0),
+        reverse=True
+    )
+    if not representations:
+        return None
+    duration = video_info.get("durationMillis")
+    return {
+        "title": title or video_key_from_url(url),
+        "duration": duration / 1000 if duration else None,
+        "representations": representations
+    }
+
+
+def expand_acfun_url(url, session):
+    """把番剧或多P视频链接展开为剧集列表
+
+    一次请求页面即可拿到全部剧集的标题和编号。返回 {"title", "episodes": [{"url", "title"}]}；
+    单个视频、已指定具体分P/剧集的链接或解析失败时返回None。
+    """
+    bangumi = re.search(r'acfun\.cn/bangumi/aa(\d+)(?:[/?#]|$)', url)
+    video = re.search(r'acfun\.cn/v/ac(\d+)(?:[/?#]|$)', url)
+    if not bangumi and not video:
+        return None
+    response = session.get(url, timeout=10)
+    response.raise_for_status()
+    page = response.text
+    
+    if bangumi:
+        data = extract_page_json(page, "bangumiData") or {}
+        items = (extract_page_json(page, "bangumiList") or {}).get("items") or []
+        bangumi_id = data.get("bangumiId") or bangumi.group(1)
+        episodes = [{
+            "url": f"https://www.acfun.cn/bangumi/aa{bangumi_id}_{ACFUN_BANGUMI_GROUP_ID}_{item['itemId']}",
+            "title": " ".join(filter(None, [item.get("episodeName"), item.get("title")])) or str(item["itemId"])
+        } for item in items if item.get("itemId")]
+        title = data.get("bangumiTitle") or data.get("showTitle")
+    else:
+        data = extract_page_json(page, "videoInfo") or {}
+        parts = data.get("videoList") or []
+        if len(parts) < 2:
+            return None
+        episodes = [{
+            "url": f"https://www.acfun.cn/v/ac{video.group(1)}_{index}",
+            "title": f"P{index:02d} {part.get('title', '')}".strip()
+        } for index, part in enumerate(parts, 1)]
+        title = data.get("title")
+    if not episodes:
+        return None
+    return {"title": title or url, "episodes": episodes}
+
+
+class UrlExpandThread(QThread):
+    """在后台并行展开链接，结果按输入顺序返回"""
+    expand_complete = pyqtSignal(list, list)  # 单个视频链接, 剧集列表 [{"title", "episodes"}]
+    
+    def __init__(self, urls, max_workers=4):
+        super().__init__()
+        self.urls = urls
+        self.max_workers = max_workers
+    
+    def run(self):
+        session = create_http_session(self.max_workers)
+        
+        def expand(url):
+            try:
+                return expand_acfun_url(url, session)
+            except Exception as e:
+                print(f"展开剧集列表失败 {url}: {e}")
+                return None
+        
+        singles, series = [], []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for url, result in zip(self.urls, executor.map(expand, self.urls)):
+                if result:
+                    series.append(result)
+                else:
+                    singles.append(url)
+        self.expand_complete.emit(singles, series)
+
+
+def parse_m3u8_attributes(text):
+    """解析 KEY=VALUE,KEY="VALUE" 形式的标签属性"""
+    return {key: value.strip('"') for key, value in re.findall(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)', text)}
+
+
+def parse_m3u8(text, base_url):
+    """解析m3u8播放列表
+
+    返回 {"variants": [(带宽, 地址)], "segments": [{"url", "duration", "byterange"}],
+    "init": 初始化分片或None, "encrypted": 是否加密}。主播放列表只有 variants。
+    """
+    playlist = {"variants": [], "segments": [], "init": None, "encrypted": False}
+    duration = 0.0
+    byterange = None
+    next_offset = 0
+    pending_variant = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("#EXT-X-STREAM-INF:"):
+            pending_variant = int(parse_m3u8_attributes(line[18:]).get("BANDWIDTH") or 0)
+        elif line.startswith("#EXTINF:"):
+            try:
+                duration = float(line[8:].split(",", 1)[0])
+            except ValueError:
+                duration = 0.0
+        elif line.startswith("#EXT-X-BYTERANGE:"):
+            length, _, offset = line[17:].partition("@")
+            start = int(offset) if offset else next_offset
+            byterange = (start, start + int(length) - 1)
+            next_offset = start + int(length)
+        elif line.startswith("#EXT-X-KEY:"):
+            if parse_m3u8_attributes(line[11:]).get("METHOD", "NONE") != "NONE":
+                playlist["encrypted"] = True
+        elif line.startswith("#EXT-X-MAP:"):
+            uri = parse_m3u8_attributes(line[11:]).get("URI")
+            if uri:
+                playlist["init"] = urljoin(base_url, uri)
+        elif not line.startswith("#"):
+            url = urljoin(base_url, line)
+            if pending_variant is not None:
+                playlist["variants"].append((pending_variant, url))
+                pending_variant = None
+            else:
+                playlist["segments"].append({"url": url, "duration": duration, "byterange": byterange})
+                duration = 0.0
+                byterange = None
+    return playlist
+
+
+def fetch_hls_playlist(url, session, max_depth=2):
+    """下载并解析媒体播放列表，主播放列表时选择带宽最高的子列表"""
+    for _ in range(max_depth + 1):
+        response = session.get(url, timeout=10)
+        response.raise_for_status()
+        playlist = parse_m3u8(response.text, response.url or url)
+        if not playlist["variants"]:
+            return playlist
+        url = max(playlist["variants"])[1]
+    return None
+
+
+class DownloadCancelled(Exception):
+    """下载被用户取消"""
+
+
+class HlsDownloader:
+    """HLS分片并行下载器
+
+    最多 connections 个线程并行请求分片，下载完成的分片先放入重排缓冲区，
+    再按播放列表顺序追加写入同一个文件。写入位置之后最多预取 window 个分片，
+    前面的分片迟迟未完成时其余线程等待，内存占用不会随分片数增长。单个分片失败时只重试该分片。
+    """
+    
+    def __init__(self, session=None, connections=8, window=None, max_retries=3,
+                 should_stop=None, on_bytes=None, throttle=None):
+        self.connections = max(1, int(connections))
+        self.session = session or create_http_session(self.connections)
+        self.window = window or self.connections * 4
+        self.max_retries = max_retries
+        self.should_stop = should_stop or (lambda: False)
+        self.on_bytes = on_bytes or (lambda count: None)
+        self.throttle = throttle or (lambda count: None)  # 带宽限速，超速时阻塞
+    
+    def download(self, segments, path, start_index=0, on_segment_written=None):
+        """把 segments[start_index:] 按顺序追加写入 path，返回文件大小
+
+        start_index 为0时覆盖已有文件；每写入一个分片调用 on_segment_written(已写入分片数, 文件大小)。
+        """
+        cond = threading.Condition()
+        state = {"next_fetch": start_index, "next_write": start_index, "error": None}
+        buffer = {}  # 分片序号 -> 数据，等待前面的分片写入
+        
+        with open(path, "ab" if start_index else "wb") as f:
+            def worker():
+                while True:
+                    with cond:
+                        # 领先写入位置太多时等待，限制缓冲区大小
+                        while (state["error"] is None and state["next_fetch"] < len(segments)
+                               and state["next_fetch"] - state["next_write"] >= self.window):
+                            cond.wait(0.5)
+                            if self.should_stop():
+                                state["error"] = state["error"] or DownloadCancelled()
+                        if state["error"] is not None or state["next_fetch"] >= len(segments):
+                            return
+                        index = state["next_fetch"]
+                        state["next_fetch"] += 1
+                    try:
+                        data = self._fetch_segment(segments[index])
+                    except Exception as e:
+                        with cond:
+                            state["error"] = state["error"] or e
+                            cond.notify_all()
+                        return
+                    with cond:
+                        buffer[index] = data
+                        # 按顺序写出缓冲区中已经连续的分片
+                        while state["next_write"] in buffer:
+                            f.write(buffer.pop(state["next_write"]))
+                            state["next_write"] += 1
+                            if on_segment_written:
+                                on_segment_written(state["next_write"], f.tell())
+                        cond.notify_all()
             
+            workers = [threading.Thread(target=worker, daemon=True)
+                       for _ in range(min(self.connections, max(len(segments) - start_index, 1)))]
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            if state["error"] is not None:
+                raise state["error"]
+            return f.tell()
+    
+    def _fetch_segment(self, segment):
+        headers = {}
+        if segment.get("byterange"):
+            headers["Range"] = "bytes=%d-%d" % tuple(segment["byterange"])
+        for attempt in range(self.max_retries + 1):
+            received = 0
+            try:
+                response = self.session.get(segment["url"], headers=headers, stream=True, timeout=15)
+                try:
+                    response.raise_for_status()
+                    chunks = []
+                    for data in response.iter_content(64 * 1024):
+                        if self.should_stop():
+                            raise DownloadCancelled()
+                        chunks.append(data)
+                        received += len(data)
+                        self.on_bytes(len(data))
+                        self.throttle(len(data))
+                finally:
+                    response.close()
+                return b"".join(chunks)
+            except DownloadCancelled:
+                raise
+            except Exception as e:
+                # 重试前扣除这次已计入进度的字节
+                self.on_bytes(-received)
+                if attempt == self.max_retries:
+                    raise
+                print(f"分片 {segment['url']} 下载失败，准备重试: {e}")
+                time.sleep(1 + attempt)
+
+
+def remux_to_mp4(input_path, output_path, should_stop=None):
+    """用ffmpeg把TS文件不重新编码地封装为MP4，成功返回True"""
+    supervisor = ProcessSupervisor([
+        'ffmpeg', '-y', '-i', input_path, '-c', 'copy', '-bsf:a', 'aac_adtstoasc',
+        '-movflags', '+faststart', output_path
+    ])
+    for _ in supervisor.iter_lines(should_stop=should_stop):
+        pass
+    if supervisor.wait(10) == 0:
+        return True
+    print(f"封装MP4失败: {supervisor.stderr_text()[-500:]}")
+    return False
+
+
+def adaptive_candidates(info, duration):
+    """自适应画质的候选：各清晰度 [(画质名称, 清晰度信息, 预计字节数)]，从高到低；缺少码率时返回空列表"""
+    candidates = []
+    for representation in info["representations"]:
+        bitrate = representation.get("avgBitrate") or representation.get("maxBitrate")  # kbps
+        if not bitrate or not duration:
+            return []
+        label = representation.get("qualityLabel") or f"{representation.get('height')}P"
+        candidates.append((label, representation, int(bitrate * 1000 / 8 * duration)))
+    return candidates
+
+
+def prefetch_video_metadata(url):
+    """粘贴链接后预先解析视频页面和最高画质的媒体播放列表，开始下载时内置下载器直接使用"""
+    session = create_http_session(4)
+    info = fetch_acfun_play_info(url, session)
+    if not info:
+        return {"error": "解析视频页面失败"}
+    best = info["representations"][0]
+    playlist = fetch_hls_playlist(best["url"], session)
+    duration = info["duration"] or (sum(segment["duration"] for segment in playlist["segments"]) if playlist else None)
+    bitrate = best.get("avgBitrate") or best.get("maxBitrate")  # kbps
+    return {
+        "title": info["title"],
+        "duration": duration,
+        "size": int(bitrate * 1000 / 8 * duration) if bitrate and duration else None,
+        "qualities": [r.get("qualityLabel") or f"{r.get('height')}P" for r in info["representations"]],
+        "info": info,
+        "playlist": playlist
+    }
+
+
 class AcfunDownloadThread(QThread):
     """AcFun视频下载线程"""
     progress_updated = pyqtSignal(int, str)
     download_complete = pyqtSignal(bool, str, str)  # 成功状态, 消息, 文件路径
     
-    def __init__(self, url, output_dir):
+    def __init__(self, url, output_dir, bandwidth=None, archive=None, skip_downloaded=True,
+                 engine="native", connections=8, postprocessor=None, prefetcher=None, time_budget=0):
         super().__init__()
         
         self.url = url
         self.output_dir = output_dir
+        self.engine = engine  # "native": 内置HLS分片并行下载, "ytdlp": 交给yt-dlp
+        self.connections = connections  # 内置下载器并行下载的分片数
         self.is_running = True
+        self.bandwidth = bandwidth  # BandwidthManager，为None时不限速
+        self.archive = archive  # DownloadArchive，为None时不记录已下载的视频
+        self.skip_downloaded = skip_downloaded  # 已下载过的视频直接跳过
+        self.postprocessor = postprocessor  # PostProcessPool，为None时在下载线程中直接封装和计算校验和
+        self.postprocessing = False  # 收尾工作已交给后处理线程池
+        self.prefetcher = prefetcher  # MetadataPrefetcher，粘贴链接时已解析的播放列表直接用于下载
+        self.time_budget = time_budget  # 自适应画质的时限(秒)，0为固定下载最高画质
+        self.adaptive_choice = None  # 自适应画质探测后选定的画质和测得的吞吐量
+        self.progress_bus = None  # 由下载队列设置的ProgressAggregator
+        self.journal = None  # 由下载队列设置的DownloadJournal
+        self.partial_files = []  # yt-dlp写入过的文件，用于清理 .part 临时文件
+        self.native_partial = None  # 内置下载器的临时文件（不含 .part 后缀）
+        self.job_key = url
         self.file_path = ""
         
     def run(self):
         try:
+            video_id = video_key_from_url(self.url)
+            # 已下载过且文件仍然存在时直接跳过，不再访问网络
+            archived = self.archive.lookup("acfun", video_id, '') if self.archive and self.skip_downloaded else None
+            if archived:
+                self.report_progress(100, "已下载过，跳过")
+                self.download_complete.emit(True, "已下载过，跳过", archived["path"])
+                return
+            
             # 确保输出目录存在
             os.makedirs(self.output_dir, exist_ok=True)
             
+            if self.engine == "native":
+                self.report_progress(5, "正在解析视频地址...")
+                downloaded = self.download_native()
+                if not self.is_running:
+                    self.report_progress(0, "下载已取消")
+                    self.download_complete.emit(False, "取消下载", "")
+                    return
+                if downloaded:
+                    temp_path, output_path, fragmented = downloaded
+                    self.run_postprocess(lambda: self.finish_native(temp_path, output_path, fragmented, video_id))
+                    return
+                print("内置下载器不可用，改用yt-dlp下载")
+            
             # 设置输出文件模板
             output_template = os.path.join(self.output_dir, "%(title)s.%(ext)s")
             
-            # 设置yt-dlp命令
-            cmd = [
-                "yt-dlp", 
-                self.url, 
-                "-o", output_template,
-                "--newline",  # 确保进度实时显示
-                "--progress",  # 显示进度条
-                "--no-colors", # 移除颜色代码，便于解析输出
-                "--no-playlist", # 不下载播放列表
-                "--no-check-certificate"  # 不检查证书
-            ]
+            # 设置yt-dlp选项
+            options = {
+                "outtmpl": output_template,
+                "noplaylist": True,  # 不下载播放列表
+                "nocheckcertificate": True,  # 不检查证书
+                "continuedl": True  # 从已有的 .part 文件继续下载
+            }
             
-            self.progress_updated.emit(5, "正在连接AcFun...")
+            self.report_progress(5, "正在连接AcFun...")
             
-            # 启动下载进程
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                encoding='utf-8',
-                errors='replace'
-            )
+            # 优先交给常驻的yt-dlp工作进程，不可用时启动单独的yt-dlp进程
+            # 按带宽管理器分配的份额限速，其他任务开始或结束时份额会重新计算
+            bandwidth_job = self.bandwidth.register("acfun") if self.bandwidth else None
+            get_ratelimit = (lambda: self.bandwidth.job_rate(bandwidth_job)) if bandwidth_job else None
+            try:
+                if get_ratelimit:
+                    options["ratelimit"] = get_ratelimit() or None
+                result = get_ytdlp_pool().run_job(self.url, options, self.on_ytdlp_event, lambda: not self.is_running,
+                                                  get_ratelimit=get_ratelimit)
+                if result is None:
+                    result = self.run_ytdlp_command(options)
+            finally:
+                if bandwidth_job is not None:
+                    self.bandwidth.unregister(bandwidth_job)
             
-            # 捕获文件名
-            downloaded_file = ""
-            
-            # 监控进度
-            while process.poll() is None:
-                if not self.is_running:
-                    process.terminate()
-                    self.progress_updated.emit(0, "下载已取消")
-                    self.download_complete.emit(False, "取消下载", "")
-                    return
-                
-                line = process.stdout.readline().strip()
-                if not line:
-                    continue
-                    
-                print(f"yt-dlp输出: {line}")
-                
-                # 检测下载进度
-                if '[download]' in line and '%' in line:
-                    try:
-                        # 提取百分比
-                        percent_str = line.split('%')[0].split()[-1]
-                        percent = float(percent_str)
-                        self.progress_updated.emit(int(percent), f"下载中... {percent:.1f}%")
-                    except:
-                        pass
-                
-                # 检测下载文件名
-                elif 'Destination:' in line:
-                    try:
-                        downloaded_file = line.split('Destination:')[1].strip()
-                        self.file_path = downloaded_file
-                        print(f"下载文件: {downloaded_file}")
-                        self.progress_updated.emit(2, f"准备下载: {os.path.basename(downloaded_file)}")
-                    except:
-                        pass
-                
-                # 检测下载速度等信息
-                elif 'ETA' in line:
-                    try:
-                        eta_parts = line.split('ETA')[1].strip()
-                        self.progress_updated.emit(50, f"下载中... ETA: {eta_parts}")
-                    except:
-                        pass
+            if not self.is_running or result.get("cancelled"):
+                self.report_progress(0, "下载已取消")
+                self.download_complete.emit(False, "取消下载", "")
+                return
             
             # 检查是否成功
-            if process.returncode == 0:
-                self.progress_updated.emit(100, "下载完成!")
-                self.download_complete.emit(True, "下载完成", self.file_path)
+            if result.get("ok"):
+                if result.get("filepath"):
+                    self.file_path = result["filepath"]
+                file_path = self.file_path
+                self.run_postprocess(lambda: self.finish_download(video_id, file_path))
             else:
-                error = process.stderr.read()
-                self.progress_updated.emit(0, f"下载失败")
+                error = result.get("error", "")
+                self.report_progress(0, f"下载失败")
                 self.download_complete.emit(False, f"下载失败: {error[:100]}...", "")
                 
         except Exception as e:
             import traceback
             traceback.print_exc()
-            self.progress_updated.emit(0, f"下载出错")
+            self.report_progress(0, f"下载出错")
             self.download_complete.emit(False, str(e), "")
     
+    def download_native(self):
+        """解析页面中的m3u8，多个分片并行下载后按顺序写入同一个TS文件
+
+        返回 (临时文件, MP4输出路径, 是否为fMP4分片)，由 finish_native 封装为MP4；
+        页面解析失败、播放列表加密或下载出错时返回None，由调用方回退到yt-dlp。
+        """
+        session = create_http_session(self.connections)
+        prefetched = self.prefetcher.result(self.url) if self.prefetcher else None
+        if prefetched and prefetched.get("playlist"):
+            info, playlist = prefetched["info"], prefetched["playlist"]
+        else:
+            try:
+                info = fetch_acfun_play_info(self.url, session)
+                playlist = fetch_hls_playlist(info["representations"][0]["url"], session) if info else None
+            except Exception as e:
+                print(f"解析AcFun视频地址失败: {e}")
+                return None
+        if not playlist or not playlist["segments"] or playlist["encrypted"]:
+            return None
+        # 断点续传日志中记录了已按顺序写入的分片数和文件大小，分片数一致时从该处继续
+        entry = (self.journal.get(self.job_key) if self.journal is not None else None) or {}
+        
+        # 自适应画质：先按上次测得的吞吐量初选，探测期结束后按实测结果定下画质；
+        # 选择结果记入任务日志，续传时沿用，不再重新选择
+        adaptive = None
+        duration = info["duration"] or sum(segment["duration"] for segment in playlist["segments"])
+        candidates = adaptive_candidates(info, duration) if self.time_budget else []
+        if len(candidates) > 1:
+            choice = self.adaptive_choice or entry.get("adaptive")
+            if choice and any(candidate[0] == choice.get("quality") for candidate in candidates):
+                quality = choice["quality"]
+            else:
+                choice = None
+                quality = choose_within_budget([(label, size) for label, _, size in candidates],
+                                               get_measured_throughput("acfun"), self.time_budget)
+            if quality != candidates[0][0]:
+                representation = next(r for label, r, _ in candidates if label == quality)
+                try:
+                    playlist = fetch_hls_playlist(representation["url"], session)
+                except Exception as e:
+                    print(f"获取播放列表失败: {e}")
+                    return None
+                if not playlist or not playlist["segments"] or playlist["encrypted"]:
+                    return None
+            adaptive = {"candidates": candidates, "decided": choice is not None, "switch": None, "quality": quality}
+        segments = playlist["segments"]
+        if playlist["init"]:
+            # fMP4分片需要先写入初始化分片
+            segments = [{"url": playlist["init"], "duration": 0.0, "byterange": None}] + segments
+        
+        safe_title = re.sub(r'[\\/:*?"<>|]', '_', info["title"])
+        output_path = os.path.join(self.output_dir, f"{safe_title}.mp4")
+        # 写入单独命名的 .part 临时文件，不与回退到yt-dlp时的临时文件冲突；取消下载时由下载队列清理
+        self.native_partial = output_path + ".hls"
+        temp_path = self.native_partial + ".part"
+        self.record_partial_file(self.native_partial)
+        
+        previous = entry.get("hls") or {}
+        start_index, start_size = 0, 0
+        if (previous.get("count") == len(segments) and os.path.exists(temp_path)
+                and os.path.getsize(temp_path) >= previous.get("size", 0) > 0):
+            start_index, start_size = previous["written"], previous["size"]
+            with open(temp_path, "r+b") as f:
+                f.truncate(start_size)  # 丢弃最后一次记录之后写入的不完整数据
+        
+        total_duration = sum(segment["duration"] for segment in segments) or len(segments)
+        durations = [segment["duration"] or total_duration / len(segments) for segment in segments]
+        progress = {"done": start_size, "written": start_index, "written_duration": sum(durations[:start_index]),
+                    "written_size": start_size}
+        progress_lock = threading.Lock()
+        meter = ThroughputMeter()
+        progress["start"] = meter.start
+        
+        def on_bytes(count):
+            with progress_lock:
+                progress["done"] += count
+                done = progress["done"]
+                # 总大小按已写入分片的码率和总时长估算，全部写入后即为准确值
+                if progress["written_duration"]:
+                    total = int(progress["written_size"] * total_duration / progress["written_duration"])
+                else:
+                    total = None
+            if total:
+                total = max(total, done)
+            elapsed = max(time.time() - progress["start"], 0.001)
+            speed = (done - start_size) / elapsed
+            self.report_progress(
+                done * 100 / total if total else None,
+                downloaded_bytes=done,
+                total_bytes=total,
+                speed=speed,
+                eta=(total - done) / speed if total and speed else None,
+                quality=adaptive["quality"] if adaptive else None
+            )
+        
+        def on_network_bytes(count):
+            on_bytes(count)
+            if adaptive is None or adaptive["decided"]:
+                return
+            meter.add(count)
+            if meter.elapsed() < ADAPTIVE_PROBE_SECONDS:
+                return
+            with progress_lock:
+                if adaptive["decided"]:
+                    return
+                adaptive["decided"] = True
+                done = progress["done"]
+            self.decide_adaptive_quality(adaptive, meter, done)
+        
+        def on_segment_written(written, size):
+            with progress_lock:
+                progress["written_duration"] += sum(durations[progress["written"]:written])
+                progress["written"] = written
+                progress["written_size"] = size
+            self.journal_update(bytes_done=size,
+                                hls={"count": len(segments), "written": written, "size": size})
+        
+        should_stop = lambda: not self.is_running or bool(adaptive and adaptive["switch"])
+        bandwidth_job = self.bandwidth.register("acfun", native=True) if self.bandwidth else None
+        downloader = HlsDownloader(
+            session=session,
+            connections=self.connections,
+            should_stop=should_stop,
+            on_bytes=on_network_bytes,
+            throttle=(lambda count: self.bandwidth.throttle("acfun", count, should_stop)) if self.bandwidth else None
+        )
+        try:
+            self.report_progress(10, f"共 {len(segments)} 个分片，{self.connections} 个连接并行下载")
+            downloader.download(segments, temp_path, start_index, on_segment_written)
+            if adaptive and not adaptive["decided"]:
+                adaptive["decided"] = True
+                self.decide_adaptive_quality(adaptive, meter, progress["done"], finished=True)
+        except DownloadCancelled:
+            if not self.is_running or not adaptive or not adaptive["switch"]:
+                return None
+            # 探测后选定了另一个画质：丢弃已下载的分片，按选定的画质重新下载
+            self.journal_update(force=True, hls=None)
+            remove_partial_files([self.native_partial])
+            return self.download_native()
+        except Exception as e:
+            # 保留已写入的分片和任务日志中的记录，下次仍可从中断处续传
+            print(f"内置下载器下载失败: {e}")
+            return None
+        finally:
+            if bandwidth_job is not None:
+                self.bandwidth.unregister(bandwidth_job)
+        return temp_path, output_path, bool(playlist["init"])
+    
+    def decide_adaptive_quality(self, adaptive, meter, done, finished=False):
+        """探测期结束：按实测吞吐量选出能在时限内下完的最高画质并记入任务日志，需要换画质时让下载器停下
+
+        finished 为True时下载已在探测期内完成，只记录初选的画质和测得的吞吐量。
+        """
+        rate, per_connection, connections = meter.snapshot()
+        set_measured_throughput("acfun", rate)
+        current = adaptive["quality"]
+        options = [(label, max(size - done, 0) if label == current else size)
+                   for label, _, size in adaptive["candidates"]]
+        if finished:
+            quality = current
+        else:
+            quality = choose_within_budget(options, rate, self.time_budget - meter.elapsed())
+        expected = meter.elapsed() + dict(options)[quality] / rate if rate else None
+        self.adaptive_choice = {
+            "quality": quality,
+            "rate": int(rate),
+            "per_connection_rate": int(per_connection),
+            "connections": connections,
+            "budget": self.time_budget,
+            "expected_seconds": int(expected) if expected is not None else None
+        }
+        self.journal_update(force=True, adaptive=self.adaptive_choice)
+        message = (f"自适应画质: {quality} (测得 {format_size(rate)}/s，"
+                   f"每连接 {format_size(per_connection)}/s，预计 {format_duration(expected)} 下完)")
+        print(message)
+        self.report_progress(None, message, adaptive=self.adaptive_choice)
+        if quality != current:
+            adaptive["switch"] = quality
+        adaptive["quality"] = quality
+    
+    def run_postprocess(self, func):
+        """执行下载后的收尾工作（封装、计算校验和），func 负责发出完成信号
+
+        设置了后处理线程池时交给线程池执行，下载线程随即结束、释放下载名额；否则在当前线程中执行。
+        """
+        def task():
+            try:
+                func()
+            except Exception as e:
+                self.report_progress(0, "后处理出错")
+                self.download_complete.emit(False, f"后处理出错: {str(e)}", "")
+        
+        if self.postprocessor is None:
+            task()
+            return
+        self.postprocessing = True
+        self.report_progress(99, "等待后处理...")
+        self.postprocessor.submit(task)
+    
+    def finish_native(self, temp_path, output_path, fragmented, video_id):
+        """后处理：把内置下载器写好的TS文件封装为MP4（fMP4分片直接改名），然后完成下载"""
+        if fragmented:
+            os.replace(temp_path, output_path)
+            self.finish_download(video_id, output_path)
+            return
+        if shutil.which("ffmpeg"):
+            self.report_progress(99, "正在封装为MP4...")
+            if remux_to_mp4(temp_path, output_path, lambda: not self.is_running):
+                os.remove(temp_path)
+                self.finish_download(video_id, output_path)
+                return
+            if not self.is_running:
+                self.report_progress(0, "下载已取消")
+                self.download_complete.emit(False, "取消下载", "")
+                return
+        # 没有ffmpeg时直接保留TS文件，主流播放器都能播放
+        ts_path = os.path.splitext(output_path)[0] + ".ts"
+        os.replace(temp_path, ts_path)
+        self.finish_download(video_id, ts_path)
+    
+    def finish_download(self, video_id, path):
+        """后处理：计算校验和并登记已下载记录，然后发出完成信号"""
+        # 内置下载器中途出错后改用yt-dlp下完的，删除内置下载器留下的分片文件
+        if self.native_partial:
+            remove_partial_files([self.native_partial])
+        self.file_path = path
+        self.archive_download([video_id], path)
+        self.report_progress(100, "下载完成!")
+        self.download_complete.emit(True, "下载完成", path)
+    
+    def on_ytdlp_event(self, event):
+        """处理yt-dlp工作进程返回的结构化进度事件"""
+        if event.get("type") == "progress" and event.get("status") == "downloading":
+            if event.get("filename") and event["filename"] != self.file_path:
+                self.file_path = event["filename"]
+                self.record_partial_file(self.file_path)
+            total = event.get("total_bytes")
+            downloaded = event.get("downloaded_bytes") or 0
+            self.journal_update(bytes_done=downloaded, total_bytes=total)
+            self.report_progress(
+                downloaded * 100 / total if total else None,
+                downloaded_bytes=downloaded,
+                total_bytes=total,
+                speed=event.get("speed"),
+                eta=event.get("eta")
+            )
+        elif event.get("type") == "log" and event.get("level") == "error":
+            print(f"yt-dlp错误: {event.get('message')}")
+    
+    def archive_download(self, video_ids, path, title=None):
+        """把下载完成的文件登记到已下载记录，失败不影响下载结果"""
+        if self.archive is None:
+            return
+        try:
+            sha256 = file_sha256(path) if path and os.path.exists(path) else None
+            for video_id in dict.fromkeys(filter(None, video_ids)):
+                self.archive.record("acfun", video_id, '', path, title, sha256)
+        except Exception as e:
+            print(f"登记已下载记录失败: {e}")
+    
+    def journal_update(self, force=False, **fields):
+        """把下载状态写入断点续传日志"""
+        if self.journal is not None:
+            self.journal.update(self.job_key, force=force, **fields)
+    
+    def record_partial_file(self, path):
+        """记录yt-dlp正在写入的文件，取消下载时据此清理 .part 临时文件"""
+        if path and path not in self.partial_files:
+            self.partial_files.append(path)
+            self.journal_update(force=True, path=path, partial_files=list(self.partial_files))
+    
+    def report_progress(self, percent, message=None, **fields):
+        """上报进度：有进度汇总器时交给它合并限频，否则直接发信号"""
+        if self.progress_bus is not None:
+            self.progress_bus.report(self.job_key, percent, message, **fields)
+        else:
+            fields.update(percent=percent, message=message)
+            self.progress_updated.emit(int(percent or 0), format_progress_message(fields))
+    
+    def run_ytdlp_command(self, options):
+        """以单独的yt-dlp进程执行下载，返回与工作进程相同格式的结果"""
+        cmd = ytdlp_cli_args(self.url, options) + [
+            "--newline",  # 确保进度实时显示
+            "--progress",  # 显示进度条
+            "--no-colors"  # 移除颜色代码，便于解析输出
+        ]
+        
+        # 启动下载进程，同时排空stdout和stderr，避免stderr写满管道导致yt-dlp卡死
+        supervisor = ProcessSupervisor(cmd)
+        
+        # 监控进度
+        for stream, line in supervisor.iter_lines(should_stop=lambda: not self.is_running, idle_timeout=300):
+            line = line.strip()
+            if stream != "stdout" or not line:
+                continue
+            
+            # 检测下载进度
+            if '[download]' in line and '%' in line:
+                try:
+                    # 提取百分比
+                    percent_str = line.split('%')[0].split()[-1]
+                    percent = float(percent_str)
+                    self.report_progress(percent)
+                except:
+                    pass
+                continue
+            
+            print(f"yt-dlp输出: {line}")
+            
+            # 检测下载文件名
+            if 'Destination:' in line:
+                try:
+                    downloaded_file = line.split('Destination:')[1].strip()
+                    self.file_path = downloaded_file
+                    self.record_partial_file(downloaded_file)
+                    print(f"下载文件: {downloaded_file}")
+                    self.report_progress(2, f"准备下载: {os.path.basename(downloaded_file)}")
+                except:
+                    pass
+            
+            # 检测下载速度等信息
+            elif 'ETA' in line:
+                try:
+                    eta_parts = line.split('ETA')[1].strip()
+                    self.report_progress(50, f"下载中... ETA: {eta_parts}")
+                except:
+                    pass
+        
+        if not self.is_running:
+            return {"ok": False, "cancelled": True, "error": "下载已取消"}
+        if supervisor.wait(5) == 0:
+            return {"ok": True}
+        supervisor.cancel()
+        return {"ok": False, "error": supervisor.stderr_text() or "yt-dlp没有正常退出"}
+    
     def stop(self):
         """安全停止下载过程"""
         self.is_running = False
 
+# 命令行模式下多个工作线程会同时创建下载线程，预解析器在锁内创建，避免建出两个
+_metadata_prefetcher_lock = threading.Lock()
+
+
 class AcfunDownloaderPlugin(PluginBase):
     """A站视频下载插件 - 使用yt-dlp下载AcFun视频"""
     
@@ -136,6 +872,14 @@ class AcfunDownloaderPlugin(PluginBase):
         self.description = "使用yt-dlp命令下载AcFun视频，界面美观，使用简单"
         self.author = "YT下载器团队"
         self.app = app_instance
+        self.max_concurrent_downloads = 3  # 同时运行的下载线程数
+        self.progress_update_hz = 5  # 每秒刷新下载进度的次数
+        self.skip_downloaded = True  # 跳过已下载记录中存在的视频
+        self.download_engine = "native"  # "native": 内置HLS分片并行下载, "ytdlp": 交给yt-dlp
+        self.hls_connections = 8  # 内置下载器并行下载的分片数
+        self.time_budget_minutes = 0  # 自适应画质的下载时限(分钟)，0为关闭
+        self.download_queue = None
+        self.prefetch_urls = []  # 输入框中正在预解析的链接
         
     def initialize(self):
         """初始化插件"""
@@ -232,10 +976,13 @@ class AcfunDownloaderPlugin(PluginBase):
                 "无法找到yt-dlp，这是下载AcFun视频所必需的。\n\n"
                 "请安装yt-dlp: pip install yt-dlp -U")
             return
+        
+        # 提前启动yt-dlp工作进程，第一个下载无需等待yt-dlp导入
+        get_ytdlp_pool().prewarm(1)
             
         dialog = QDialog(self.app)
         dialog.setWindowTitle("A站视频下载")
-        dialog.resize(520, 320)
+        dialog.resize(620, 560)
         # 去除右上角的问号按钮
         dialog.setWindowFlags(dialog.windowFlags() & ~Qt.WindowContextHelpButtonHint)
         # 设置窗口样式
@@ -300,24 +1047,72 @@ class AcfunDownloaderPlugin(PluginBase):
         form_layout.setSpacing(10)
         
         # URL输入框
-        self.url_input = QLineEdit()
-        self.url_input.setText("")
-        self.url_input.setPlaceholderText("请输入AcFun视频链接")
+        self.url_input = QPlainTextEdit()
+        self.url_input.setPlaceholderText("请输入AcFun视频链接，每行一个，可一次粘贴多个；番剧和多P视频可选择要下载的剧集")
         self.url_input.setStyleSheet("""
-            QLineEdit {
+            QPlainTextEdit {
                 border: 1px solid #CCCCCC;
                 border-radius: 4px;
                 padding: 5px;
                 background-color: white;
                 selection-background-color: #FD4C5D;
             }
-            QLineEdit:focus {
+            QPlainTextEdit:focus {
                 border: 1px solid #FD4C5D;
             }
         """)
-        self.url_input.setMinimumHeight(28)
+        self.url_input.setFixedHeight(80)
         form_layout.addRow("视频链接:", self.url_input)
         
+        # 粘贴链接后稍等片刻再预解析，输入过程中不重复请求
+        self.metadata_label = QLabel()
+        self.metadata_label.setWordWrap(True)
+        self.metadata_label.setStyleSheet("color: #666666;")
+        self.metadata_label.setVisible(False)
+        form_layout.addRow("", self.metadata_label)
+        self.prefetch_urls = []
+        self.prefetch_timer = QTimer(dialog)
+        self.prefetch_timer.setSingleShot(True)
+        self.prefetch_timer.setInterval(400)
+        self.prefetch_timer.timeout.connect(self.prefetch_pasted_urls)
+        self.url_input.textChanged.connect(self.prefetch_timer.start)
+        
+        import_btn = QPushButton("从文件导入...")
+        import_btn.setStyleSheet("padding: 4px 10px; font-weight: normal;")
+        import_btn.clicked.connect(self.import_urls_from_file)
+        
+        # 把已有下载目录中的视频登记到已下载记录
+        scan_btn = QPushButton("索引已有目录...")
+        scan_btn.setStyleSheet("padding: 4px 10px; font-weight: normal;")
+        scan_btn.clicked.connect(self.scan_download_archive)
+        
+        import_layout = QHBoxLayout()
+        import_layout.addWidget(import_btn)
+        import_layout.addWidget(scan_btn)
+        form_layout.addRow("", import_layout)
+        
+        self.skip_downloaded_check = QCheckBox("跳过已下载的视频")
+        self.skip_downloaded_check.setChecked(self.skip_downloaded)
+        self.skip_downloaded_check.toggled.connect(lambda checked: setattr(self, "skip_downloaded", checked))
+        form_layout.addRow("", self.skip_downloaded_check)
+        
+        # 同时下载数
+        self.concurrent_spin = QSpinBox()
+        self.concurrent_spin.setRange(1, 16)
+        self.concurrent_spin.setValue(self.max_concurrent_downloads)
+        self.concurrent_spin.valueChanged.connect(self.on_concurrent_changed)
+        form_layout.addRow("同时下载数:", self.concurrent_spin)
+        
+        # 自适应画质：先测量实际吞吐量，选出能在时限内下完的最高画质
+        self.time_budget_spin = QSpinBox()
+        self.time_budget_spin.setRange(0, 24 * 60)
+        self.time_budget_spin.setSpecialValueText("关闭")
+        self.time_budget_spin.setSuffix(" 分钟")
+        self.time_budget_spin.setToolTip("每个视频的下载时限，开启后按实测网速自动降低画质（仅内置下载引擎）")
+        self.time_budget_spin.setValue(self.time_budget_minutes)
+        self.time_budget_spin.valueChanged.connect(lambda value: setattr(self, "time_budget_minutes", value))
+        form_layout.addRow("自适应时限:", self.time_budget_spin)
+        
         layout.addWidget(form_group)
         
         # 进度显示
@@ -325,6 +1120,18 @@ class AcfunDownloaderPlugin(PluginBase):
         progress_layout = QVBoxLayout(progress_group)
         progress_layout.setContentsMargins(15, 20, 15, 15)
         
+        # 下载队列
+        self.queue_table = QTableWidget()
+        self.queue_table.setColumnCount(3)
+        self.queue_table.setHorizontalHeaderLabels(["链接", "进度", "状态"])
+        self.queue_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.queue_table.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeToContents)
+        self.queue_table.horizontalHeader().setSectionResizeMode(2, QHeaderView.Stretch)
+        self.queue_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.queue_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        progress_layout.addWidget(self.queue_table)
+        self.queue_rows = {}
+        
         self.progress_bar = QProgressBar()
         self.progress_bar.setValue(0)
         self.progress_bar.setMinimumHeight(20)
@@ -418,43 +1225,296 @@ class AcfunDownloaderPlugin(PluginBase):
         layout.addWidget(version_label)
         
         self.download_dialog = dialog
+        self.resume_unfinished_downloads()
         dialog.exec_()
         
-    def start_download(self):
-        """开始下载AcFun视频"""
-        url = self.url_input.text().strip()
-        if not url:
-            QMessageBox.warning(None, "输入错误", "请输入有效的AcFun视频链接")
+    def import_urls_from_file(self):
+        """从文本文件导入链接列表"""
+        from PyQt5.QtWidgets import QFileDialog
+        
+        file_path, _ = QFileDialog.getOpenFileName(None, "选择链接列表文件", "", "文本文件 (*.txt);;所有文件 (*)")
+        if not file_path:
             return
-            
+        try:
+            with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+                urls = parse_url_list(f.read())
+            if urls:
+                existing = self.url_input.toPlainText().strip()
+                self.url_input.setPlainText("\n".join(([existing] if existing else []) + urls))
+            self.status_label.setText(f"已从文件导入 {len(urls)} 个链接")
+        except Exception as e:
+            QMessageBox.warning(None, "导入失败", f"读取链接文件失败: {e}")
+    
+    def get_metadata_prefetcher(self):
+        """获取链接预解析器，不存在时创建"""
+        with _metadata_prefetcher_lock:
+            if getattr(self, 'metadata_prefetcher', None) is None:
+                self.metadata_prefetcher = MetadataPrefetcher(prefetch_video_metadata, video_key_from_url)
+                self.metadata_prefetcher.metadata_ready.connect(self.on_metadata_ready)
+            return self.metadata_prefetcher
+    
+    def prefetch_pasted_urls(self):
+        """在后台预解析输入框中的前几个AcFun链接"""
+        self.prefetch_urls = [url for url in parse_url_list(self.url_input.toPlainText())
+                              if 'acfun.cn' in url][:PREFETCH_LIMIT]
+        if self.prefetch_urls:
+            self.get_metadata_prefetcher().prefetch(self.prefetch_urls)
+        self.refresh_metadata_label()
+    
+    def on_metadata_ready(self, key, result):
+        """预解析完成，刷新输入框下方的视频信息"""
+        if any(video_key_from_url(url) == key for url in self.prefetch_urls):
+            self.refresh_metadata_label()
+    
+    def refresh_metadata_label(self):
+        """在输入框下方逐行显示预解析到的标题、时长、预计大小和可选画质"""
+        lines = []
+        for url in self.prefetch_urls:
+            result = self.get_metadata_prefetcher().peek(url)
+            if result is None:
+                lines.append(f"正在解析 {url} ...")
+            elif result.get("error"):
+                lines.append(f"解析失败 {url}: {result['error'][:80]}")
+            else:
+                lines.append(describe_prefetched_metadata(result))
+        try:
+            self.metadata_label.setText("\n".join(lines))
+            self.metadata_label.setVisible(bool(lines))
+        except RuntimeError:
+            pass  # 对话框已关闭
+    
+    def scan_download_archive(self):
+        """选择目录并在后台索引其中已下载的视频"""
+        from PyQt5.QtWidgets import QFileDialog
+        
+        directory = QFileDialog.getExistingDirectory(None, "选择已有的下载目录")
+        if not directory:
+            return
+        self.archive_scan_thread = ArchiveScanThread(directory)
+        self.archive_scan_thread.scan_complete.connect(self.on_archive_scan_complete)
+        self.archive_scan_thread.start()
+        self.status_label.setText(f"正在索引 {directory} ...")
+    
+    def on_archive_scan_complete(self, indexed, scanned):
+        """目录索引完成"""
+        self.status_label.setText(f"索引完成: 扫描 {scanned} 个视频文件，登记 {indexed} 个可识别的视频")
+    
+    def on_concurrent_changed(self, value):
+        """修改同时下载数"""
+        self.max_concurrent_downloads = value
+        if self.download_queue:
+            self.download_queue.set_max_concurrent(value)
+    
+    def get_download_queue(self):
+        """获取下载队列，不存在时创建"""
+        if self.download_queue is None:
+            # 所有下载线程的进度先汇总，再按固定频率批量刷新界面
+            self.progress_bus = ProgressAggregator(self.progress_update_hz)
+            self.progress_bus.progress_batch.connect(self.on_progress_batch)
+            self.download_queue = DownloadQueue(
+                self.create_download_thread,
+                self.max_concurrent_downloads,
+                key_func=video_key_from_url,
+                progress_bus=self.progress_bus,
+                journal=self.get_download_journal()
+            )
+            self.download_queue.item_added.connect(self.on_queue_item_added)
+            self.download_queue.item_complete.connect(self.on_download_complete)
+            self.download_queue.queue_finished.connect(self.on_queue_finished)
+        return self.download_queue
+    
+    def get_download_journal(self):
+        """获取断点续传任务日志，不存在时创建"""
+        if getattr(self, 'download_journal', None) is None:
+            journal_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings", "download_journal.json")
+            self.download_journal = DownloadJournal(journal_file, "acfun")
+        return self.download_journal
+    
+    def resume_unfinished_downloads(self):
+        """把上次退出时未完成的任务重新加入队列，已下载的部分会继续使用"""
+        resumed = 0
+        for key, entry in self.get_download_journal().unfinished():
+            resumed += len(self.enqueue_urls([entry["url"]], entry.get("options")))
+        if resumed:
+            self.status_label.setText(f"已恢复 {resumed} 个未完成的下载任务")
+            self.cancel_btn.setEnabled(self.get_download_queue().is_busy())
+    
+    def create_download_thread(self, url):
+        """为队列中的单个链接创建下载线程"""
         # 获取输出目录
         output_dir = "downloads"
         if hasattr(self.app, 'download_dir'):
             output_dir = self.app.download_dir
-            
-        # 创建并启动下载线程
-        self.download_thread = AcfunDownloadThread(url, output_dir)
-        self.download_thread.progress_updated.connect(self.update_progress)
-        self.download_thread.download_complete.connect(self.on_download_complete)
+        return AcfunDownloadThread(
+            url, output_dir,
+            bandwidth=get_bandwidth_manager(self.app),
+            archive=get_download_archive(),
+            skip_downloaded=self.skip_downloaded,
+            engine=self.download_engine,
+            connections=self.hls_connections,
+            postprocessor=get_postprocess_pool(self.app),
+            prefetcher=self.get_metadata_prefetcher(),
+            time_budget=self.time_budget_minutes * 60
+        )
         
-        # 更新界面状态
+    def start_download(self):
+        """开始下载AcFun视频，所有链接加入下载队列"""
+        urls = parse_url_list(self.url_input.toPlainText())
+        if not urls:
+            QMessageBox.warning(None, "输入错误", "请输入有效的AcFun视频链接")
+            return
+            
+        self.url_input.clear()
+        # 番剧和多P视频先在后台展开为剧集列表，选择后再加入队列
         self.download_btn.setEnabled(False)
-        self.cancel_btn.setEnabled(True)
-        self.progress_bar.setValue(0)
-        self.status_label.setText("准备下载...")
+        self.status_label.setText("正在解析链接...")
+        self.expand_thread = UrlExpandThread(urls)
+        self.expand_thread.expand_complete.connect(self.on_urls_expanded)
+        self.expand_thread.start()
+    
+    def on_urls_expanded(self, singles, series):
+        """链接展开完成，单个视频直接加入队列，剧集列表让用户选择后加入"""
+        self.download_btn.setEnabled(True)
+        urls = list(singles)
+        episode_urls = []
+        for item in series:
+            episode_urls.extend(self.select_episodes(item))
+        urls.extend(episode_urls)
+        if not urls:
+            self.status_label.setText("没有选择要下载的视频")
+            return
         
-        self.download_thread.start()
+        # 选中的剧集一次性交给预解析器并行解析播放列表，各集的下载线程直接取用解析结果
+        if episode_urls:
+            self.get_metadata_prefetcher().prefetch(episode_urls)
+        queue = self.get_download_queue()
+        added = self.enqueue_urls(urls)
         
-    def update_progress(self, value, message):
-        """更新下载进度"""
-        self.progress_bar.setValue(value)
+        # 更新界面状态
+        skipped = len(urls) - len(added)
+        message = f"已加入 {len(added)} 个下载任务"
+        if skipped:
+            message += f"，忽略 {skipped} 个重复链接"
         self.status_label.setText(message)
+        self.cancel_btn.setEnabled(queue.is_busy())
+    
+    def select_episodes(self, series):
+        """显示剧集列表供用户勾选，返回选中剧集的链接"""
+        dialog = QDialog(self.download_dialog)
+        dialog.setWindowTitle(f"选择剧集 - {series['title']}")
+        dialog.resize(480, 500)
+        dialog.setWindowFlags(dialog.windowFlags() & ~Qt.WindowContextHelpButtonHint)
+        layout = QVBoxLayout(dialog)
+        layout.addWidget(QLabel(f"{series['title']}（共 {len(series['episodes'])} 集）"))
         
-    def on_download_complete(self, success, message, file_path):
-        """下载完成处理"""
-        self.download_btn.setEnabled(True)
+        episode_list = QListWidget()
+        for episode in series["episodes"]:
+            item = QListWidgetItem(episode["title"])
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Checked)
+            item.setData(Qt.UserRole, episode["url"])
+            episode_list.addItem(item)
+        layout.addWidget(episode_list)
+        
+        def set_all(state):
+            for row in range(episode_list.count()):
+                episode_list.item(row).setCheckState(state)
+        
+        buttons_layout = QHBoxLayout()
+        select_all_btn = QPushButton("全选")
+        select_all_btn.clicked.connect(lambda: set_all(Qt.Checked))
+        select_none_btn = QPushButton("全不选")
+        select_none_btn.clicked.connect(lambda: set_all(Qt.Unchecked))
+        ok_btn = QPushButton("下载所选")
+        ok_btn.clicked.connect(dialog.accept)
+        cancel_btn = QPushButton("取消")
+        cancel_btn.clicked.connect(dialog.reject)
+        for button in (select_all_btn, select_none_btn):
+            buttons_layout.addWidget(button)
+        buttons_layout.addStretch()
+        for button in (ok_btn, cancel_btn):
+            buttons_layout.addWidget(button)
+        layout.addLayout(buttons_layout)
+        
+        if dialog.exec_() != QDialog.Accepted:
+            return []
+        return [episode_list.item(row).data(Qt.UserRole) for row in range(episode_list.count())
+                if episode_list.item(row).checkState() == Qt.Checked]
+        
+    def enqueue_urls(self, urls, options=None):
+        """把链接加入下载队列，队列空闲时先清空上一批的显示，返回加入的任务键"""
+        queue = self.get_download_queue()
+        if not queue.is_busy():
+            # 新的一批下载，清空上一批的显示
+            self.queue_table.setRowCount(0)
+            self.queue_rows = {}
+            self.batch_total = 0
+            self.batch_done = 0
+            self.active_percents = {}
+            self.progress_bar.setValue(0)
+        added = queue.add_urls(urls, options)
+        self.batch_total += len(added)
+        return added
+    
+    def on_queue_item_added(self, key, url):
+        """在队列表格中添加一行"""
+        row = self.queue_table.rowCount()
+        self.queue_table.insertRow(row)
+        self.queue_table.setItem(row, 0, QTableWidgetItem(url))
+        self.queue_table.setItem(row, 1, QTableWidgetItem("0%"))
+        self.queue_table.setItem(row, 2, QTableWidgetItem("等待中"))
+        self.queue_rows[key] = row
+        
+    def on_progress_batch(self, batch):
+        """按批次刷新所有正在下载任务的进度"""
+        for key, progress in batch.items():
+            if progress.get("percent") is not None:
+                self.active_percents[key] = progress["percent"]
+            row = self.queue_rows.get(key)
+            if row is None:
+                continue
+            if progress.get("percent") is not None:
+                self.queue_table.item(row, 1).setText(f"{progress['percent']:.0f}%")
+            self.queue_table.item(row, 2).setText(format_progress_message(progress))
+        self.update_total_progress()
+        
+    def update_total_progress(self):
+        """总体进度 = 已完成任务 + 正在下载任务的部分进度"""
+        if self.batch_total:
+            partial = sum(self.active_percents.values()) / 100
+            self.progress_bar.setValue(int((self.batch_done + partial) * 100 / self.batch_total))
+        
+    def on_download_complete(self, key, success, message, file_path):
+        """单个任务下载完成处理"""
+        self.batch_done += 1
+        self.active_percents.pop(key, None)
+        self.update_total_progress()
+        self.status_label.setText(f"已完成 {self.batch_done}/{self.batch_total}")
+        
+        row = self.queue_rows.get(key)
+        if row is not None:
+            self.queue_table.item(row, 1).setText("100%" if success else "-")
+            if success and file_path:
+                self.queue_table.item(row, 2).setText(f"完成: {os.path.basename(file_path)}")
+            else:
+                self.queue_table.item(row, 2).setText(message)
+        self.last_result = (success, message, file_path)
+        
+    def on_queue_finished(self, succeeded, failed):
+        """整个队列完成处理"""
         self.cancel_btn.setEnabled(False)
         
+        if succeeded + failed == 1:
+            self.show_single_result(*self.last_result)
+        elif failed:
+            QMessageBox.warning(None, "下载完成", f"批量下载结束: 成功 {succeeded} 个，失败 {failed} 个")
+            self.status_label.setText(f"下载结束: 成功 {succeeded} 个，失败 {failed} 个")
+        else:
+            QMessageBox.information(None, "下载完成", f"批量下载结束: {succeeded} 个视频已全部下载成功")
+            self.status_label.setText(f"全部下载完成: {succeeded} 个")
+            
+    def show_single_result(self, success, message, file_path):
+        """只有一个任务时显示详细的下载结果"""
         if success:
             # 如果下载成功且有文件路径
             if file_path and os.path.exists(file_path):
@@ -494,10 +1554,9 @@ class AcfunDownloaderPlugin(PluginBase):
             self.progress_bar.setValue(0)
             
     def cancel_download(self):
-        """取消正在进行的下载"""
-        if hasattr(self, 'download_thread') and self.download_thread:
-            self.download_thread.stop()
-            self.download_btn.setEnabled(True)
+        """取消队列中所有下载"""
+        if self.download_queue:
+            self.download_queue.cancel_all()
             self.cancel_btn.setEnabled(False)
             self.status_label.setText("下载已取消")
 
@@ -535,4 +1594,35 @@ class AcfunDownloaderPlugin(PluginBase):
     def on_disable(self):
         """插件被禁用时执行"""
         print("A站下载插件被禁用")
-        self.cleanup_ui()
\ No newline at end of file
+        self.cleanup_ui()
+        # 关闭空闲的yt-dlp工作进程
+        get_ytdlp_pool().shutdown()
+
+
+def main(argv=None):
+    """命令行入口，不需要图形界面: python -m acfun_downloader [链接 ...] [-i 任务文件]"""
+    from types import SimpleNamespace
+    
+    parser = build_headless_parser("python -m acfun_downloader", "无界面批量下载AcFun视频，进度以JSON行输出到标准输出")
+    parser.add_argument("--engine", choices=["native", "ytdlp"], default="native", help="下载引擎")
+    parser.add_argument("--connections", type=int, default=8, help="内置下载器并行下载的分片数")
+    parser.add_argument("--time-budget", type=int, default=0, metavar="MINUTES",
+                        help="自适应画质：每个视频的下载时限(分钟)，按实测网速选择能按时下完的最高画质")
+    args = parser.parse_args(argv)
+    
+    # 复用插件的下载线程创建逻辑
+    plugin = AcfunDownloaderPlugin(SimpleNamespace(download_dir=args.output_dir) if args.output_dir else None)
+    plugin.download_engine = args.engine
+    plugin.hls_connections = args.connections
+    plugin.time_budget_minutes = args.time_budget
+    plugin.skip_downloaded = not args.no_skip
+    
+    journal_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings", "cli_journal.json")
+    return run_headless(
+        args,
+        plugin.create_download_thread,
+        video_key_from_url,
+        journal=DownloadJournal(journal_file, "acfun"),
+        # 完成信号的参数: 成功状态, 消息, 文件路径
+        result_fields=lambda result: {"message": result[1], "path": result[2] if len(result) > 2 else ""}
+    )
@@ -0,0 +1,6 @@
+# python -m bilibili_downloader：无界面的命令行下载入口
+import sys
+
+from .plugin import main
+
+sys.exit(main())
@@ -1,12 +1,42 @@
 # 在 plugins/bilibili_downloader/plugin.py 中
+import os
 import re
+import sys
 import json
-import requests
-from urllib.parse import urlparse, parse_qs
-from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QFormLayout, QLabel, 
-                            QLineEdit, QPushButton, QComboBox, QCheckBox, 
-                            QMessageBox, QProgressBar, QGroupBox, QDialog)
-from PyQt5.QtCore import QThread, pyqtSignal, Qt
+import atexit
+import time
+import struct
+import base64
+import queue
+import threading
+import shutil
+import importlib.util
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs, urlencode
+from PyQt5.QtCore import QThread, QTimer, pyqtSignal, Qt
+
+# 以命令行方式运行（python -m bilibili_downloader）时不导入界面模块，没有图形环境的服务器上也能启动
+if not os.environ.get("DOWNLOADER_HEADLESS"):
+    from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QFormLayout, QLabel, 
+                                QLineEdit, QPushButton, QComboBox, QCheckBox, 
+                                QMessageBox, QProgressBar, QGroupBox, QDialog,
+                                QHBoxLayout, QPlainTextEdit, QSpinBox, QTableWidget,
+                                QTableWidgetItem, QHeaderView, QAbstractItemView,
+                                QListWidget, QListWidgetItem)
+
+# 各插件共用的组件在插件目录下的 downloader_common 包中，先把插件目录加入路径
+PLUGINS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PLUGINS_DIR not in sys.path:
+    sys.path.append(PLUGINS_DIR)
+from downloader_common import (ProcessSupervisor, ytdlp_cli_args, get_ytdlp_pool, format_size,
+                               format_duration, format_progress_message, ProgressAggregator, DownloadJournal,
+                               get_bandwidth_manager, ADAPTIVE_PROBE_SECONDS, get_measured_throughput,
+                               set_measured_throughput, ThroughputMeter, choose_within_budget,
+                               parse_bandwidth_schedule, format_bandwidth_schedule, get_postprocess_pool,
+                               file_sha256, get_download_archive, ArchiveScanThread, parse_url_list,
+                               DownloadQueue, PREFETCH_LIMIT, describe_prefetched_metadata,
+                               MetadataPrefetcher, build_headless_parser, run_headless, BilibiliHttpClient)
 
 # 导入插件基类
 try:
@@ -24,131 +54,1818 @@ except ImportError:
         def set_setting(self, key, value):
             self.settings[key] = value
 
+def video_key_from_url(url):
+    """用视频ID(和分P)作为去重键，同一视频的不同链接形式视为重复"""
+    video_id = extract_video_id_from_url(url)
+    if not video_id:
+        return DownloadQueue.normalize_url(url)
+    page = parse_qs(urlparse(url).query).get('p', ['1'])[0]
+    return video_id if page == '1' else f"{video_id}?p={page}"
+
+
+BILIBILI_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Referer': 'https://www.bilibili.com'
+}
+
+# 共享HTTP客户端每秒最多向 api.bilibili.com 发出的请求数
+API_REQUESTS_PER_SECOND = 20
+
+# 新订阅首次同步默认最多下载的视频数，避免把UP主的全部历史投稿一次加入队列
+SUBSCRIPTION_FIRST_SYNC_LIMIT = 30
+
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """获取插件共享的B站HTTP客户端"""
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = BilibiliHttpClient(BILIBILI_HEADERS, api_rate=API_REQUESTS_PER_SECOND)
+        return _http_client
+
+
+class VideoInfoCache:
+    """B站视频信息和短链接解析结果的磁盘缓存
+
+    条目按最近使用顺序保存，超过 ttl 秒视为过期，超过 max_entries 时淘汰最久未用的条目。
+    键的形式为 "video:BVxxx"、"video:av123" 或 "short:<短链接>"。
+    put 之后延迟 SAVE_DELAY 秒合并写盘，退出时由 flush 写入尚未保存的修改。
+    """
+    SAVE_DELAY = 5.0
+    
+    def __init__(self, cache_file, max_entries=5000, ttl=7 * 24 * 3600):
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # 键 -> {"time": 写入时间, "value": 值}
+        self.dirty = False  # 有尚未写盘的修改
+        self.save_timer = None
+        self.load()
+    
+    def load(self):
+        try:
+            if os.path.exists(self.cache_file):
+                with open(self.cache_file, "r", encoding="utf-8") as f:
+                    self.entries = OrderedDict(json.load(f))
+        except Exception as e:
+            print(f"加载B站视频信息缓存失败: {e}")
+            self.entries = OrderedDict()
+    
+    def save(self):
+        """立即写盘，写临时文件和替换都在锁内完成"""
+        with self.lock:
+            if self.save_timer is not None:
+                self.save_timer.cancel()
+                self.save_timer = None
+            self.dirty = False
+            try:
+                os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+                temp_file = self.cache_file + ".tmp"
+                with open(temp_file, "w", encoding="utf-8") as f:
+                    json.dump(self.entries, f, ensure_ascii=False)
+                os.replace(temp_file, self.cache_file)
+            except Exception as e:
+                print(f"保存B站视频信息缓存失败: {e}")
+    
+    def schedule_save(self):
+        """SAVE_DELAY 秒后写盘，期间的多次修改只写一次"""
+        with self.lock:
+            self.dirty = True
+            if self.save_timer is not None:
+                return
+            self.save_timer = threading.Timer(self.SAVE_DELAY, self.save)
+            self.save_timer.daemon = True
+            self.save_timer.start()
+    
+    def flush(self):
+        """写入尚未保存的修改，程序退出或插件卸载时调用"""
+        if self.dirty:
+            self.save()
+    
+    def get(self, key):
+        """读取未过期的缓存值，不存在或已过期返回None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry["time"] > self.ttl:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry["value"]
+    
+    def put(self, key, value, save=True):
+        with self.lock:
+            self.entries[key] = {"time": time.time(), "value": value}
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+        if save:
+            self.schedule_save()
+
+
+_video_info_cache = None
+_video_info_cache_lock = threading.Lock()
+
+
+def get_video_info_cache():
+    """获取插件共享的视频信息缓存"""
+    global _video_info_cache
+    with _video_info_cache_lock:
+        if _video_info_cache is None:
+            cache_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings", "video_cache.json")
+            _video_info_cache = VideoInfoCache(cache_file)
+            # 延迟写盘的定时器是守护线程，退出前把没写完的修改保存下来
+            atexit.register(_video_info_cache.flush)
+        return _video_info_cache
+
+
+def resolve_short_link(url, save=True):
+    """解析b23.tv短链接，返回跳转后的完整链接，结果会被缓存"""
+    cache = get_video_info_cache()
+    key = f"short:{url.strip().rstrip('/')}"
+    resolved = cache.get(key)
+    if resolved:
+        return resolved
+    try:
+        response = get_http_client().head(url, allow_redirects=True)
+        resolved = response.url
+    except Exception as e:
+        print(f"解析短链接失败: {e}")
+        return None
+    if resolved and 'b23.tv' not in urlparse(resolved).netloc:
+        cache.put(key, resolved, save=save)
+    return resolved
+
+
+def fetch_video_info(video_id, cookies=None, save=True):
+    """获取视频的标题、UP主、aid、cid、分P列表和所属合集，优先使用缓存"""
+    cache = get_video_info_cache()
+    key = f"video:{video_id}"
+    info = cache.get(key)
+    if info and 'season' in info:
+        return info
+    
+    if video_id[:2].lower() == 'av':
+        api_url = f"https://api.bilibili.com/x/web-interface/view?aid={video_id[2:]}"
+    else:
+        api_url = f"https://api.bilibili.com/x/web-interface/view?bvid={video_id}"
+    try:
+        response = get_http_client().get(api_url, cookies=cookies or None)
+        data = response.json()
+    except Exception as e:
+        print(f"获取视频信息失败: {e}")
+        return None
+    
+    if data.get('code') != 0:
+        print(f"获取视频信息失败: {data.get('message')}")
+        return None
+    
+    video = data['data']
+    info = {
+        'title': video['title'],
+        'cover': video['pic'],
+        'author': video['owner']['name'],
+        'owner_mid': video['owner'].get('mid'),
+        'bvid': video.get('bvid'),
+        'aid': video['aid'],
+        'cid': video['cid'],
+        'duration': video.get('duration'),
+        'pages': [
+            {'cid': page['cid'], 'page': page['page'], 'part': page.get('part', ''),
+             'duration': page.get('duration')}
+            for page in video.get('pages') or []
+        ],
+        'season': None
+    }
+    season = video.get('ugc_season')
+    if season:
+        # 合集中全部视频的BV号和标题随view接口一次返回
+        info['season'] = {
+            'id': season.get('id'),
+            'title': season.get('title', ''),
+            'episodes': [
+                {'bvid': episode.get('bvid'), 'aid': episode.get('aid'), 'cid': episode.get('cid'),
+                 'title': episode.get('title', '')}
+                for section in season.get('sections') or []
+                for episode in section.get('episodes') or []
+                if episode.get('bvid')
+            ]
+        }
+    cache.put(key, info, save=save)
+    # 同一视频用另一种ID查询时也能命中缓存
+    other_id = info['bvid'] if video_id[:2].lower() == 'av' else f"av{info['aid']}"
+    if other_id:
+        cache.put(f"video:{other_id}", info, save=save)
+    return info
+
+
+def warm_video_info_cache(urls_or_ids, cookies=None, max_workers=8):
+    """并发预取一批视频的信息（包括解析短链接），返回 视频ID -> 信息 的字典"""
+    from concurrent.futures import ThreadPoolExecutor
+    
+    def resolve(item):
+        video_id = extract_video_id_from_url(item) if '://' in item else item
+        if not video_id and 'b23.tv' in item:
+            resolved = resolve_short_link(item, save=False)
+            video_id = extract_video_id_from_url(resolved) if resolved else None
+        if not video_id:
+            return None, None
+        return video_id, fetch_video_info(video_id, cookies, save=False)
+    
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for video_id, info in executor.map(resolve, urls_or_ids):
+            if video_id and info:
+                results[video_id] = info
+    get_video_info_cache().save()
+    return results
+
+
+def extract_video_id_from_url(url):
+    """从完整的B站视频链接中提取BV号或av号，不做网络请求"""
+    match = re.search(r'bilibili\.com/video/([BbAa][Vv][0-9a-zA-Z]+)', url or "")
+    if not match:
+        return None
+    video_id = match.group(1)
+    return f"av{video_id[2:]}" if video_id[:2].lower() == 'av' else f"BV{video_id[2:]}"
+
+
+def page_number_from_url(url):
+    """链接中 ?p= 指定的分P序号，默认为1"""
+    page = parse_qs(urlparse(url or "").query).get('p', ['1'])[0]
+    return int(page) if page.isdigit() and int(page) > 0 else 1
+
+
+def select_video_page(video_info, page):
+    """返回指定分P的视频信息：cid和时长换成该分P的，多P视频的标题后加上分P名称"""
+    pages = video_info.get('pages') or []
+    if len(pages) < 2:
+        return video_info
+    part = next((item for item in pages if item['page'] == page), pages[0])
+    info = dict(video_info, cid=part['cid'], duration=part.get('duration') or video_info.get('duration'))
+    info['title'] = f"{video_info['title']} P{part['page']:02d} {part.get('part', '')}".strip()
+    return info
+
+
+def expand_video_parts(video_id, video_info):
+    """多P视频展开为各分P，属于合集的视频展开为合集中的全部视频
+
+    返回 {"title", "episodes": [{"url", "title"}]}，无需展开时返回None。
+    """
+    pages = video_info.get('pages') or []
+    if len(pages) > 1:
+        return {
+            "title": video_info['title'],
+            "episodes": [
+                {"url": f"https://www.bilibili.com/video/{video_id}?p={page['page']}",
+                 "title": f"P{page['page']:02d} {page.get('part', '')}".strip()}
+                for page in pages
+            ]
+        }
+    season = video_info.get('season')
+    if season and len(season.get('episodes') or []) > 1:
+        return {
+            "title": season['title'],
+            "episodes": [
+                {"url": f"https://www.bilibili.com/video/{episode['bvid']}", "title": episode['title']}
+                for episode in season['episodes']
+            ]
+        }
+    return None
+
+
+class PartExpandThread(QThread):
+    """在后台一次性并发获取所有链接的视频信息，把多P视频和合集展开为分P列表"""
+    expand_complete = pyqtSignal(list, list)  # 无需展开的链接, 分P列表 [{"title", "episodes"}]
+    
+    def __init__(self, urls, cookies=None):
+        super().__init__()
+        self.urls = urls
+        self.cookies = cookies
+    
+    def run(self):
+        # 已指定分P的链接不再展开
+        candidates = [url for url in self.urls if 'p=' not in urlparse(url).query]
+        try:
+            infos = warm_video_info_cache(candidates, self.cookies)
+        except Exception as e:
+            print(f"获取视频信息失败: {e}")
+            infos = {}
+        
+        singles, series = [], []
+        for url in self.urls:
+            video_id = extract_video_id_from_url(url) if url in candidates else None
+            if video_id is None and url in candidates and 'b23.tv' in url:
+                resolved = resolve_short_link(url)
+                video_id = extract_video_id_from_url(resolved) if resolved else None
+            expanded = expand_video_parts(video_id, infos[video_id]) if video_id in infos else None
+            if expanded:
+                series.append(expanded)
+            else:
+                singles.append(url)
+        self.expand_complete.emit(singles, series)
+
+
+# WBI签名用的密钥重排表，见 https://socialsisteryi.github.io/bilibili-API-collect/docs/misc/sign/wbi.html
+MIXIN_KEY_ENC_TAB = [
+    46, 47, 18, 2, 53, 8, 23, 32, 15, 50, 10, 31, 58, 3, 45, 35, 27, 43, 5, 49,
+    33, 9, 42, 19, 29, 28, 14, 39, 12, 38, 41, 13, 37, 48, 7, 16, 24, 55, 40,
+    61, 26, 17, 0, 1, 60, 51, 30, 4, 22, 25, 54, 21, 56, 59, 6, 63, 57, 62, 11,
+    36, 20, 34, 44, 52
+]
+WBI_KEYS_TTL = 3600  # 密钥每天更换，缓存1小时
+
+_wbi_keys = None
+_wbi_keys_time = 0
+_wbi_keys_lock = threading.Lock()
+
+
+def get_wbi_keys(cookies=None):
+    """从nav接口获取WBI签名的 img_key 和 sub_key，多个线程同时调用时只请求一次"""
+    global _wbi_keys, _wbi_keys_time
+    with _wbi_keys_lock:
+        if _wbi_keys and time.time() - _wbi_keys_time < WBI_KEYS_TTL:
+            return _wbi_keys
+        # 未登录时 code 为 -101，但 wbi_img 照常返回
+        response = get_http_client().get("https://api.bilibili.com/x/web-interface/nav", cookies=cookies or None)
+        wbi_img = (response.json().get('data') or {}).get('wbi_img') or {}
+        keys = tuple(os.path.splitext(os.path.basename(wbi_img.get(name) or ""))[0]
+                     for name in ('img_url', 'sub_url'))
+        if not all(keys):
+            raise RuntimeError("获取WBI签名密钥失败")
+        _wbi_keys, _wbi_keys_time = keys, time.time()
+        return keys
+
+
+def sign_wbi(params, cookies=None):
+    """给请求参数加上 wts 和 w_rid 签名，返回新的参数字典"""
+    import hashlib
+    
+    img_key, sub_key = get_wbi_keys(cookies)
+    mixin_key = ''.join((img_key + sub_key)[i] for i in MIXIN_KEY_ENC_TAB)[:32]
+    params = dict(params, wts=int(time.time()))
+    # 按键名排序，并去掉值中的 !'()* 字符
+    params = {key: ''.join(c for c in str(value) if c not in "!'()*") for key, value in sorted(params.items())}
+    params['w_rid'] = hashlib.md5((urlencode(params) + mixin_key).encode('utf-8')).hexdigest()
+    return params
+
+
+# 空间投稿接口缺少这些浏览器指纹参数时容易返回 -352 风控
+SPACE_SEARCH_FINGERPRINT = {
+    "dm_img_list": "[]",
+    "dm_img_str": "V2ViR0wgMS4wIChPcGVuR0wgRVMgMi4wIENocm9taXVtKQ",
+    "dm_cover_img_str": "QU5HTEUgKEludGVsLCBJbnRlbChSKSBVSEQgR3JhcGhpY3MgNjMwIERpcmVjdDNEMTEpR29vZ2xlIEluYy4gKEludGVsKQ",
+    "dm_img_inter": '{"ds":[],"wh":[0,0,0],"of":[0,0,0]}'
+}
+
+
+def iter_space_videos(mid, cookies=None, page_size=30):
+    """按发布时间从新到旧逐页列出UP主的投稿，调用方停止迭代后不再请求下一页"""
+    page = 1
+    while True:
+        params = sign_wbi(dict(SPACE_SEARCH_FINGERPRINT, mid=mid, ps=page_size, pn=page, order="pubdate",
+                               platform="web", web_location=1550101), cookies)
+        data = get_http_client().get("https://api.bilibili.com/x/space/wbi/arc/search",
+                                     params=params, cookies=cookies or None).json()
+        if data.get('code') != 0:
+            raise RuntimeError(f"获取UP主投稿失败: {data.get('message')} ({data.get('code')})")
+        body = data.get('data') or {}
+        videos = (body.get('list') or {}).get('vlist') or []
+        for video in videos:
+            yield {
+                'aid': video.get('aid'),
+                'bvid': video.get('bvid'),
+                'title': video.get('title', ''),
+                'timestamp': video.get('created') or 0,
+                'name': video.get('author'),
+                'valid': True
+            }
+        if not videos or page * page_size >= (body.get('page') or {}).get('count', 0):
+            return
+        page += 1
+
+
+def iter_favorite_videos(media_id, cookies=None, page_size=20):
+    """按收藏时间从新到旧逐页列出收藏夹中的视频，私密收藏夹需要Cookie"""
+    page = 1
+    while True:
+        params = {"media_id": media_id, "pn": page, "ps": page_size, "order": "mtime", "platform": "web"}
+        data = get_http_client().get("https://api.bilibili.com/x/v3/fav/resource/list",
+                                     params=params, cookies=cookies or None).json()
+        if data.get('code') != 0:
+            raise RuntimeError(f"获取收藏夹失败: {data.get('message')} ({data.get('code')})")
+        body = data.get('data') or {}
+        folder = (body.get('info') or {}).get('title')
+        for media in body.get('medias') or []:
+            if media.get('type', 2) != 2:
+                continue  # 只要视频，跳过音频和合集
+            yield {
+                'aid': media.get('id'),
+                'bvid': media.get('bvid') or media.get('bv_id'),
+                'title': media.get('title', ''),
+                'timestamp': media.get('fav_time') or 0,
+                'name': folder,
+                'valid': media.get('attr', 0) == 0  # 已失效的视频 attr 不为0
+            }
+        if not body.get('has_more'):
+            return
+        page += 1
+
+
+def normalize_subscription_source(text):
+    """把UP主空间链接/UID、收藏夹链接/ml号规范为订阅地址，无法识别时返回 None"""
+    text = text.strip()
+    match = re.search(r'(?:[?&]fid=|medialist/(?:detail|play)/ml|^ml)(\d+)', text)
+    if match:
+        return f"https://www.bilibili.com/medialist/detail/ml{match.group(1)}"
+    if 'favlist' in text:
+        return None  # 默认收藏夹的链接不带 fid，需要从收藏夹页面复制带 fid 的链接
+    match = re.match(r'(?:https?://)?space\.bilibili\.com/(\d+)', text) or re.match(r'(?:UID[:：]?\s*)?(\d+)$', text, re.I)
+    if match:
+        return f"https://space.bilibili.com/{match.group(1)}"
+    return None
+
+
+def subscription_video_url(video):
+    """订阅中列出的视频对应的下载链接"""
+    return f"https://www.bilibili.com/video/{video['bvid'] or 'av' + str(video['aid'])}"
+
+
+def iter_subscription_videos(source, cookies=None):
+    """按从新到旧的顺序列出订阅中的视频"""
+    match = re.search(r'/ml(\d+)$', source)
+    if match:
+        return iter_favorite_videos(match.group(1), cookies)
+    return iter_space_videos(source.rstrip('/').rsplit('/', 1)[-1], cookies)
+
+
+class SubscriptionStore:
+    """订阅列表，记录每个UP主空间/收藏夹已同步到的最新视频（游标），保存在JSON文件中
+
+    游标为见过的最新发布（收藏）时间，以及该时间上的aid：同一秒内的多个视频不会被漏掉或重复下载。
+    """
+    
+    def __init__(self, store_file):
+        self.store_file = store_file
+        self.lock = threading.Lock()
+        self.sources = OrderedDict()
+        self.load()
+    
+    def load(self):
+        try:
+            if os.path.exists(self.store_file):
+                with open(self.store_file, "r", encoding="utf-8") as f:
+                    self.sources = OrderedDict(json.load(f).get("sources", {}))
+        except Exception as e:
+            print(f"读取订阅列表失败: {e}")
+            self.sources = OrderedDict()
+    
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.store_file), exist_ok=True)
+            tmp_file = self.store_file + ".tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump({"sources": self.sources}, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, self.store_file)
+        except Exception as e:
+            print(f"保存订阅列表失败: {e}")
+    
+    def add(self, source, options=None):
+        """添加订阅，options 为新视频加入下载队列时使用的清晰度等选项"""
+        with self.lock:
+            if source in self.sources:
+                return False
+            self.sources[source] = {
+                "kind": "favorites" if "/medialist/" in source else "space",
+                "name": None,
+                "options": options or {},
+                "cursor_timestamp": None,
+                "cursor_ids": [],
+                "last_sync": None
+            }
+            self.save()
+            return True
+    
+    def remove(self, source):
+        with self.lock:
+            if self.sources.pop(source, None) is not None:
+                self.save()
+    
+    def get(self, source):
+        with self.lock:
+            entry = self.sources.get(source)
+            return dict(entry) if entry else None
+    
+    def list_sources(self):
+        with self.lock:
+            return list(self.sources.keys())
+    
+    def advance(self, source, videos=None, name=None):
+        """把游标推进到 videos 中最新的视频，videos 为空时只更新名称和同步时间"""
+        with self.lock:
+            entry = self.sources.get(source)
+            if entry is None:
+                return
+            newest = max((video['timestamp'] for video in videos or []), default=None)
+            if newest is not None and newest >= (entry.get("cursor_timestamp") or 0):
+                ids = [video['aid'] for video in videos if video['timestamp'] == newest]
+                if newest == entry.get("cursor_timestamp"):
+                    ids = list(entry.get("cursor_ids") or []) + ids
+                entry["cursor_timestamp"] = newest
+                entry["cursor_ids"] = ids
+            entry["name"] = name or entry.get("name")
+            entry["last_sync"] = int(time.time())
+            self.save()
+
+
+class SubscriptionSyncThread(QThread):
+    """增量同步订阅：只取比游标新的视频，遇到第一个已见过的视频就停止翻页
+
+    各订阅并发同步，接口请求都经过共享HTTP客户端的限速器，订阅再多也不会触发风控。
+    """
+    new_videos = pyqtSignal(str, list)  # 订阅地址, 可下载的新视频（从旧到新），加入下载队列后由接收方推进游标
+    sync_complete = pyqtSignal(int)  # 新视频总数
+    
+    def __init__(self, store, cookies=None, sources=None, max_workers=8,
+                 first_sync_limit=SUBSCRIPTION_FIRST_SYNC_LIMIT):
+        super().__init__()
+        self.store = store
+        self.cookies = cookies
+        self.sources = sources or store.list_sources()
+        self.max_workers = max_workers
+        self.first_sync_limit = first_sync_limit  # 首次同步最多取多少个视频，0为不限
+        self.is_running = True
+    
+    def sync_source(self, source):
+        """同步单个订阅，返回新视频数"""
+        entry = self.store.get(source)
+        if entry is None:
+            return 0
+        cursor = entry.get("cursor_timestamp")
+        cursor_ids = set(entry.get("cursor_ids") or [])
+        limit = self.first_sync_limit if cursor is None else 0
+        found = []
+        name = None
+        try:
+            for video in iter_subscription_videos(source, self.cookies):
+                if not self.is_running:
+                    return 0
+                name = name or video.get('name')
+                if cursor is not None and (video['timestamp'] < cursor
+                                           or (video['timestamp'] == cursor and video['aid'] in cursor_ids)):
+                    break
+                found.append(video)
+                if limit and len(found) >= limit:
+                    break
+        except Exception as e:
+            print(f"同步订阅 {source} 失败: {e}")
+            return 0
+        
+        # 游标不在这里推进：新视频加入下载队列后才推进到其中最新的一个；失效的视频不会下载，
+        # 同一批中有更新的视频入队后游标越过它，之后也不会再同步到
+        videos = [video for video in reversed(found) if video['valid']]
+        self.store.advance(source, None, name)
+        if videos:
+            self.new_videos.emit(source, videos)
+        print(f"订阅 {name or source} 同步完成，新视频 {len(videos)} 个")
+        return len(videos)
+    
+    def run(self):
+        total = 0
+        # 各订阅互不依赖，并行列出
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for count in executor.map(self.sync_source, self.sources):
+                total += count
+        self.sync_complete.emit(total)
+    
+    def stop(self):
+        self.is_running = False
+
+
+class DownloadCancelled(Exception):
+    """下载被用户取消"""
+
+
+class MirrorTooSlow(Exception):
+    """当前镜像的吞吐量骤降，需要换用下一个镜像"""
+
+
+class RangedDownloader:
+    """多连接分段下载器
+
+    先用 Range: bytes=0-0 探测文件大小并预分配目标文件，再把文件切成固定大小的分块，
+    由 connections 个线程各自用HTTP Range请求并行下载、直接写入对应偏移。
+    服务器不支持Range时退化为单连接顺序下载。分块失败时从已写入的位置续传重试。
+    传入上次已完成的分块起始位置 completed 时保留已有文件，只下载剩余分块。
+    
+    传入备用镜像 backup_urls 时，请求出错或某个连接的吞吐量降到本镜像单连接最高吞吐量的
+    1/SLOW_RATIO 以下，就换用下一个镜像，从已写入的位置继续。mirror_rate(url) 返回镜像测速时的
+    吞吐量，镜像在测速之后才变慢、一开始就达不到时也能换掉。
+    """
+    CHUNK_SIZE = 4 * 1024 * 1024
+    SLOW_RATIO = 5
+    SLOW_WINDOW = 3  # 每个连接每隔这么多秒（不含限速等待）检查一次吞吐量
+    
+    def __init__(self, client=None, headers=None, connections=4, chunk_size=CHUNK_SIZE,
+                 max_retries=3, should_stop=None, on_bytes=None, throttle=None, on_failover=None, mirror_rate=None):
+        self.client = client or get_http_client()
+        self.headers = dict(headers or {})
+        self.connections = max(1, int(connections))
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.should_stop = should_stop or (lambda: False)
+        self.on_bytes = on_bytes or (lambda count: None)
+        self.throttle = throttle or (lambda count: None)  # 带宽限速，超速时阻塞
+        self.on_failover = on_failover or (lambda old_url, new_url, rate: None)  # rate 为None表示请求出错
+        self.mirror_rate = mirror_rate or (lambda url: None)
+        self.mirror_lock = threading.Lock()
+        self.urls = []  # 当前下载的镜像地址，按优先顺序
+        self.url_index = 0
+        self.best_rate = 0  # 当前镜像上测得的单连接最高吞吐量
+        self.probed_rate = 0  # 当前镜像测速时的吞吐量
+    
+    def probe(self, url):
+        """返回 (文件大小, 是否支持Range)，无法获知大小时文件大小为None"""
+        response = self.client.get(url, headers=dict(self.headers, Range="bytes=0-0"), stream=True)
+        try:
+            if response.status_code == 206:
+                content_range = response.headers.get("Content-Range", "")
+                total = content_range.rsplit("/", 1)[-1]
+                if total.isdigit():
+                    return int(total), True
+            response.raise_for_status()
+            length = response.headers.get("Content-Length")
+            return (int(length) if length and length.isdigit() else None), False
+        finally:
+            response.close()
+    
+    def download(self, url, path, size=None, supports_range=None, completed=None, on_chunk_done=None,
+                 backup_urls=None):
+        """下载到 path，返回文件大小；每完成一个分块调用 on_chunk_done(分块起始位置)"""
+        self.urls = [url] + [backup for backup in backup_urls or () if backup != url]
+        self.url_index = 0
+        self.best_rate = 0
+        self.probed_rate = self.mirror_rate(url) or 0
+        if size is None or supports_range is None:
+            size, supports_range = self.probe(url)
+        if not supports_range or not size:
+            return self._download_single(url, path)
+        
+        completed = set(completed or ())
+        if not completed or not os.path.exists(path) or os.path.getsize(path) != size:
+            # 预分配文件，各连接直接写入自己的偏移位置
+            completed = set()
+            with open(path, "wb") as f:
+                f.truncate(size)
+        
+        chunks = queue.Queue()
+        for start in range(0, size, self.chunk_size):
+            if start not in completed:
+                chunks.put((start, min(start + self.chunk_size, size) - 1))
+        errors = []
+        
+        def worker():
+            while not errors:
+                try:
+                    start, end = chunks.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    self._fetch_range(path, start, end)
+                except Exception as e:
+                    errors.append(e)
+                    return
+                if on_chunk_done:
+                    on_chunk_done(start)
+        
+        workers = [threading.Thread(target=worker, daemon=True)
+                   for _ in range(min(self.connections, chunks.qsize()))]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return size
+    
+    def completed_bytes(self, size, completed):
+        """已完成分块的总字节数"""
+        return sum(min(self.chunk_size, size - start) for start in completed if 0 <= start < size)
+    
+    def current_url(self):
+        """返回 (当前镜像地址, 是否还有备用镜像)"""
+        with self.mirror_lock:
+            return self.urls[self.url_index], self.url_index + 1 < len(self.urls)
+    
+    def failover(self, url, reason, rate=None):
+        """换用下一个镜像，返回之后是否应使用新的镜像（其他连接已经换过时同样返回True）"""
+        with self.mirror_lock:
+            if self.urls[self.url_index] != url:
+                return True
+            if self.url_index + 1 >= len(self.urls):
+                return False
+            self.url_index += 1
+            self.best_rate = 0
+            new_url = self.urls[self.url_index]
+            self.probed_rate = self.mirror_rate(new_url) or 0
+        print(f"镜像 {urlparse(url).netloc} {reason}，换用 {urlparse(new_url).netloc}")
+        self.on_failover(url, new_url, rate)
+        return True
+    
+    def check_throughput(self, url, rate):
+        """记录一个连接最近的吞吐量，比当前镜像的最高吞吐量低得多时换用下一个镜像"""
+        with self.mirror_lock:
+            self.best_rate = max(self.best_rate, rate)
+            # 测速是单连接的，多个连接可能共享同一条带宽，按连接数折算
+            collapsed = rate * self.SLOW_RATIO < max(self.best_rate, self.probed_rate / self.connections)
+        if collapsed and self.failover(url, f"吞吐量降到 {format_size(rate)}/s", rate):
+            raise MirrorTooSlow()
+    
+    def _fetch_range(self, path, start, end):
+        offset = start
+        attempt = 0
+        while True:
+            url, has_backup = self.current_url()
+            try:
+                # 还有备用镜像时请求出错不在原地重试，直接换镜像
+                response = self.client.get(url, headers=dict(self.headers, Range=f"bytes={offset}-{end}"), stream=True,
+                                           **({"max_retries": 0} if has_backup else {}))
+                try:
+                    if response.status_code != 206:
+                        raise IOError(f"服务器未返回分段内容，状态码: {response.status_code}")
+                    with open(path, "r+b") as f:
+                        f.seek(offset)
+                        window_start, window_bytes, throttled = time.time(), 0, 0.0
+                        for data in response.iter_content(64 * 1024):
+                            if self.should_stop():
+                                raise DownloadCancelled()
+                            f.write(data)
+                            offset += len(data)
+                            self.on_bytes(len(data))
+                            throttle_start = time.time()
+                            self.throttle(len(data))
+                            throttled += time.time() - throttle_start
+                            # 限速等待的时间不计入，其他任务加入导致份额变小时不会误判为镜像变慢
+                            window_bytes += len(data)
+                            elapsed = time.time() - window_start - throttled
+                            if elapsed >= self.SLOW_WINDOW:
+                                self.check_throughput(url, window_bytes / elapsed)
+                                window_start, window_bytes, throttled = time.time(), 0, 0.0
+                finally:
+                    response.close()
+                if offset > end:
+                    return
+                raise IOError(f"分段 {start}-{end} 数据不完整")
+            except DownloadCancelled:
+                raise
+            except MirrorTooSlow:
+                continue  # 已换用下一个镜像，立即从已写入的位置继续，不计入重试次数
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                print(f"分段 {start}-{end} 下载失败，从 {offset} 处重试: {e}")
+                if not self.failover(url, "请求失败"):
+                    time.sleep(1 + attempt)
+                attempt += 1
+    
+    def _download_single(self, url, path):
+        response = self.client.get(url, headers=self.headers, stream=True)
+        written = 0
+        try:
+            response.raise_for_status()
+            with open(path, "wb") as f:
+                for data in response.iter_content(64 * 1024):
+                    if self.should_stop():
+                        raise DownloadCancelled()
+                    f.write(data)
+                    written += len(data)
+                    self.on_bytes(len(data))
+                    self.throttle(len(data))
+        finally:
+            response.close()
+        return written
+
+
+# 镜像测速：对每个CDN主机发一个这么多字节的Range请求，结果按主机缓存 MIRROR_RANK_TTL 秒
+MIRROR_PROBE_BYTES = 256 * 1024
+MIRROR_PROBE_TIMEOUT = 5
+MIRROR_RANK_TTL = 600
+
+
+class MirrorSelector:
+    """B站CDN镜像测速和排序
+
+    playurl接口为每个流返回 baseUrl 和若干 backupUrl，分布在不同的CDN主机上，速度可能相差十倍。
+    rank() 并发地对尚未测过（或结果已过期）的主机各发一个短的Range请求，记录首字节时间和吞吐量，
+    按下载一个分块的预计用时从快到慢排序。同一主机上不同视频的地址只是签名不同，所以测速结果按主机缓存。
+    下载中途换掉的镜像由 demote() 记下，缓存过期前其他任务也不再优先使用它。
+    """
+    
+    def __init__(self, client=None, headers=None, ttl=MIRROR_RANK_TTL, probe_bytes=MIRROR_PROBE_BYTES,
+                 timeout=MIRROR_PROBE_TIMEOUT, chunk_size=RangedDownloader.CHUNK_SIZE):
+        self.client = client or get_http_client()
+        self.headers = dict(headers or {})
+        self.ttl = ttl
+        self.probe_bytes = probe_bytes
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock()
+        self.hosts = {}  # 主机 -> {"time": 测速时间, "ttfb": 首字节时间, "rate": 字节/秒} 或 {"time", "failed": True}
+    
+    def rank(self, urls):
+        """返回按预计速度从快到慢排列的地址列表，没有测速结果的保持接口返回的顺序"""
+        urls = list(dict.fromkeys(urls))
+        if len(urls) < 2:
+            return urls
+        now = time.time()
+        stale = {}
+        with self.lock:
+            for url in urls:
+                host = urlparse(url).netloc
+                entry = self.hosts.get(host)
+                if host not in stale and (entry is None or now - entry["time"] > self.ttl):
+                    stale[host] = url
+        if stale:
+            with ThreadPoolExecutor(max_workers=len(stale)) as executor:
+                results = list(executor.map(self.probe, stale.values()))
+            with self.lock:
+                for host, result in zip(stale, results):
+                    self.hosts[host] = dict(result, time=time.time())
+        with self.lock:
+            scores = {url: self.score(self.hosts.get(urlparse(url).netloc)) for url in urls}
+        return sorted(urls, key=lambda url: scores[url])
+    
+    def score(self, entry):
+        """下载一个分块的预计用时（秒），测速失败的排在最后"""
+        if not entry or entry.get("failed") or not entry.get("rate"):
+            return float("inf")
+        return entry["ttfb"] + self.chunk_size / entry["rate"]
+    
+    def probe(self, url):
+        """下载地址开头的 probe_bytes 字节，返回 {"ttfb", "rate"}，失败返回 {"failed": True}"""
+        start = time.time()
+        first_byte, received = None, 0
+        try:
+            # 不经过重试逻辑：测速时慢或出错的镜像直接记为慢或失败
+            response = self.client.session.get(url, headers=dict(self.headers, Range=f"bytes=0-{self.probe_bytes - 1}"),
+                                               stream=True, timeout=self.timeout)
+            try:
+                if response.status_code not in (200, 206):
+                    return {"failed": True}
+                for data in response.iter_content(16 * 1024):
+                    if first_byte is None:
+                        first_byte = time.time()
+                    received += len(data)
+                    if received >= self.probe_bytes or time.time() - start > self.timeout:
+                        break
+            finally:
+                response.close()
+        except Exception as e:
+            print(f"镜像 {urlparse(url).netloc} 测速失败: {e}")
+            return {"failed": True}
+        if first_byte is None:
+            return {"failed": True}
+        return {"ttfb": first_byte - start, "rate": received / max(time.time() - first_byte, 0.001)}
+    
+    def expected_rate(self, url):
+        """镜像所在主机测速得到的吞吐量（字节/秒），没有有效结果时返回None"""
+        with self.lock:
+            entry = self.hosts.get(urlparse(url).netloc)
+        if not entry or entry.get("failed") or time.time() - entry["time"] > self.ttl:
+            return None
+        return entry["rate"]
+    
+    def demote(self, url, rate=None):
+        """下载中途换掉的镜像：记为测得的吞吐量，没有吞吐量（请求出错）时记为失败"""
+        entry = {"ttfb": 0.0, "rate": rate} if rate else {"failed": True}
+        with self.lock:
+            self.hosts[urlparse(url).netloc] = dict(entry, time=time.time())
+
+
+_mirror_selector = None
+_mirror_selector_lock = threading.Lock()
+
+
+def get_mirror_selector():
+    """获取插件共享的CDN镜像测速器"""
+    global _mirror_selector
+    with _mirror_selector_lock:
+        if _mirror_selector is None:
+            _mirror_selector = MirrorSelector(headers={'Referer': 'https://www.bilibili.com'})
+        return _mirror_selector
+
+
+# B站清晰度代码(qn) -> 名称
+QUALITY_NAMES = {
+    127: "8K", 126: "杜比视界", 125: "HDR", 120: "4K", 116: "1080P60",
+    112: "1080P+", 80: "1080P", 74: "720P60", 64: "720P", 32: "480P", 16: "360P"
+}
+
+# 视频编码 -> DASH流中的codecid，以及各偏好下的选择顺序（HEVC/AV1 同画质下体积明显更小）
+CODEC_IDS = {"avc": 7, "hevc": 12, "av1": 13}
+CODEC_NAMES = {7: "AVC", 12: "HEVC", 13: "AV1"}
+CODEC_PREFERENCE = {"hevc": (12, 13, 7), "av1": (13, 12, 7), "avc": (7, 12, 13)}
+
+# 交给yt-dlp时各codecid对应的格式过滤条件
+YTDLP_CODEC_FILTERS = {7: "[vcodec^=avc]", 12: "[vcodec~='^(hev|hvc)']", 13: "[vcodec^=av01]"}
+
+
+def ytdlp_format_selector(quality, codec):
+    """生成与内置下载器相同选择规则的yt-dlp格式表达式
+
+    先取不超过所选清晰度(qn)的最高画质，同画质按 CODEC_PREFERENCE 的顺序选编码。
+    yt-dlp 的 vcodec 排序只能指定一个优先编码，无法表达 HEVC > AV1 > AVC 这样的顺序，
+    所以逐个画质、逐个编码列出备选项，yt-dlp 按顺序取第一个存在的格式。
+    """
+    order = CODEC_PREFERENCE.get(codec, CODEC_PREFERENCE["hevc"])
+    choices = [f"bv*[quality={qn}]{YTDLP_CODEC_FILTERS[codec_id]}+ba"
+               for qn in sorted(QUALITY_NAMES, reverse=True) if qn <= quality
+               for codec_id in order]
+    return "/".join(choices + [f"bv*[quality<={quality}]+ba", "bv*+ba", "b"])
+
+
+def fetch_play_streams(video_id, cid, quality=80, cookies=None):
+    """调用playurl接口获取DASH流列表，不是DASH格式或请求失败时返回None"""
+    params = {'cid': cid, 'qn': quality, 'fnval': 4048, 'fnver': 0, 'fourk': 1}
+    if video_id[:2].lower() == 'av':
+        params['avid'] = video_id[2:]
+    else:
+        params['bvid'] = video_id
+    try:
+        response = get_http_client().get("https://api.bilibili.com/x/player/playurl", params=params,
+                                         cookies=cookies or None)
+        data = response.json()
+    except Exception as e:
+        print(f"获取播放地址失败: {e}")
+        return None
+    if data.get('code') != 0:
+        print(f"获取播放地址失败: {data.get('message')}")
+        return None
+    dash = (data.get('data') or {}).get('dash')
+    if not dash or not dash.get('video'):
+        return None
+    return {
+        'video': dash.get('video') or [],
+        'audio': dash.get('audio') or [],
+        'duration': dash.get('duration') or 0,
+        'accept_quality': data['data'].get('accept_quality') or []
+    }
+
+
+def stream_urls(stream):
+    """返回一个DASH流的主地址和备用地址列表"""
+    urls = [stream.get('baseUrl') or stream.get('base_url')]
+    urls.extend(stream.get('backupUrl') or stream.get('backup_url') or [])
+    return [url for url in urls if url]
+
+
+def select_dash_streams(streams, quality, codec="hevc"):
+    """选出不超过所选清晰度的最高画质视频流和码率最高的音频流
+
+    同一画质有多种编码时按 codec 对应的 CODEC_PREFERENCE 顺序选择。
+    """
+    videos = streams['video']
+    candidates = [v for v in videos if v['id'] <= quality] or [min(videos, key=lambda v: v['id'])]
+    best_id = max(v['id'] for v in candidates)
+    same_quality = [v for v in candidates if v['id'] == best_id]
+    order = CODEC_PREFERENCE.get(codec, CODEC_PREFERENCE["hevc"])
+    video = min(same_quality, key=lambda v: (
+        order.index(v.get('codecid')) if v.get('codecid') in order else len(order),
+        -v.get('bandwidth', 0)
+    ))
+    audio = max(streams['audio'], key=lambda a: a.get('bandwidth', 0)) if streams['audio'] else None
+    return video, audio
+
+
+def adaptive_candidates(streams, max_quality, codec, duration):
+    """自适应画质的候选：不超过所选清晰度的各画质 [(qn, 视频流, 音频流, 预计字节数)]，从高到低"""
+    candidates = []
+    for quality in sorted({stream['id'] for stream in streams['video'] if stream['id'] <= max_quality}, reverse=True):
+        video, audio = select_dash_streams(streams, quality, codec)
+        size = estimate_stream_size(video, duration) + (estimate_stream_size(audio, duration) if audio else 0)
+        candidates.append((quality, video, audio, size))
+    return candidates
+
+
+def estimate_stream_size(stream, duration):
+    """估算一个DASH流的字节数：优先使用接口给出的大小，否则按码率×时长计算"""
+    if stream.get('size'):
+        return int(stream['size'])
+    return int(stream.get('bandwidth', 0) * (duration or 0) / 8)
+
+
+def describe_size_estimates(streams, video, audio, duration):
+    """列出所选画质下每种编码的预计下载大小（含音频），例如 1080P: HEVC 约85.2MB, AVC 约140.6MB"""
+    audio_size = estimate_stream_size(audio, duration) if audio else 0
+    sizes = {}
+    for stream in streams['video']:
+        if stream['id'] == video['id']:
+            name = CODEC_NAMES.get(stream.get('codecid'), str(stream.get('codecs', '?')))
+            sizes[name] = min(sizes.get(name, float('inf')), estimate_stream_size(stream, duration) + audio_size)
+    quality_name = QUALITY_NAMES.get(video['id'], str(video['id']))
+    return f"{quality_name}: " + ", ".join(f"{name} 约{format_size(size)}" for name, size in sorted(sizes.items(), key=lambda item: item[1]))
+
+
+def prefetch_video_metadata(url, cookies=None):
+    """粘贴链接后预先获取视频信息（写入信息缓存）和各画质的DASH流列表
+
+    开始下载时下载线程直接使用这里的流列表；预计大小由对话框按当前选择的清晰度和编码计算。
+    """
+    video_id = extract_video_id_from_url(url)
+    if not video_id and 'b23.tv' in url:
+        resolved = resolve_short_link(url)
+        video_id = extract_video_id_from_url(resolved) if resolved else None
+        url = resolved or url
+    if not video_id:
+        return {"error": "无效的B站视频链接"}
+    video_info = fetch_video_info(video_id, cookies)
+    if not video_info:
+        return {"error": "获取视频信息失败"}
+    video_info = select_video_page(video_info, page_number_from_url(url))
+    # 请求最高清晰度，返回的DASH流包含账号可用的全部画质
+    streams = fetch_play_streams(video_id, video_info['cid'], max(QUALITY_NAMES), cookies)
+    qualities = sorted({stream['id'] for stream in streams['video']}, reverse=True) if streams else []
+    if streams:
+        # 顺便测出各CDN镜像的速度，开始下载时直接使用缓存的排序
+        get_mirror_selector().rank(stream_urls(streams['video'][0]))
+    return {
+        "title": video_info['title'],
+        "duration": video_info.get('duration'),
+        "cid": video_info['cid'],
+        "streams": streams,
+        "qualities": [QUALITY_NAMES.get(quality, str(quality)) for quality in qualities]
+    }
+
+
+def mux_streams(video_path, audio_path, output_path, should_stop=None):
+    """用ffmpeg不重新编码地合并视频流和音频流，成功返回True"""
+    cmd = ['ffmpeg', '-y', '-i', video_path]
+    if audio_path:
+        cmd.extend(['-i', audio_path])
+    cmd.extend(['-c', 'copy', '-movflags', '+faststart', output_path])
+    supervisor = ProcessSupervisor(cmd)
+    for _ in supervisor.iter_lines(should_stop=should_stop):
+        pass
+    if supervisor.wait(10) == 0:
+        return True
+    print(f"合并音视频失败: {supervisor.stderr_text()[-500:]}")
+    return False
+
+
+# 仅音频模式的输出格式：m4a 直接封装B站的AAC音轨，opus 由ffmpeg重新编码
+AUDIO_FORMATS = {"m4a": "M4A (AAC，不重新编码)", "opus": "Opus (重新编码，体积更小)"}
+OPUS_BITRATE = "128k"
+
+
+def fetch_cover_image(url):
+    """下载视频封面，返回 (图片数据, MIME类型)，失败返回None"""
+    if not url:
+        return None
+    try:
+        response = get_http_client().get(url.replace("http://", "https://", 1))
+        if response.status_code != 200 or not response.content:
+            return None
+    except Exception as e:
+        print(f"下载封面失败: {e}")
+        return None
+    data = response.content
+    mime = "image/png" if data.startswith(b"\x89PNG") else "image/jpeg"
+    return data, mime
+
+
+def escape_ffmetadata(value):
+    """转义ffmetadata文件中的特殊字符"""
+    return re.sub(r'([=;#\\\n])', r'\\\1', str(value))
+
+
+def flac_picture_block(image, mime):
+    """构造FLAC图片块（类型3为封面），Opus文件的封面以base64写在 METADATA_BLOCK_PICTURE 标签中"""
+    mime = mime.encode("ascii")
+    # 类型, MIME长度, MIME, 描述长度, 宽, 高, 色深, 调色板颜色数, 图片长度, 图片
+    return (struct.pack(">II", 3, len(mime)) + mime
+            + struct.pack(">IIIIII", 0, 0, 0, 0, 0, len(image)) + image)
+
+
+def write_audio_file(audio_path, output_path, metadata, cover=None, should_stop=None):
+    """把DASH音频流写成带标签和封面的m4a或opus文件，成功返回True
+
+    标签通过ffmetadata文件传给ffmpeg，封面图片较大时也不受命令行长度限制；
+    m4a 不重新编码，封面作为 attached_pic 写入；opus 重新编码，封面写入 METADATA_BLOCK_PICTURE。
+    """
+    opus = output_path.lower().endswith(".opus")
+    metadata = {key: value for key, value in metadata.items() if value}
+    if cover and opus:
+        metadata["METADATA_BLOCK_PICTURE"] = base64.b64encode(flac_picture_block(*cover)).decode("ascii")
+    meta_path = output_path + ".ffmeta"
+    cover_path = output_path + (".cover.png" if cover and cover[1] == "image/png" else ".cover.jpg")
+    try:
+        with open(meta_path, "w", encoding="utf-8") as f:
+            f.write(";FFMETADATA1\n")
+            for key, value in metadata.items():
+                f.write(f"{key}={escape_ffmetadata(value)}\n")
+        cmd = ['ffmpeg', '-y', '-i', audio_path, '-i', meta_path]
+        if opus:
+            cmd.extend(['-map', '0:a', '-map_metadata', '1', '-c:a', 'libopus', '-b:a', OPUS_BITRATE])
+        elif cover:
+            with open(cover_path, "wb") as f:
+                f.write(cover[0])
+            cmd.extend(['-i', cover_path, '-map', '0:a', '-map', '2:v', '-map_metadata', '1',
+                        '-c', 'copy', '-disposition:v:0', 'attached_pic', '-movflags', '+faststart'])
+        else:
+            cmd.extend(['-map', '0:a', '-map_metadata', '1', '-c', 'copy', '-movflags', '+faststart'])
+        cmd.append(output_path)
+        supervisor = ProcessSupervisor(cmd)
+        for _ in supervisor.iter_lines(should_stop=should_stop):
+            pass
+        if supervisor.wait(10) == 0:
+            return True
+        print(f"写入音频文件失败: {supervisor.stderr_text()[-500:]}")
+        return False
+    finally:
+        for path in (meta_path, cover_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+# 弹幕分段接口每段覆盖6分钟
+DANMAKU_SEGMENT_SECONDS = 360
+
+
+def read_varint(data, pos):
+    """读取protobuf变长整数，返回 (值, 新位置)"""
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def iter_protobuf_fields(data):
+    """逐个产出protobuf消息的 (字段号, 值)，长度分隔字段的值为bytes"""
+    pos = 0
+    end = len(data)
+    while pos < end:
+        key, pos = read_varint(data, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = read_varint(data, pos)
+        elif wire_type == 2:
+            length, pos = read_varint(data, pos)
+            value = data[pos:pos + length]
+            pos += length
+        elif wire_type == 1:
+            value = int.from_bytes(data[pos:pos + 8], "little")
+            pos += 8
+        elif wire_type == 5:
+            value = int.from_bytes(data[pos:pos + 4], "little")
+            pos += 4
+        else:
+            raise ValueError(f"不支持的protobuf字段类型: {wire_type}")
+        yield field, value
+
+
+# DanmakuElem 的字段号 -> (名称, 是否为字符串)
+DANMAKU_FIELDS = {
+    1: ("id", False), 2: ("progress", False), 3: ("mode", False), 4: ("fontsize", False),
+    5: ("color", False), 6: ("mid_hash", True), 7: ("content", True), 8: ("ctime", False),
+    9: ("weight", False), 11: ("pool", False), 12: ("id_str", True)
+}
+
+
+def parse_danmaku_segment(data):
+    """解析 seg.so 返回的 DmSegMobileReply，返回弹幕字典列表"""
+    comments = []
+    for field, value in iter_protobuf_fields(data):
+        if field != 1:
+            continue
+        comment = {"id": 0, "progress": 0, "mode": 1, "fontsize": 25, "color": 0xFFFFFF,
+                   "mid_hash": "", "content": "", "ctime": 0, "pool": 0}
+        for elem_field, elem_value in iter_protobuf_fields(value):
+            name, is_text = DANMAKU_FIELDS.get(elem_field, (None, False))
+            if name:
+                comment[name] = elem_value.decode("utf-8", "replace") if is_text else elem_value
+        comments.append(comment)
+    return comments
+
+
+def fetch_danmaku(cid, duration, cookies=None, max_workers=8):
+    """并行获取视频全部弹幕分段，去重后按出现时间排序返回"""
+    from concurrent.futures import ThreadPoolExecutor
+    
+    segment_count = max(1, -(-int(duration or 0) // DANMAKU_SEGMENT_SECONDS))
+    client = get_http_client()
+    
+    def fetch(index):
+        response = client.get("https://api.bilibili.com/x/v2/dm/web/seg.so",
+                              params={"type": 1, "oid": cid, "segment_index": index}, cookies=cookies or None)
+        if response.status_code != 200:
+            print(f"获取弹幕分段 {index} 失败，状态码: {response.status_code}")
+            return []
+        return parse_danmaku_segment(response.content)
+    
+    comments = {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, segment_count)) as executor:
+        for segment in executor.map(fetch, range(1, segment_count + 1)):
+            for comment in segment:
+                # 相邻分段边界上的弹幕可能重复返回，按弹幕ID去重
+                comments[comment["id_str"] if comment.get("id_str") else comment["id"]] = comment
+    return sorted(comments.values(), key=lambda comment: (comment["progress"], comment["id"]))
+
+
+def write_danmaku_xml(comments, cid, path):
+    """按B站弹幕XML格式保存"""
+    from xml.sax.saxutils import escape, quoteattr
+    
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<i>',
+             '<chatserver>chat.bilibili.com</chatserver>', f'<chatid>{cid}</chatid>']
+    for comment in comments:
+        # p属性: 出现时间,类型,字号,颜色,发送时间,弹幕池,用户哈希,弹幕ID
+        p = (f"{comment['progress'] / 1000:.5f},{comment['mode']},{comment['fontsize']},{comment['color']},"
+             f"{comment['ctime']},{comment['pool']},{comment['mid_hash']},{comment.get('id_str') or comment['id']}")
+        # 去掉XML不允许的控制字符
+        content = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f]', '', comment['content'])
+        lines.append(f'<d p={quoteattr(p)}>{escape(content)}</d>')
+    lines.append('</i>')
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+
+
+def layout_danmaku(comments, width=1920, height=1080, font_size=38, scroll_duration=8.0,
+                   fixed_duration=4.0, area=1.0):
+    """为弹幕分配轨道，返回 [(弹幕, 开始秒, 结束秒, 轨道类型, 轨道号, 文字宽度)]
+
+    滚动弹幕以相同的速度移动，同一轨道上前一条弹幕的尾部完全进入屏幕后轨道即可复用，
+    因此每条轨道只需一个“空闲时间”。空闲轨道放在按轨道号排序的堆中（总是选最上面的），
+    占用中的轨道放在按空闲时间排序的堆中，按时间顺序处理每条弹幕只需 O(log 轨道数)，
+    总复杂度为排序的 O(n log n)。所有轨道都被占用时丢弃该弹幕，避免重叠。
+    """
+    import heapq
+    
+    track_count = max(1, int(height * area // font_size))
+    speed = width / scroll_duration  # 像素/秒
+    # 轨道类型 -> (空闲轨道堆[轨道号], 占用轨道堆[(空闲时间, 轨道号)])
+    tracks = {kind: (list(range(track_count)), []) for kind in ("scroll", "top", "bottom")}
+    placed = []
+    for comment in sorted(comments, key=lambda comment: comment["progress"]):
+        kind = {1: "scroll", 2: "scroll", 3: "scroll", 4: "bottom", 5: "top"}.get(comment["mode"])
+        if kind is None:
+            continue  # 高级弹幕和代码弹幕不渲染
+        start = comment["progress"] / 1000
+        size = font_size * comment["fontsize"] / 25
+        text_width = sum(size if ord(char) > 0x7F else size / 2 for char in comment["content"])
+        
+        free, busy = tracks[kind]
+        while busy and busy[0][0] <= start:
+            heapq.heappush(free, heapq.heappop(busy)[1])
+        if not free:
+            continue
+        track = heapq.heappop(free)
+        if kind == "scroll":
+            end = start + (width + text_width) / speed
+            release = start + (text_width + size) / speed  # 尾部进入屏幕并留出一个字的间距
+        else:
+            end = release = start + fixed_duration
+        heapq.heappush(busy, (release, track))
+        placed.append((comment, start, end, kind, track, text_width))
+    return placed
+
+
+def format_ass_time(seconds):
+    centiseconds = int(round(seconds * 100))
+    hours, centiseconds = divmod(centiseconds, 360000)
+    minutes, centiseconds = divmod(centiseconds, 6000)
+    secs, centiseconds = divmod(centiseconds, 100)
+    return f"{hours}:{minutes:02d}:{secs:02d}.{centiseconds:02d}"
+
+
+def write_danmaku_ass(comments, path, width=1920, height=1080, font_size=38, font_name="Microsoft YaHei",
+                      alpha=0.8, **layout_options):
+    """把弹幕排版后保存为ASS字幕，返回实际渲染的弹幕数"""
+    placed = layout_danmaku(comments, width, height, font_size, **layout_options)
+    alpha_hex = f"{int(round((1 - alpha) * 255)):02X}"
+    lines = [
+        "[Script Info]",
+        "ScriptType: v4.00+",
+        f"PlayResX: {width}",
+        f"PlayResY: {height}",
+        "WrapStyle: 2",
+        "ScaledBorderAndShadow: yes",
+        "",
+        "[V4+ Styles]",
+        "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, "
+        "Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, "
+        "MarginL, MarginR, MarginV, Encoding",
+        f"Style: Danmaku,{font_name},{font_size},&H{alpha_hex}FFFFFF,&H{alpha_hex}FFFFFF,&H{alpha_hex}000000,"
+        f"&H{alpha_hex}000000,0,0,0,0,100,100,0,0,1,1,0,7,0,0,0,0",
+        "",
+        "[Events]",
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+    ]
+    for comment, start, end, kind, track, text_width in placed:
+        size = font_size * comment["fontsize"] / 25
+        color = comment["color"] & 0xFFFFFF
+        tags = [f"\\c&H{color & 0xFF:02X}{(color >> 8) & 0xFF:02X}{color >> 16:02X}&"]
+        if size != font_size:
+            tags.append(f"\\fs{size:.0f}")
+        if color == 0x000000:
+            tags.append("\\3c&HFFFFFF&")  # 黑色弹幕用白色描边
+        if kind == "scroll":
+            y = track * font_size
+            tags.insert(0, f"\\move({width},{y},{-text_width:.0f},{y})")
+        else:
+            y = track * font_size if kind == "top" else height - (track + 1) * font_size
+            tags.insert(0, f"\\an8\\pos({width // 2},{y})")
+        text = comment["content"].replace("\\", "\\\\").replace("{", "\\{").replace("}", "\\}").replace("\n", "\\N")
+        lines.append(f"Dialogue: 2,{format_ass_time(start)},{format_ass_time(end)},Danmaku,,0,0,0,,"
+                     f"{{{''.join(tags)}}}{text}")
+    with open(path, "w", encoding="utf-8-sig") as f:
+        f.write("\n".join(lines) + "\n")
+    return len(placed)
+
+
 class BilibiliDownloadThread(QThread):
     """B站视频下载线程"""
     progress_updated = pyqtSignal(int, str)
-    download_complete = pyqtSignal(bool, str, str)
+    download_complete = pyqtSignal(bool, str, str)  # 成功状态, 消息（成功时为视频标题）, 文件路径
     
-    def __init__(self, url, quality, output_dir, cookies=None):
+    def __init__(self, url, quality, output_dir, cookies=None, engine="native", connections=4, bandwidth=None,
+                 archive=None, skip_downloaded=True, codec="hevc", download_danmaku=False, postprocessor=None,
+                 prefetcher=None, time_budget=0, audio_only=False, audio_format="m4a"):
         super().__init__()
         self.url = url
-        self.quality = quality
+        self.quality = quality  # B站清晰度代码(qn)
+        self.audio_only = audio_only  # 只下载码率最高的音频流，不下载视频流
+        self.audio_format = audio_format  # 仅音频模式的输出格式，见 AUDIO_FORMATS
+        # 已下载记录按清晰度区分，仅音频的文件单独登记，不会与视频互相跳过
+        self.archive_quality = f"audio-{audio_format}" if audio_only else quality
+        self.codec = codec  # 优先的视频编码: "hevc", "av1" 或 "avc"
         self.output_dir = output_dir
         self.cookies = cookies or {}
+        self.engine = engine  # "native": 内置DASH多连接下载, "ytdlp": 交给yt-dlp
+        self.connections = connections  # 内置下载器每个流的并行连接数
+        self.bandwidth = bandwidth  # BandwidthManager，为None时不限速
+        self.archive = archive  # DownloadArchive，为None时不记录已下载的视频
+        self.skip_downloaded = skip_downloaded  # 已下载过的视频直接跳过
+        self.download_danmaku = download_danmaku  # 同时保存XML和ASS格式的弹幕
+        self.postprocessor = postprocessor  # PostProcessPool，为None时在下载线程中直接合并和计算校验和
+        self.postprocessing = False  # 收尾工作已交给后处理线程池
+        self.prefetcher = prefetcher  # MetadataPrefetcher，粘贴链接时已获取的DASH流列表直接用于下载
+        self.prefetched = None
+        self.time_budget = time_budget  # 自适应画质的时限(秒)，0为固定按所选清晰度下载
+        self.adaptive_choice = None  # 自适应画质探测后选定的画质和测得的吞吐量
+        self.is_running = True
+        self.user_cancelled = False  # 由下载队列在用户取消时设置，此时不再保留临时文件
+        self.progress_bus = None  # 由下载队列设置的ProgressAggregator
+        self.journal = None  # 由下载队列设置的DownloadJournal
+        self.partial_files = []  # yt-dlp写入过的文件，用于清理 .part 临时文件
+        self.job_key = url
 
     def run(self):
         try:
             # 1. 解析视频ID
             video_id = self.extract_video_id(self.url)
             if not video_id:
-                self.progress_updated.emit(0, "无效的B站视频链接")
-                self.download_complete.emit(False, "", "无效的链接")
+                self.report_progress(0, "无效的B站视频链接")
+                self.download_complete.emit(False, "无效的链接", "")
+                return
+            
+            # 分P视频用 "BV号?p=N" 登记，第1P与单P视频相同
+            page = page_number_from_url(self.url)
+            archive_key = video_id if page == 1 else f"{video_id}?p={page}"
+            
+            # 已下载过且文件仍然存在时直接跳过，不再访问网络
+            archived = self.archive.lookup("bilibili", archive_key, self.archive_quality) if self.archive and self.skip_downloaded else None
+            if archived:
+                self.report_progress(100, "已下载过，跳过")
+                self.download_complete.emit(True, archived.get("title") or video_id, archived["path"])
                 return
                 
-            # 2. 获取视频信息
-            self.progress_updated.emit(10, "正在获取视频信息...")
+            # 2. 获取视频信息，多P视频换成链接所指分P的cid和标题
+            self.report_progress(10, "正在获取视频信息...")
+            # 粘贴链接时已开始预解析的，等它完成：视频信息已写入缓存，DASH流列表可直接使用
+            self.prefetched = self.prefetcher.result(self.url) if self.prefetcher else None
             video_info = self.get_video_info(video_id)
             if not video_info:
-                self.progress_updated.emit(0, "获取视频信息失败")
-                self.download_complete.emit(False, "", "获取信息失败")
+                self.report_progress(0, "获取视频信息失败")
+                self.download_complete.emit(False, "获取信息失败", "")
                 return
+            video_info = select_video_page(video_info, page)
+            archive_ids = [video_id, video_info.get('bvid')] if page == 1 else [archive_key]
+                
+            # 3. 优先使用内置DASH下载器，失败时再交给yt-dlp
+            if self.engine == "native":
+                self.report_progress(20, "正在获取播放地址...")
+                downloaded = self.download_native(video_id, video_info, self.output_dir)
+                if not self.is_running:
+                    self.report_progress(0, "下载已取消")
+                    self.download_complete.emit(False, "下载已取消", "")
+                    return
+                if downloaded:
+                    video_path, audio_path, output_path = downloaded
+                    if self.audio_only:
+                        self.run_postprocess(lambda: self.finish_audio(audio_path, output_path, archive_ids, video_info))
+                        return
+                    self.save_danmaku(video_info, output_path)
+                    self.run_postprocess(lambda: self.finish_native(video_path, audio_path, output_path,
+                                                                    archive_ids, video_info['title']))
+                    return
+                print("内置下载器不可用，改用yt-dlp下载")
                 
-            # 3. 获取视频下载链接
-            self.progress_updated.emit(30, "正在获取下载链接...")
-            download_url = self.get_download_url(video_id, self.quality)
+            # 4. 获取视频下载链接
+            self.report_progress(30, "正在获取下载链接...")
+            download_url = self.get_download_url(video_id, self.quality, page)
             if not download_url:
-                self.progress_updated.emit(0, "获取下载链接失败")
-                self.download_complete.emit(False, "", "获取下载链接失败")
+                self.report_progress(0, "获取下载链接失败")
+                self.download_complete.emit(False, "获取下载链接失败", "")
                 return
                 
-            # 4. 下载视频
-            self.progress_updated.emit(50, "开始下载视频...")
+            # 5. 下载视频
+            self.report_progress(50, "开始下载视频...")
             output_path = self.download_video(download_url, video_info['title'], self.output_dir)
             if not output_path:
-                self.progress_updated.emit(0, "下载视频失败")
-                self.download_complete.emit(False, "", "下载失败")
+                self.report_progress(0, "下载视频失败")
+                self.download_complete.emit(False, "下载失败", "")
                 return
                 
-            # 5. 完成下载
-            self.progress_updated.emit(100, "下载完成")
-            self.download_complete.emit(True, output_path, video_info['title'])
+            # 6. 完成下载
+            self.save_danmaku(video_info, output_path)
+            self.run_postprocess(lambda: self.finish_download(archive_ids, output_path, video_info['title']))
             
         except Exception as e:
-            self.progress_updated.emit(0, f"下载出错: {str(e)}")
-            self.download_complete.emit(False, "", str(e))
+            self.report_progress(0, f"下载出错: {str(e)}")
+            self.download_complete.emit(False, str(e), "")
     
     def extract_video_id(self, url):
         """从URL中提取B站视频ID"""
         # 支持 https://www.bilibili.com/video/BV1xx411c7mD/ 格式
-        bv_pattern = r'bilibili\.com/video/([BbAa][Vv][0-9a-zA-Z]+)'
-        match = re.search(bv_pattern, url)
-        if match:
-            return match.group(1)
+        video_id = extract_video_id_from_url(url)
+        if video_id:
+            return video_id
             
-        # 支持 https://b23.tv/xxx 短链接
+        # 支持 https://b23.tv/xxx 短链接，解析结果会被缓存
         if 'b23.tv' in url:
-            try:
-                response = requests.head(url, allow_redirects=True)
-                return self.extract_video_id(response.url)
-            except:
-                pass
+            resolved = resolve_short_link(url)
+            if resolved and 'b23.tv' not in resolved:
+                return self.extract_video_id(resolved)
                 
         return None
         
     def get_video_info(self, video_id):
-        """获取B站视频信息"""
-        try:
-            api_url = f"https://api.bilibili.com/x/web-interface/view?bvid={video_id}"
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                'Referer': 'https://www.bilibili.com'
-            }
-            
-            response = requests.get(api_url, headers=headers, cookies=self.cookies)
-            data = response.json()
-            
-            if data['code'] == 0:
-                return {
-                    'title': data['data']['title'],
-                    'cover': data['data']['pic'],
-                    'author': data['data']['owner']['name'],
-                    'aid': data['data']['aid'],
-                    'cid': data['data']['cid']
-                }
-        except Exception as e:
-            print(f"获取视频信息失败: {e}")
-        
-        return None
+        """获取B站视频信息，重复查询直接使用磁盘缓存"""
+        return fetch_video_info(video_id, self.cookies)
         
-    def get_download_url(self, video_id, quality=0):
+    def get_download_url(self, video_id, quality=0, page=1):
         """获取视频下载链接，直接返回B站视频URL即可，由yt-dlp实际处理"""
-        # 使用通用的视频URL格式，yt-dlp会自动处理真实下载链接的获取
+        # 使用通用的视频URL格式，yt-dlp会自动处理真实下载链接的获取，?p= 指定分P
         try:
+            suffix = f"?p={page}" if page > 1 else ""
             if video_id.startswith(('BV', 'bv')):
-                return f"https://www.bilibili.com/video/{video_id}"
+                return f"https://www.bilibili.com/video/{video_id}{suffix}"
             elif video_id.startswith(('AV', 'av')):
-                return f"https://www.bilibili.com/video/{video_id}"
-            return f"https://www.bilibili.com/video/{video_id}"
+                return f"https://www.bilibili.com/video/{video_id}{suffix}"
+            return f"https://www.bilibili.com/video/{video_id}{suffix}"
         except Exception as e:
             print(f"获取B站下载链接失败: {e}")
             return None
         
-    def download_video(self, url, title, output_dir):
-        """下载视频文件，使用yt-dlp实现实际下载"""
+    def download_native(self, video_id, video_info, output_dir):
+        """调用playurl接口选出DASH音视频流，多连接分段下载到临时文件
+
+        返回 (视频流文件, 音频流文件或None, 合并后的输出路径)，由 finish_native 合并；
+        仅音频模式下视频流文件为None，由 finish_audio 写成音频文件。
+        接口不返回DASH、未安装ffmpeg或下载出错时返回None，由调用方回退到yt-dlp。
+        """
+        if not shutil.which("ffmpeg"):
+            return None
+        prefetched = self.prefetched or {}
+        streams = prefetched.get('streams') if prefetched.get('cid') == video_info['cid'] else None
+        streams = streams or fetch_play_streams(video_id, video_info['cid'], self.quality, self.cookies)
+        if not streams:
+            return None
+        video, audio = select_dash_streams(streams, self.quality, self.codec)
+        if self.audio_only and not audio:
+            return None
+        duration = streams.get('duration') or video_info.get('duration')
+        # 断点续传日志中记录了每个流已完成的分块，大小一致时继续使用已有的临时文件
+        entry = (self.journal.get(self.job_key) if self.journal is not None else None) or {}
+        
+        # 自适应画质：先按上次测得的吞吐量初选，探测期结束后按实测结果定下画质；
+        # 选择结果记入任务日志，续传时沿用，不再重新选择
+        adaptive = None
+        candidates = (adaptive_candidates(streams, self.quality, self.codec, duration)
+                      if self.time_budget and not self.audio_only else [])
+        if candidates:
+            choice = self.adaptive_choice or entry.get("adaptive")
+            if choice and any(candidate[0] == choice.get("quality") for candidate in candidates):
+                quality = choice["quality"]
+            else:
+                choice = None
+                quality = choose_within_budget([(candidate[0], candidate[3]) for candidate in candidates],
+                                               get_measured_throughput("bilibili"), self.time_budget)
+            video, audio = next((v, a) for q, v, a, _ in candidates if q == quality)
+            adaptive = {"candidates": candidates, "decided": choice is not None, "switch": None,
+                        "quality": QUALITY_NAMES.get(quality, str(quality))}
+        
+        # 下载前报告所选画质下各编码的预计大小
+        if self.audio_only:
+            message = f"仅下载音频，预计大小 {format_size(estimate_stream_size(audio, duration))}"
+        else:
+            estimates = describe_size_estimates(streams, video, audio, duration)
+            message = f"预计大小 {estimates}，已选择 {CODEC_NAMES.get(video.get('codecid'), video.get('codecs', ''))}"
+        print(message)
+        self.report_progress(20, message)
+        
+        os.makedirs(output_dir, exist_ok=True)
+        safe_title = re.sub(r'[\\/:*?"<>|]', '_', video_info['title'])
+        output_path = os.path.join(output_dir, f"{safe_title}.{self.audio_format if self.audio_only else 'mp4'}")
+        video_part = None if self.audio_only else output_path + ".video.m4s"
+        audio_part = output_path + ".audio.m4s" if audio else None
+        parts = [(stream, path) for stream, path in ((video, video_part), (audio, audio_part)) if path]
+        
+        progress = {"done": 0, "resumed": 0, "total": 0, "start": time.time()}
+        progress_lock = threading.Lock()
+        meter = ThroughputMeter()
+        
+        def on_bytes(count):
+            with progress_lock:
+                progress["done"] += count
+                done, total = progress["done"], progress["total"]
+            elapsed = max(time.time() - progress["start"], 0.001)
+            speed = (done - progress["resumed"]) / elapsed
+            self.report_progress(
+                done * 100 / total if total else None,
+                downloaded_bytes=done,
+                total_bytes=total,
+                speed=speed,
+                eta=(total - done) / speed if total and speed else None,
+                quality=adaptive["quality"] if adaptive else None
+            )
+        
+        def on_network_bytes(count):
+            on_bytes(count)
+            if adaptive is None or adaptive["decided"]:
+                return
+            meter.add(count)
+            if meter.elapsed() < ADAPTIVE_PROBE_SECONDS:
+                return
+            with progress_lock:
+                if adaptive["decided"]:
+                    return
+                adaptive["decided"] = True
+                done = progress["done"]
+            self.decide_adaptive_quality(adaptive, meter, video['id'], done)
+        
+        should_stop = lambda: not self.is_running or bool(adaptive and adaptive["switch"])
+        selector = get_mirror_selector()
+        
+        def on_failover(old_url, new_url, rate):
+            selector.demote(old_url, rate)
+            self.report_progress(None, f"换用CDN镜像 {urlparse(new_url).netloc}")
+        
+        bandwidth_job = self.bandwidth.register("bilibili", native=True) if self.bandwidth else None
+        downloader = RangedDownloader(
+            headers={'Referer': 'https://www.bilibili.com'},
+            connections=self.connections,
+            should_stop=should_stop,
+            on_bytes=on_network_bytes,
+            throttle=(lambda count: self.bandwidth.throttle("bilibili", count, should_stop)) if self.bandwidth else None,
+            on_failover=on_failover,
+            mirror_rate=selector.expected_rate
+        )
+        segments = entry.get("segments") or {}
+        
+        def chunk_recorder(path):
+            def on_chunk_done(start):
+                with progress_lock:
+                    segments[path]["done"].append(start)
+                    snapshot = json.loads(json.dumps(segments))
+                self.journal_update(path=output_path, segments=snapshot,
+                                    bytes_done=progress["done"], total_bytes=progress["total"])
+            return on_chunk_done
+        
+        downloaded = None
+        discard = False
         try:
-            import os
-            import subprocess
-            import sys
+            # 先探测各个流的大小，便于显示总进度
+            probed = []
+            for stream, path in parts:
+                # 按测速结果从最快的CDN镜像开始，其余镜像留作下载中途换用
+                urls = selector.rank(stream_urls(stream))
+                for index, url in enumerate(urls):
+                    try:
+                        size, supports_range = downloader.probe(url)
+                        break
+                    except Exception as e:
+                        if index == len(urls) - 1:
+                            raise
+                        print(f"镜像 {urlparse(url).netloc} 不可用: {e}")
+                        selector.demote(url)
+                urls = urls[index:]
+                progress["total"] += size or 0
+                previous = segments.get(path) or {}
+                completed = []
+                if size and previous.get("size") == size and os.path.exists(path) and os.path.getsize(path) == size:
+                    completed = previous.get("done", [])
+                segments[path] = {"size": size, "done": list(completed)}
+                probed.append((urls, path, size, supports_range, completed))
             
+            self.journal_update(force=True, path=output_path, segments=json.loads(json.dumps(segments)))
+            progress["start"] = meter.start = time.time()
+            for urls, path, size, supports_range, completed in probed:
+                if completed:
+                    resumed = downloader.completed_bytes(size, completed)
+                    progress["resumed"] += resumed
+                    on_bytes(resumed)
+                downloader.download(urls[0], path, size, supports_range, completed, chunk_recorder(path),
+                                    backup_urls=urls[1:])
+            
+            if adaptive and not adaptive["decided"]:
+                adaptive["decided"] = True
+                self.decide_adaptive_quality(adaptive, meter, video['id'], progress["done"], finished=True)
+            downloaded = (video_part, audio_part, output_path)
+            return downloaded
+        except DownloadCancelled:
+            # 用户取消时不再续传；探测后换画质时已下载的部分也用不上了
+            discard = self.user_cancelled or bool(self.is_running and adaptive and adaptive["switch"])
+            if not self.is_running or not adaptive or not adaptive["switch"]:
+                return None
+        except Exception as e:
+            print(f"内置下载器下载失败: {e}")
+            return None
+        finally:
+            if bandwidth_job is not None:
+                self.bandwidth.unregister(bandwidth_job)
+            if discard:
+                self.remove_files([path for _, path in parts])
+            # 其他情况（出错、程序退出）保留临时文件，下次按任务日志中的分段记录续传
+        
+        # 探测后选定了另一个画质：丢弃已下载的部分，按选定的画质重新下载
+        self.journal_update(force=True, segments=None)
+        return self.download_native(video_id, video_info, output_dir)
+    
+    def decide_adaptive_quality(self, adaptive, meter, current, done, finished=False):
+        """探测期结束：按实测吞吐量选出能在时限内下完的最高画质并记入任务日志，需要换画质时让下载器停下
+
+        finished 为True时下载已在探测期内完成，只记录初选的画质和测得的吞吐量。
+        """
+        rate, per_connection, connections = meter.snapshot()
+        set_measured_throughput("bilibili", rate)
+        options = [(quality, max(size - done, 0) if quality == current else size)
+                   for quality, _, _, size in adaptive["candidates"]]
+        if finished:
+            quality = current
+        else:
+            quality = choose_within_budget(options, rate, self.time_budget - meter.elapsed())
+        expected = meter.elapsed() + dict(options)[quality] / rate if rate else None
+        self.adaptive_choice = {
+            "quality": quality,
+            "rate": int(rate),
+            "per_connection_rate": int(per_connection),
+            "connections": connections,
+            "budget": self.time_budget,
+            "expected_seconds": int(expected) if expected is not None else None
+        }
+        self.journal_update(force=True, adaptive=self.adaptive_choice)
+        adaptive["quality"] = QUALITY_NAMES.get(quality, str(quality))
+        message = (f"自适应画质: {adaptive['quality']} (测得 {format_size(rate)}/s，"
+                   f"每连接 {format_size(per_connection)}/s，预计 {format_duration(expected)} 下完)")
+        print(message)
+        self.report_progress(None, message, adaptive=self.adaptive_choice)
+        if quality != current:
+            adaptive["switch"] = quality
+    
+    def run_postprocess(self, func):
+        """执行下载后的收尾工作（合并音视频、计算校验和），func 负责发出完成信号
+
+        设置了后处理线程池时交给线程池执行，下载线程随即结束、释放下载名额；否则在当前线程中执行。
+        """
+        def task():
+            try:
+                func()
+            except Exception as e:
+                self.report_progress(0, f"后处理出错: {str(e)}")
+                self.download_complete.emit(False, str(e), "")
+        
+        if self.postprocessor is None:
+            task()
+            return
+        self.postprocessing = True
+        self.report_progress(99, "等待后处理...")
+        self.postprocessor.submit(task)
+    
+    def finish_native(self, video_path, audio_path, output_path, archive_ids, title):
+        """后处理：用ffmpeg合并内置下载器下载的音视频流，删除临时文件后完成下载"""
+        muxed = False
+        try:
+            self.report_progress(99, "正在合并音视频...")
+            muxed = mux_streams(video_path, audio_path, output_path, lambda: not self.is_running)
+        finally:
+            # 合并被中断或失败时保留音视频流，续传时不必重新下载
+            if muxed or self.user_cancelled:
+                self.remove_files([video_path, audio_path])
+        if not self.is_running:
+            self.report_progress(0, "下载已取消")
+            self.download_complete.emit(False, "下载已取消", "")
+        elif not muxed:
+            self.report_progress(0, "合并音视频失败")
+            self.download_complete.emit(False, "合并音视频失败", "")
+        else:
+            self.finish_download(archive_ids, output_path, title)
+    
+    def finish_audio(self, audio_path, output_path, archive_ids, video_info):
+        """后处理：把下载的音频流写成带标题、UP主和封面的音频文件，删除临时文件后完成下载"""
+        written = False
+        try:
+            self.report_progress(99, "正在写入音频文件...")
+            metadata = {
+                "title": video_info['title'],
+                "artist": video_info.get('author'),
+                "album": (video_info.get('season') or {}).get('title'),
+                "comment": self.url
+            }
+            cover = fetch_cover_image(video_info.get('cover'))
+            written = write_audio_file(audio_path, output_path, metadata, cover, lambda: not self.is_running)
+        finally:
+            if written or self.user_cancelled:
+                self.remove_files([audio_path])
+        if not self.is_running:
+            self.report_progress(0, "下载已取消")
+            self.download_complete.emit(False, "下载已取消", "")
+        elif not written:
+            self.report_progress(0, "写入音频文件失败")
+            self.download_complete.emit(False, "写入音频文件失败", "")
+        else:
+            self.finish_download(archive_ids, output_path, video_info['title'])
+    
+    def finish_download(self, archive_ids, output_path, title):
+        """后处理：计算校验和并登记已下载记录，然后发出完成信号"""
+        # 内置下载器中途出错后改用yt-dlp下完的，删除内置下载器留下的分段临时文件
+        entry = self.journal.get(self.job_key) if self.journal is not None else None
+        if entry and entry.get("segments"):
+            self.remove_files(list(entry["segments"]))
+        self.archive_download(archive_ids, output_path, title)
+        self.report_progress(100, "下载完成")
+        self.download_complete.emit(True, title, output_path)
+    
+    def remove_files(self, paths):
+        """删除临时文件，失败时只打印错误"""
+        for path in filter(None, paths):
+            if os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    print(f"删除临时文件失败: {e}")
+        
+    def download_video(self, url, title, output_dir):
+        """下载视频文件，优先使用常驻的yt-dlp工作进程，不可用时回退到yt-dlp命令"""
+        try:
             # 创建输出目录
             os.makedirs(output_dir, exist_ok=True)
             
             # 生成安全的文件名
             safe_title = re.sub(r'[\\/:*?"<>|]', '_', title)
-            output_path = os.path.join(output_dir, f"{safe_title}.mp4")
+            output_path = os.path.join(output_dir, f"{safe_title}.{self.audio_format if self.audio_only else 'mp4'}")
             
-            # 构建yt-dlp命令
-            cmd = ["yt-dlp"]
+            options = {
+                "outtmpl": output_path,             # 输出文件路径
+                # 不超过所选清晰度(qn)的最高画质，同画质按编码偏好选择
+                "format": ytdlp_format_selector(self.quality, self.codec),
+                "format_sort": ["quality"],
+                "noplaylist": True,                 # 不作为播放列表下载
+                "merge_output_format": "mp4",       # 合并为mp4格式
+                "nocheckcertificate": True,         # 不检查SSL证书
+                "continuedl": True,                 # 从已有的 .part 文件继续下载
+                "http_headers": {
+                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+                    "Referer": "https://www.bilibili.com/"
+                }
+            }
+            if self.audio_only:
+                # 只下载音频流，转换为所选格式并写入标签和封面；Opus封面需要mutagen
+                postprocessors = [
+                    {"key": "FFmpegExtractAudio", "preferredcodec": self.audio_format},
+                    {"key": "FFmpegMetadata"}
+                ]
+                if self.audio_format != "opus" or importlib.util.find_spec("mutagen"):
+                    postprocessors.append({"key": "EmbedThumbnail"})
+                    options["writethumbnail"] = True
+                options.update({
+                    "outtmpl": os.path.join(output_dir, f"{safe_title}.%(ext)s"),
+                    "format": "ba/b",
+                    "postprocessors": postprocessors
+                })
+                del options["format_sort"], options["merge_output_format"]
             
             # 临时cookie文件路径
             cookie_file_path = None
@@ -166,70 +1883,48 @@ class BilibiliDownloadThread(QThread):
                             cookie_file.write(f".bilibili.com\tTRUE\t/\tFALSE\t0\t{key}\t{value}\n")
                     
                     cookie_file.close()
-                    cmd.extend(["--cookies", cookie_file_path])
+                    options["cookiefile"] = cookie_file_path
                 except Exception as e:
                     print(f"设置cookie失败: {e}")
                     
             try:
-                # 添加其他参数
-                cmd.extend([
-                    url,                       # B站视频URL
-                    "-o", output_path,         # 输出文件路径
-                    "--no-playlist",           # 不作为播放列表下载
-                    "--merge-output-format", "mp4", # 合并为mp4格式
-                    "--no-check-certificate",  # 不检查SSL证书
-                    "--user-agent", "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                    "--referer", "https://www.bilibili.com/"
-                ])
-                
-                self.progress_updated.emit(20, "开始下载...")
+                self.report_progress(20, "开始下载...")
                 
-                # 在Windows下隐藏控制台窗口
-                startupinfo = None
-                if sys.platform == "win32":
-                    startupinfo = subprocess.STARTUPINFO()
-                    startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                
-                # 运行命令下载视频
-                process = subprocess.Popen(
-                    cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    encoding='utf-8',
-                    errors='replace',
-                    startupinfo=startupinfo
-                )
+                # 按带宽管理器分配的份额限速，其他任务开始或结束时份额会重新计算
+                bandwidth_job = self.bandwidth.register("bilibili") if self.bandwidth else None
+                get_ratelimit = (lambda: self.bandwidth.job_rate(bandwidth_job)) if bandwidth_job else None
+                try:
+                    if get_ratelimit:
+                        options["ratelimit"] = get_ratelimit() or None
+                    result = get_ytdlp_pool().run_job(url, options, self.on_ytdlp_event, lambda: not self.is_running,
+                                                      get_ratelimit=get_ratelimit)
+                    if result is None:
+                        result = self.run_ytdlp_command(url, options)
+                finally:
+                    if bandwidth_job is not None:
+                        self.bandwidth.unregister(bandwidth_job)
                 
-                # 监控进度
-                while process.poll() is None:
-                    line = process.stdout.readline().strip()
-                    if line:
-                        print(f"yt-dlp输出: {line}")
-                        if '[download]' in line and '%' in line:
-                            try:
-                                percent = float(line.split('%')[0].split()[-1])
-                                self.progress_updated.emit(int(percent), f"下载中... {percent:.1f}%")
-                            except:
-                                pass
+                if not self.is_running:
+                    self.report_progress(0, "下载已取消")
+                    return None
                 
                 # 检查是否成功
-                if process.returncode == 0:
-                    self.progress_updated.emit(100, "下载完成!")
+                if result.get("ok"):
+                    self.report_progress(100, "下载完成!")
                     if os.path.exists(output_path):
                         return output_path
-                    else:
-                        # 尝试查找可能以不同扩展名下载的文件
-                        base_dir = os.path.dirname(output_path)
-                        base_name = os.path.splitext(os.path.basename(output_path))[0]
-                        for ext in ['.mp4', '.mkv', '.flv', '.webm']:
-                            alt_path = os.path.join(base_dir, f"{base_name}{ext}")
-                            if os.path.exists(alt_path):
-                                return alt_path
+                    if result.get("filepath") and os.path.exists(result["filepath"]):
+                        return result["filepath"]
+                    # 尝试查找可能以不同扩展名下载的文件
+                    base_dir = os.path.dirname(output_path)
+                    base_name = os.path.splitext(os.path.basename(output_path))[0]
+                    for ext in ['.mp4', '.mkv', '.flv', '.webm', '.m4a', '.opus']:
+                        alt_path = os.path.join(base_dir, f"{base_name}{ext}")
+                        if os.path.exists(alt_path):
+                            return alt_path
                 else:
-                    error = process.stderr.read()
-                    print(f"下载失败，错误信息: {error}")
-                    self.progress_updated.emit(0, "下载失败")
+                    print(f"下载失败，错误信息: {result.get('error', '')}")
+                    self.report_progress(0, "下载失败")
                     return None
                     
                 return None
@@ -247,8 +1942,109 @@ class BilibiliDownloadThread(QThread):
             import traceback
             traceback.print_exc()
             print(f"下载B站视频失败: {e}")
-            self.progress_updated.emit(0, f"下载出错: {e}")
+            self.report_progress(0, f"下载出错: {e}")
             return None
+    
+    def on_ytdlp_event(self, event):
+        """处理yt-dlp工作进程返回的结构化进度事件"""
+        if event.get("type") == "progress" and event.get("status") == "downloading":
+            self.record_partial_file(event.get("filename"))
+            total = event.get("total_bytes")
+            downloaded = event.get("downloaded_bytes") or 0
+            self.journal_update(bytes_done=downloaded, total_bytes=total)
+            self.report_progress(
+                downloaded * 100 / total if total else None,
+                downloaded_bytes=downloaded,
+                total_bytes=total,
+                speed=event.get("speed"),
+                eta=event.get("eta")
+            )
+        elif event.get("type") == "postprocess" and event.get("status") == "started":
+            self.report_progress(99, "正在合并音视频...")
+        elif event.get("type") == "log" and event.get("level") == "error":
+            print(f"yt-dlp错误: {event.get('message')}")
+    
+    def save_danmaku(self, video_info, output_path):
+        """在视频旁边保存同名的XML和ASS弹幕文件，失败不影响下载结果"""
+        if not self.download_danmaku or self.audio_only or not self.is_running:
+            return
+        try:
+            self.report_progress(99, "正在下载弹幕...")
+            comments = fetch_danmaku(video_info['cid'], video_info.get('duration'), self.cookies)
+            base_path = os.path.splitext(output_path)[0]
+            write_danmaku_xml(comments, video_info['cid'], base_path + ".xml")
+            rendered = write_danmaku_ass(comments, base_path + ".ass")
+            print(f"弹幕已保存: 共 {len(comments)} 条，ASS中显示 {rendered} 条")
+        except Exception as e:
+            print(f"下载弹幕失败: {e}")
+    
+    def archive_download(self, video_ids, path, title=None):
+        """把下载完成的文件登记到已下载记录，失败不影响下载结果"""
+        if self.archive is None:
+            return
+        try:
+            sha256 = file_sha256(path) if path and os.path.exists(path) else None
+            for video_id in dict.fromkeys(filter(None, video_ids)):
+                self.archive.record("bilibili", video_id, self.archive_quality, path, title, sha256)
+        except Exception as e:
+            print(f"登记已下载记录失败: {e}")
+    
+    def journal_update(self, force=False, **fields):
+        """把下载状态写入断点续传日志"""
+        if self.journal is not None:
+            self.journal.update(self.job_key, force=force, **fields)
+    
+    def record_partial_file(self, path):
+        """记录yt-dlp正在写入的文件，取消下载时据此清理 .part 临时文件"""
+        if path and path not in self.partial_files:
+            self.partial_files.append(path)
+            self.journal_update(force=True, path=path, partial_files=list(self.partial_files))
+    
+    def report_progress(self, percent, message=None, **fields):
+        """上报进度：有进度汇总器时交给它合并限频，否则直接发信号"""
+        if self.progress_bus is not None:
+            self.progress_bus.report(self.job_key, percent, message, **fields)
+        else:
+            fields.update(percent=percent, message=message)
+            self.progress_updated.emit(int(percent or 0), format_progress_message(fields))
+    
+    def run_ytdlp_command(self, url, options):
+        """以单独的yt-dlp进程执行下载，返回与工作进程相同格式的结果"""
+        cmd = ytdlp_cli_args(url, options) + ["--newline", "--no-colors"]
+        
+        # 同时排空stdout和stderr，避免stderr写满管道导致yt-dlp卡死
+        supervisor = ProcessSupervisor(cmd)
+        
+        # 监控进度
+        for stream, line in supervisor.iter_lines(should_stop=lambda: not self.is_running, idle_timeout=300):
+            line = line.strip()
+            if stream != "stdout" or not line:
+                continue
+            if '[download]' in line and '%' in line:
+                try:
+                    percent = float(line.split('%')[0].split()[-1])
+                    self.report_progress(percent)
+                except:
+                    pass
+            else:
+                print(f"yt-dlp输出: {line}")
+                if 'Destination:' in line:
+                    self.record_partial_file(line.split('Destination:')[1].strip())
+
+        if not self.is_running:
+            return {"ok": False, "cancelled": True, "error": "下载已取消"}
+        if supervisor.wait(5) == 0:
+            return {"ok": True}
+        supervisor.cancel()
+        return {"ok": False, "error": supervisor.stderr_text() or "yt-dlp没有正常退出"}
+    
+    def stop(self):
+        """安全停止下载过程"""
+        self.is_running = False
+
+# 命令行模式下多个工作线程会同时创建下载线程，预解析器在锁内创建，避免建出两个
+_metadata_prefetcher_lock = threading.Lock()
+
 
 class BilibiliDownloaderPlugin(PluginBase):
     """B站视频下载插件 - 支持从哔哩哔哩下载视频"""
@@ -261,6 +2057,13 @@ class BilibiliDownloaderPlugin(PluginBase):
         self.author = "YT下载器团队"
         self.settings = {}  # 确保初始化settings属性
         self.app = app_instance  # 存储应用实例
+        self.prefetch_urls = []  # 输入框中正在预解析的链接
+        self.subscription_timer = None
+        # 定时同步订阅时下载对话框可能还没打开过，批次状态先初始化
+        self.queue_rows = {}
+        self.batch_total = 0
+        self.batch_done = 0
+        self.active_percents = {}
         self.load_settings()
         
     # 添加 get_setting 和 set_setting 方法
@@ -282,6 +2085,13 @@ class BilibiliDownloaderPlugin(PluginBase):
                 print(f"已清理B站下载按钮 (ID: {button.objectName()})")
             except Exception as e:
                 print(f"清理B站下载按钮失败: {e}")
+        
+        # 关闭空闲的yt-dlp工作进程
+        get_ytdlp_pool().shutdown()
+        if _video_info_cache is not None:
+            _video_info_cache.flush()
+        if _http_client is not None:
+            _http_client.log_metrics()
     def set_setting(self, key, value):
         """设置插件设置"""
         self.settings[key] = value
@@ -291,6 +2101,7 @@ class BilibiliDownloaderPlugin(PluginBase):
         """初始化插件"""
         print("B站下载插件已初始化")
         self.add_bilibili_action()
+        self.start_subscription_timer()
         return True
         
     def get_hooks(self):
@@ -460,6 +2271,9 @@ class BilibiliDownloaderPlugin(PluginBase):
                 "请安装yt-dlp: pip install yt-dlp -U")
             return
         
+        # 提前启动yt-dlp工作进程，第一个下载无需等待yt-dlp导入
+        get_ytdlp_pool().prewarm(1)
+        
         dialog = QDialog(self.app)
         dialog.setWindowTitle("B站视频下载")
         dialog.resize(500, 400)
@@ -471,22 +2285,163 @@ class BilibiliDownloaderPlugin(PluginBase):
         form_group = QGroupBox("视频信息")
         form_layout = QFormLayout(form_group)
         
-        # URL输入框
-        self.url_input = QLineEdit()
-        self.url_input.setPlaceholderText("请输入B站视频链接...")
+        # URL输入框，支持一次粘贴多个链接
+        self.url_input = QPlainTextEdit()
+        self.url_input.setPlaceholderText("请输入B站视频链接，每行一个，可一次粘贴多个...")
+        self.url_input.setFixedHeight(80)
         form_layout.addRow("视频链接:", self.url_input)
         
+        # 粘贴链接后稍等片刻再预解析，输入过程中不重复请求
+        self.metadata_label = QLabel()
+        self.metadata_label.setWordWrap(True)
+        self.metadata_label.setVisible(False)
+        form_layout.addRow("", self.metadata_label)
+        self.prefetch_urls = []
+        self.prefetch_timer = QTimer(dialog)
+        self.prefetch_timer.setSingleShot(True)
+        self.prefetch_timer.setInterval(400)
+        self.prefetch_timer.timeout.connect(self.prefetch_pasted_urls)
+        self.url_input.textChanged.connect(self.prefetch_timer.start)
+        
+        import_btn = QPushButton("从文件导入...")
+        import_btn.clicked.connect(self.import_urls_from_file)
+        
+        # 把已有下载目录中的视频登记到已下载记录
+        scan_btn = QPushButton("索引已有目录...")
+        scan_btn.clicked.connect(self.scan_download_archive)
+        
+        import_layout = QHBoxLayout()
+        import_layout.addWidget(import_btn)
+        import_layout.addWidget(scan_btn)
+        form_layout.addRow("", import_layout)
+        
+        self.skip_downloaded_check = QCheckBox("跳过已下载的视频")
+        self.skip_downloaded_check.setChecked(self.get_setting("skip_downloaded", True))
+        self.skip_downloaded_check.toggled.connect(lambda checked: self.set_setting("skip_downloaded", checked))
+        form_layout.addRow("", self.skip_downloaded_check)
+        
         # 清晰度选择
         self.quality_combo = QComboBox()
+        self.quality_combo.addItem("超清 4K", 120)
+        self.quality_combo.addItem("高清 1080P60", 116)
+        self.quality_combo.addItem("高清 1080P+", 112)
         self.quality_combo.addItem("高清 1080P", 80)
         self.quality_combo.addItem("高清 720P", 64)
         self.quality_combo.addItem("清晰 480P", 32)
         self.quality_combo.addItem("流畅 360P", 16)
+        self.quality_combo.setCurrentIndex(self.quality_combo.findData(80))
         form_layout.addRow("清晰度:", self.quality_combo)
         
+        # 自适应画质：先测量实际吞吐量，在不超过所选清晰度的画质中选出能在时限内下完的最高画质
+        self.time_budget_spin = QSpinBox()
+        self.time_budget_spin.setRange(0, 24 * 60)
+        self.time_budget_spin.setSpecialValueText("关闭")
+        self.time_budget_spin.setSuffix(" 分钟")
+        self.time_budget_spin.setToolTip("每个视频的下载时限，开启后按实测网速自动降低画质（仅内置下载引擎）")
+        self.time_budget_spin.setValue(self.get_setting("time_budget_minutes", 0))
+        self.time_budget_spin.valueChanged.connect(lambda value: self.set_setting("time_budget_minutes", value))
+        form_layout.addRow("自适应时限:", self.time_budget_spin)
+        
+        # 视频编码偏好，同画质下HEVC/AV1比AVC小30%-50%
+        self.codec_combo = QComboBox()
+        self.codec_combo.addItem("HEVC (H.265) 优先", "hevc")
+        self.codec_combo.addItem("AV1 优先", "av1")
+        self.codec_combo.addItem("AVC (H.264) 兼容性最好", "avc")
+        self.codec_combo.setCurrentIndex(max(0, self.codec_combo.findData(self.get_setting("preferred_codec", "hevc"))))
+        self.codec_combo.currentIndexChanged.connect(
+            lambda index: self.set_setting("preferred_codec", self.codec_combo.itemData(index)))
+        form_layout.addRow("视频编码:", self.codec_combo)
+        
+        # 仅音频：只下载码率最高的音频流，写成带标签和封面的音频文件，适合音乐和播客
+        self.audio_only_check = QCheckBox("仅下载音频（不下载视频流）")
+        self.audio_only_check.setChecked(self.get_setting("audio_only", False))
+        self.audio_only_check.toggled.connect(lambda checked: self.set_setting("audio_only", checked))
+        self.audio_only_check.toggled.connect(self.on_audio_only_toggled)
+        form_layout.addRow("", self.audio_only_check)
+        self.audio_format_combo = QComboBox()
+        for audio_format, name in AUDIO_FORMATS.items():
+            self.audio_format_combo.addItem(name, audio_format)
+        self.audio_format_combo.setCurrentIndex(max(0, self.audio_format_combo.findData(self.get_setting("audio_format", "m4a"))))
+        self.audio_format_combo.currentIndexChanged.connect(
+            lambda index: self.set_setting("audio_format", self.audio_format_combo.itemData(index)))
+        form_layout.addRow("音频格式:", self.audio_format_combo)
+        self.on_audio_only_toggled(self.audio_only_check.isChecked())
+        # 预计大小随所选清晰度和编码变化
+        self.quality_combo.currentIndexChanged.connect(lambda index: self.refresh_metadata_label())
+        self.codec_combo.currentIndexChanged.connect(lambda index: self.refresh_metadata_label())
+        
+        # 同时下载数
+        self.concurrent_spin = QSpinBox()
+        self.concurrent_spin.setRange(1, 16)
+        self.concurrent_spin.setValue(self.get_setting("max_concurrent_downloads", 3))
+        self.concurrent_spin.valueChanged.connect(self.on_concurrent_changed)
+        form_layout.addRow("同时下载数:", self.concurrent_spin)
+        
         layout.addWidget(form_group)
         
-        # 进度显示
+        # 订阅UP主空间或收藏夹，新视频按添加订阅时的清晰度等选项加入队列
+        subscription_group = QGroupBox("订阅")
+        subscription_layout = QVBoxLayout(subscription_group)
+        subscription_layout.setContentsMargins(15, 20, 15, 15)
+        
+        subscription_input_layout = QHBoxLayout()
+        self.subscription_input = QLineEdit()
+        self.subscription_input.setPlaceholderText("UP主空间链接/UID 或 收藏夹链接")
+        subscription_input_layout.addWidget(self.subscription_input)
+        add_subscription_btn = QPushButton("添加订阅")
+        add_subscription_btn.setStyleSheet("padding: 4px 10px; font-weight: normal;")
+        add_subscription_btn.clicked.connect(self.add_subscription)
+        subscription_input_layout.addWidget(add_subscription_btn)
+        remove_subscription_btn = QPushButton("删除所选")
+        remove_subscription_btn.setStyleSheet("padding: 4px 10px; font-weight: normal;")
+        remove_subscription_btn.clicked.connect(self.remove_subscription)
+        subscription_input_layout.addWidget(remove_subscription_btn)
+        self.sync_subscriptions_btn = QPushButton("同步订阅")
+        self.sync_subscriptions_btn.setStyleSheet("padding: 4px 10px; font-weight: normal;")
+        self.sync_subscriptions_btn.clicked.connect(lambda: self.sync_subscriptions())
+        subscription_input_layout.addWidget(self.sync_subscriptions_btn)
+        subscription_layout.addLayout(subscription_input_layout)
+        
+        self.subscription_list = QListWidget()
+        self.subscription_list.setFixedHeight(70)
+        subscription_layout.addWidget(self.subscription_list)
+        self.refresh_subscription_list()
+        
+        interval_layout = QHBoxLayout()
+        interval_layout.addWidget(QLabel("自动同步间隔:"))
+        self.subscription_interval_spin = QSpinBox()
+        self.subscription_interval_spin.setRange(0, 7 * 24 * 60)
+        self.subscription_interval_spin.setSpecialValueText("关闭")
+        self.subscription_interval_spin.setSuffix(" 分钟")
+        self.subscription_interval_spin.setValue(self.get_setting("subscription_interval_minutes", 0))
+        self.subscription_interval_spin.valueChanged.connect(self.on_subscription_interval_changed)
+        interval_layout.addWidget(self.subscription_interval_spin)
+        interval_layout.addWidget(QLabel("首次同步最多下载:"))
+        self.first_sync_limit_spin = QSpinBox()
+        self.first_sync_limit_spin.setRange(0, 10000)
+        self.first_sync_limit_spin.setSpecialValueText("不限")
+        self.first_sync_limit_spin.setSuffix(" 个")
+        self.first_sync_limit_spin.setValue(self.get_setting("subscription_first_sync_limit", SUBSCRIPTION_FIRST_SYNC_LIMIT))
+        self.first_sync_limit_spin.valueChanged.connect(self.on_first_sync_limit_changed)
+        interval_layout.addWidget(self.first_sync_limit_spin)
+        interval_layout.addStretch()
+        subscription_layout.addLayout(interval_layout)
+        
+        layout.addWidget(subscription_group)
+        
+        # 下载队列
+        self.queue_table = QTableWidget()
+        self.queue_table.setColumnCount(3)
+        self.queue_table.setHorizontalHeaderLabels(["链接", "进度", "状态"])
+        self.queue_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.queue_table.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeToContents)
+        self.queue_table.horizontalHeader().setSectionResizeMode(2, QHeaderView.Stretch)
+        self.queue_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.queue_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        layout.addWidget(self.queue_table)
+        self.queue_rows = {}
+        
+        # 总体进度显示
         self.progress_bar = QProgressBar()
         self.progress_bar.setValue(0)
         layout.addWidget(self.progress_bar)
@@ -495,6 +2450,7 @@ class BilibiliDownloaderPlugin(PluginBase):
         layout.addWidget(self.status_label)
         
         # 下载按钮
+        buttons_layout = QHBoxLayout()
         self.download_btn = QPushButton("开始下载")
         self.download_btn.setStyleSheet("""
             QPushButton {
@@ -512,26 +2468,157 @@ class BilibiliDownloaderPlugin(PluginBase):
             }
         """)
         self.download_btn.clicked.connect(self.start_download)
-        layout.addWidget(self.download_btn)
+        buttons_layout.addWidget(self.download_btn)
+        
+        self.cancel_btn = QPushButton("取消全部")
+        self.cancel_btn.setEnabled(False)
+        self.cancel_btn.clicked.connect(self.cancel_download)
+        buttons_layout.addWidget(self.cancel_btn)
+        layout.addLayout(buttons_layout)
         
+        self.download_dialog = dialog
+        self.resume_unfinished_downloads()
         dialog.exec_()
         
-    def start_download(self):
-        """开始下载B站视频"""
-        url = self.url_input.text().strip()
-        if not url:
-            QMessageBox.warning(None, "输入错误", "请输入有效的B站视频链接")
+    def import_urls_from_file(self):
+        """从文本文件导入链接列表"""
+        from PyQt5.QtWidgets import QFileDialog
+        
+        file_path, _ = QFileDialog.getOpenFileName(None, "选择链接列表文件", "", "文本文件 (*.txt);;所有文件 (*)")
+        if not file_path:
             return
-            
-        # 获取选择的清晰度
-        quality = self.quality_combo.currentData()
+        try:
+            with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+                urls = parse_url_list(f.read())
+            if urls:
+                existing = self.url_input.toPlainText().strip()
+                self.url_input.setPlainText("\n".join(([existing] if existing else []) + urls))
+            self.status_label.setText(f"已从文件导入 {len(urls)} 个链接")
+        except Exception as e:
+            QMessageBox.warning(None, "导入失败", f"读取链接文件失败: {e}")
+    
+    def get_metadata_prefetcher(self):
+        """获取链接预解析器，不存在时创建"""
+        with _metadata_prefetcher_lock:
+            if getattr(self, 'metadata_prefetcher', None) is None:
+                self.metadata_prefetcher = MetadataPrefetcher(
+                    lambda url: prefetch_video_metadata(url, self.get_cookies()), video_key_from_url)
+                self.metadata_prefetcher.metadata_ready.connect(self.on_metadata_ready)
+            return self.metadata_prefetcher
+    
+    def prefetch_pasted_urls(self):
+        """在后台预解析输入框中的前几个B站链接"""
+        self.prefetch_urls = [url for url in parse_url_list(self.url_input.toPlainText())
+                              if extract_video_id_from_url(url) or 'b23.tv' in url][:PREFETCH_LIMIT]
+        if self.prefetch_urls:
+            self.get_metadata_prefetcher().prefetch(self.prefetch_urls)
+        self.refresh_metadata_label()
+    
+    def on_metadata_ready(self, key, result):
+        """预解析完成，刷新输入框下方的视频信息"""
+        if any(video_key_from_url(url) == key for url in self.prefetch_urls):
+            self.refresh_metadata_label()
+    
+    def on_audio_only_toggled(self, checked):
+        """切换仅音频模式：画质、编码和自适应时限只对视频流有效"""
+        for widget in (self.quality_combo, self.codec_combo, self.time_budget_spin):
+            widget.setEnabled(not checked)
+        self.audio_format_combo.setEnabled(checked)
+        self.refresh_metadata_label()
+    
+    def estimate_prefetched_size(self, result):
+        """按当前选择的清晰度和编码估算预解析视频的下载大小，仅音频模式只计音频流"""
+        streams = result.get("streams")
+        if not streams:
+            return None
+        video, audio = select_dash_streams(streams, self.quality_combo.currentData(), self.codec_combo.currentData())
+        duration = streams.get('duration') or result.get("duration")
+        audio_size = estimate_stream_size(audio, duration) if audio else 0
+        if self.audio_only_check.isChecked():
+            return audio_size or None
+        return estimate_stream_size(video, duration) + audio_size
+    
+    def refresh_metadata_label(self):
+        """在输入框下方逐行显示预解析到的标题、时长、预计大小和可选画质"""
+        lines = []
+        for url in self.prefetch_urls:
+            result = self.get_metadata_prefetcher().peek(url)
+            if result is None:
+                lines.append(f"正在解析 {url} ...")
+            elif result.get("error"):
+                lines.append(f"解析失败 {url}: {result['error'][:80]}")
+            else:
+                lines.append(describe_prefetched_metadata(dict(result, size=self.estimate_prefetched_size(result))))
+        try:
+            self.metadata_label.setText("\n".join(lines))
+            self.metadata_label.setVisible(bool(lines))
+        except RuntimeError:
+            pass  # 对话框已关闭
+    
+    def scan_download_archive(self):
+        """选择目录并在后台索引其中已下载的视频"""
+        from PyQt5.QtWidgets import QFileDialog
         
-        # 获取输出目录
-        output_dir = self.get_setting("output_dir", "downloads")
-        if hasattr(self.app, 'download_dir'):
-            output_dir = self.app.download_dir
-            
-        # 获取cookie信息
+        directory = QFileDialog.getExistingDirectory(None, "选择已有的下载目录")
+        if not directory:
+            return
+        self.archive_scan_thread = ArchiveScanThread(directory)
+        self.archive_scan_thread.scan_complete.connect(self.on_archive_scan_complete)
+        self.archive_scan_thread.start()
+        self.status_label.setText(f"正在索引 {directory} ...")
+    
+    def on_archive_scan_complete(self, indexed, scanned):
+        """目录索引完成"""
+        self.status_label.setText(f"索引完成: 扫描 {scanned} 个视频文件，登记 {indexed} 个可识别的视频")
+    
+    def on_concurrent_changed(self, value):
+        """修改同时下载数"""
+        self.set_setting("max_concurrent_downloads", value)
+        if getattr(self, 'download_queue', None):
+            self.download_queue.set_max_concurrent(value)
+    
+    def on_progress_rate_changed(self, value):
+        """修改进度刷新频率"""
+        self.set_setting("progress_update_hz", value)
+        if getattr(self, 'progress_bus', None):
+            self.progress_bus.set_rate(value)
+    
+    def get_download_queue(self):
+        """获取下载队列，不存在时创建"""
+        if getattr(self, 'download_queue', None) is None:
+            # 所有下载线程的进度先汇总，再按固定频率批量刷新界面
+            self.progress_bus = ProgressAggregator(self.get_setting("progress_update_hz", 5))
+            self.progress_bus.progress_batch.connect(self.on_progress_batch)
+            self.download_queue = DownloadQueue(
+                self.create_download_thread,
+                self.get_setting("max_concurrent_downloads", 3),
+                key_func=video_key_from_url,
+                progress_bus=self.progress_bus,
+                journal=self.get_download_journal()
+            )
+            self.download_queue.item_added.connect(self.on_queue_item_added)
+            self.download_queue.item_complete.connect(self.on_download_complete)
+            self.download_queue.queue_finished.connect(self.on_queue_finished)
+        return self.download_queue
+    
+    def get_download_journal(self):
+        """获取断点续传任务日志，不存在时创建"""
+        if getattr(self, 'download_journal', None) is None:
+            journal_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings", "download_journal.json")
+            self.download_journal = DownloadJournal(journal_file, "bilibili")
+        return self.download_journal
+    
+    def resume_unfinished_downloads(self):
+        """把上次退出时未完成的任务重新加入队列，已下载的部分会继续使用"""
+        resumed = 0
+        for key, entry in self.get_download_journal().unfinished():
+            resumed += len(self.enqueue_urls([entry["url"]], entry.get("options")))
+        if resumed:
+            self.status_label.setText(f"已恢复 {resumed} 个未完成的下载任务")
+            self.cancel_btn.setEnabled(self.get_download_queue().is_busy())
+    
+    def get_cookies(self):
+        """解析设置中的Cookie字符串"""
         cookies = {}
         bilibili_cookie = self.get_setting("bilibili_cookie", "")
         if bilibili_cookie:
@@ -544,33 +2631,323 @@ class BilibiliDownloaderPlugin(PluginBase):
                         cookies[key.strip()] = value.strip()
             except:
                 print("Cookie解析失败，将使用默认方式下载")
-                
-        # 创建下载线程
-        self.download_thread = BilibiliDownloadThread(url, quality, output_dir, cookies)
-        self.download_thread.progress_updated.connect(self.update_progress)
-        self.download_thread.download_complete.connect(self.on_download_complete)
+        return cookies
+    
+    def create_download_thread(self, url, quality=80, codec=None, audio_only=None, audio_format=None):
+        """为队列中的单个链接创建下载线程，未指定的选项使用插件设置"""
+        # 获取输出目录
+        output_dir = self.get_setting("output_dir", "downloads")
+        if hasattr(self.app, 'download_dir'):
+            output_dir = self.app.download_dir
+        return BilibiliDownloadThread(
+            url, quality, output_dir, self.get_cookies(),
+            engine=self.get_setting("download_engine", "native"),
+            connections=self.get_setting("dash_connections", 4),
+            bandwidth=get_bandwidth_manager(self.app),
+            archive=get_download_archive(),
+            skip_downloaded=self.get_setting("skip_downloaded", True),
+            codec=codec or self.get_setting("preferred_codec", "hevc"),
+            download_danmaku=self.get_setting("download_danmaku", False),
+            time_budget=self.get_setting("time_budget_minutes", 0) * 60,
+            audio_only=self.get_setting("audio_only", False) if audio_only is None else audio_only,
+            audio_format=audio_format or self.get_setting("audio_format", "m4a"),
+            postprocessor=get_postprocess_pool(self.app),
+            prefetcher=self.get_metadata_prefetcher()
+        )
         
-        # 禁用下载按钮
+    def start_download(self):
+        """开始下载B站视频，所有链接加入下载队列"""
+        urls = parse_url_list(self.url_input.toPlainText())
+        if not urls:
+            QMessageBox.warning(None, "输入错误", "请输入有效的B站视频链接")
+            return
+            
+        self.url_input.clear()
+        # 先在后台并发获取全部视频信息，多P视频和合集展开后让用户选择分P；
+        # 视频信息写入缓存，各分P的下载线程共用同一份信息
         self.download_btn.setEnabled(False)
-        self.download_btn.setText("下载中...")
+        self.status_label.setText("正在获取视频信息...")
+        self.expand_thread = PartExpandThread(urls, self.get_cookies())
+        self.expand_thread.expand_complete.connect(self.on_urls_expanded)
+        self.expand_thread.start()
+    
+    def on_urls_expanded(self, singles, series):
+        """视频信息获取完成，普通视频直接加入队列，多P视频和合集选择分P后加入"""
+        self.download_btn.setEnabled(True)
+        urls = list(singles)
+        for item in series:
+            urls.extend(self.select_episodes(item))
+        if not urls:
+            self.status_label.setText("没有选择要下载的视频")
+            return
+        
+        # 获取选择的清晰度
+        quality = self.quality_combo.currentData()
         
-        # 开始下载
-        self.download_thread.start()
+        queue = self.get_download_queue()
+        added = self.enqueue_urls(urls, {"quality": quality, "codec": self.codec_combo.currentData(),
+                                         "audio_only": self.audio_only_check.isChecked(),
+                                         "audio_format": self.audio_format_combo.currentData()})
+        season_urls = [url for url in urls[len(singles):] if 'p=' not in urlparse(url).query]
+        if season_urls:
+            # 合集中的其他视频在后台并发预取信息，排队的下载线程启动时直接命中缓存
+            threading.Thread(target=warm_video_info_cache, args=(season_urls, self.get_cookies()), daemon=True).start()
         
-    def update_progress(self, value, message):
-        """更新下载进度"""
-        self.progress_bar.setValue(value)
+        skipped = len(urls) - len(added)
+        message = f"已加入 {len(added)} 个下载任务"
+        if skipped:
+            message += f"，忽略 {skipped} 个重复链接"
         self.status_label.setText(message)
         
-    def on_download_complete(self, success, file_path, title):
-        """下载完成处理"""
-        self.download_btn.setEnabled(True)
-        self.download_btn.setText("开始下载")
+        if queue.is_busy():
+            self.cancel_btn.setEnabled(True)
+        
+    def select_episodes(self, series):
+        """显示分P列表供用户勾选，返回选中分P的链接"""
+        dialog = QDialog(self.download_dialog)
+        dialog.setWindowTitle(f"选择分P - {series['title']}")
+        dialog.resize(480, 500)
+        dialog.setWindowFlags(dialog.windowFlags() & ~Qt.WindowContextHelpButtonHint)
+        layout = QVBoxLayout(dialog)
+        layout.addWidget(QLabel(f"{series['title']}（共 {len(series['episodes'])} 个）"))
+        
+        episode_list = QListWidget()
+        for episode in series["episodes"]:
+            item = QListWidgetItem(episode["title"])
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Checked)
+            item.setData(Qt.UserRole, episode["url"])
+            episode_list.addItem(item)
+        layout.addWidget(episode_list)
+        
+        def set_all(state):
+            for row in range(episode_list.count()):
+                episode_list.item(row).setCheckState(state)
+        
+        buttons_layout = QHBoxLayout()
+        select_all_btn = QPushButton("全选")
+        select_all_btn.clicked.connect(lambda: set_all(Qt.Checked))
+        select_none_btn = QPushButton("全不选")
+        select_none_btn.clicked.connect(lambda: set_all(Qt.Unchecked))
+        ok_btn = QPushButton("下载所选")
+        ok_btn.clicked.connect(dialog.accept)
+        cancel_btn = QPushButton("取消")
+        cancel_btn.clicked.connect(dialog.reject)
+        for button in (select_all_btn, select_none_btn):
+            buttons_layout.addWidget(button)
+        buttons_layout.addStretch()
+        for button in (ok_btn, cancel_btn):
+            buttons_layout.addWidget(button)
+        layout.addLayout(buttons_layout)
+        
+        if dialog.exec_() != QDialog.Accepted:
+            return []
+        return [episode_list.item(row).data(Qt.UserRole) for row in range(episode_list.count())
+                if episode_list.item(row).checkState() == Qt.Checked]
+    
+    def has_download_dialog(self):
+        """下载对话框是否已创建，定时同步订阅时对话框可能从未打开过"""
+        return getattr(self, 'download_dialog', None) is not None
+    
+    def enqueue_urls(self, urls, options=None):
+        """把链接加入下载队列，队列空闲时先清空上一批的显示，返回加入的任务键"""
+        queue = self.get_download_queue()
+        if not queue.is_busy():
+            # 新的一批下载，清空上一批的显示
+            if self.has_download_dialog():
+                self.queue_table.setRowCount(0)
+            self.queue_rows = {}
+            self.batch_total = 0
+            self.batch_done = 0
+            self.active_percents = {}
+        added = queue.add_urls(urls, options)
+        self.batch_total += len(added)
+        return added
+    
+    def on_queue_item_added(self, key, url):
+        """在队列表格中添加一行"""
+        if not self.has_download_dialog():
+            return
+        row = self.queue_table.rowCount()
+        self.queue_table.insertRow(row)
+        self.queue_table.setItem(row, 0, QTableWidgetItem(url))
+        self.queue_table.setItem(row, 1, QTableWidgetItem("0%"))
+        self.queue_table.setItem(row, 2, QTableWidgetItem("等待中"))
+        self.queue_rows[key] = row
+        
+    def on_progress_batch(self, batch):
+        """按批次刷新所有正在下载任务的进度"""
+        for key, progress in batch.items():
+            if progress.get("percent") is not None:
+                self.active_percents[key] = progress["percent"]
+            row = self.queue_rows.get(key)
+            if row is None:
+                continue
+            if progress.get("percent") is not None:
+                self.queue_table.item(row, 1).setText(f"{progress['percent']:.0f}%")
+            self.queue_table.item(row, 2).setText(format_progress_message(progress))
+        self.update_total_progress()
+        
+    def update_total_progress(self):
+        """总体进度 = 已完成任务 + 正在下载任务的部分进度"""
+        if self.batch_total and self.has_download_dialog():
+            partial = sum(self.active_percents.values()) / 100
+            self.progress_bar.setValue(int((self.batch_done + partial) * 100 / self.batch_total))
+        
+    def on_download_complete(self, key, success, message, file_path):
+        """单个任务下载完成处理"""
+        self.batch_done += 1
+        self.active_percents.pop(key, None)
+        self.update_total_progress()
+        if self.has_download_dialog():
+            self.status_label.setText(f"已完成 {self.batch_done}/{self.batch_total}")
+        
+        row = self.queue_rows.get(key)
+        if row is not None:
+            self.queue_table.item(row, 1).setText("100%" if success else "-")
+            self.queue_table.item(row, 2).setText(f"完成: {file_path}" if success else f"失败: {message}")
+        self.last_result = (success, message, file_path)
+        
+    def on_queue_finished(self, succeeded, failed):
+        """整个队列完成处理"""
+        if not self.has_download_dialog():
+            print(f"B站后台下载结束: 成功 {succeeded} 个，失败 {failed} 个")
+            return
+        self.cancel_btn.setEnabled(False)
+        
+        if succeeded + failed == 1:
+            success, message, file_path = self.last_result
+            if success:
+                QMessageBox.information(None, "下载完成", f"视频 '{message}' 已成功下载到:\n{file_path}")
+            else:
+                QMessageBox.warning(None, "下载失败", f"下载失败: {message}")
+        elif failed:
+            QMessageBox.warning(None, "下载完成", f"批量下载结束: 成功 {succeeded} 个，失败 {failed} 个")
+        else:
+            QMessageBox.information(None, "下载完成", f"批量下载结束: {succeeded} 个视频已全部下载成功")
+    
+    def get_subscription_store(self):
+        """获取订阅列表，不存在时创建"""
+        if getattr(self, 'subscription_store', None) is None:
+            store_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings", "subscriptions.json")
+            self.subscription_store = SubscriptionStore(store_file)
+        return self.subscription_store
+    
+    def refresh_subscription_list(self):
+        """刷新订阅列表显示"""
+        from datetime import datetime
+        
+        store = self.get_subscription_store()
+        self.subscription_list.clear()
+        for source in store.list_sources():
+            entry = store.get(source)
+            label = f"{entry['name']}  {source}" if entry.get("name") else source
+            if entry.get("last_sync"):
+                synced = datetime.fromtimestamp(entry["last_sync"]).strftime("%Y-%m-%d %H:%M")
+                text = f"{label}  (上次同步: {synced})"
+            else:
+                text = f"{label}  (尚未同步)"
+            self.subscription_list.addItem(text)
+            self.subscription_list.item(self.subscription_list.count() - 1).setData(Qt.UserRole, source)
+    
+    def add_subscription(self):
+        """添加订阅，记住当前选择的清晰度、编码和音频选项"""
+        source = normalize_subscription_source(self.subscription_input.text())
+        if not source:
+            QMessageBox.warning(None, "输入错误", "请输入UP主空间链接或UID，或带 fid 的收藏夹链接")
+            return
+        options = {"quality": self.quality_combo.currentData(), "codec": self.codec_combo.currentData(),
+                   "audio_only": self.audio_only_check.isChecked(),
+                   "audio_format": self.audio_format_combo.currentData()}
+        if self.get_subscription_store().add(source, options):
+            self.status_label.setText(f"已添加订阅 {source}，点击“同步订阅”下载")
+        else:
+            self.status_label.setText(f"{source} 已在订阅列表中")
+        self.subscription_input.clear()
+        self.refresh_subscription_list()
+    
+    def remove_subscription(self):
+        """删除选中的订阅"""
+        for item in self.subscription_list.selectedItems():
+            self.get_subscription_store().remove(item.data(Qt.UserRole))
+        self.refresh_subscription_list()
+    
+    def start_subscription_timer(self):
+        """按设置的间隔定时同步订阅，间隔为0时关闭"""
+        if self.subscription_timer:
+            self.subscription_timer.stop()
+            self.subscription_timer = None
         
-        if success:
-            QMessageBox.information(None, "下载完成", f"视频 '{title}' 已成功下载到:\n{file_path}")
+        interval_minutes = self.get_setting("subscription_interval_minutes", 0)
+        if not interval_minutes:
+            return
+        self.subscription_timer = QTimer()
+        self.subscription_timer.setInterval(interval_minutes * 60 * 1000)
+        self.subscription_timer.timeout.connect(lambda: self.sync_subscriptions(scheduled=True))
+        self.subscription_timer.start()
+        print(f"已启动订阅自动同步，间隔: {interval_minutes} 分钟")
+    
+    def on_subscription_interval_changed(self, value):
+        """修改订阅自动同步间隔"""
+        self.set_setting("subscription_interval_minutes", value)
+        self.start_subscription_timer()
+    
+    def on_first_sync_limit_changed(self, value):
+        """修改新订阅首次同步最多下载的视频数"""
+        self.set_setting("subscription_first_sync_limit", value)
+    
+    def sync_subscriptions(self, scheduled=False):
+        """在后台同步所有订阅，新视频加入下载队列"""
+        thread = getattr(self, 'subscription_sync_thread', None)
+        if thread is not None and thread.isRunning():
+            return
+        store = self.get_subscription_store()
+        if not store.list_sources():
+            if not scheduled:
+                QMessageBox.information(None, "没有订阅", "请先添加要订阅的UP主或收藏夹")
+            return
+        if self.has_download_dialog():
+            self.sync_subscriptions_btn.setEnabled(False)
+            self.status_label.setText("正在同步订阅...")
+        self.subscription_sync_thread = SubscriptionSyncThread(
+            store, self.get_cookies(),
+            first_sync_limit=self.get_setting("subscription_first_sync_limit", SUBSCRIPTION_FIRST_SYNC_LIMIT))
+        self.subscription_sync_thread.new_videos.connect(self.on_subscription_videos)
+        self.subscription_sync_thread.sync_complete.connect(self.on_subscription_sync_complete)
+        self.subscription_sync_thread.start()
+    
+    def on_subscription_videos(self, source, videos):
+        """订阅中发现新视频，按订阅的选项加入下载队列，游标只推进到队列接受了的视频"""
+        store = self.get_subscription_store()
+        entry = store.get(source) or {}
+        urls = [subscription_video_url(video) for video in videos]
+        added = self.enqueue_urls(urls, entry.get("options") or None)
+        queue = self.get_download_queue()
+        added_keys = set(added)
+        # 与队列中未完成任务重复而被忽略的链接也算已接受
+        store.advance(source, [video for url, video in zip(urls, videos)
+                               if queue.key_func(url) in added_keys or queue.has_job(queue.key_func(url))])
+        message = f"{entry.get('name') or source}: 新视频 {len(urls)} 个，已加入 {len(added)} 个下载任务"
+        if self.has_download_dialog():
+            self.status_label.setText(message)
+            self.cancel_btn.setEnabled(self.get_download_queue().is_busy())
         else:
-            QMessageBox.warning(None, "下载失败", f"下载失败: {title}")
+            print(message)
+    
+    def on_subscription_sync_complete(self, total):
+        """订阅同步完成"""
+        if not self.has_download_dialog():
+            return
+        self.sync_subscriptions_btn.setEnabled(True)
+        self.refresh_subscription_list()
+        if not total:
+            self.status_label.setText("订阅同步完成，没有新视频")
+    
+    def cancel_download(self):
+        """取消队列中所有下载"""
+        if getattr(self, 'download_queue', None):
+            self.download_queue.cancel_all()
+            self.status_label.setText("正在取消下载...")
         
     def create_settings_widget(self):
         """创建设置界面"""
@@ -595,6 +2972,43 @@ class BilibiliDownloaderPlugin(PluginBase):
         
         basic_layout.addRow("默认下载目录:", dir_layout)
         
+        # 同时下载数
+        concurrent_spin = QSpinBox()
+        concurrent_spin.setRange(1, 16)
+        concurrent_spin.setValue(self.get_setting("max_concurrent_downloads", 3))
+        concurrent_spin.valueChanged.connect(lambda value: self.set_setting("max_concurrent_downloads", value))
+        basic_layout.addRow("同时下载数:", concurrent_spin)
+        
+        # 下载引擎
+        engine_combo = QComboBox()
+        engine_combo.addItem("内置多连接下载 (DASH)", "native")
+        engine_combo.addItem("yt-dlp", "ytdlp")
+        engine_combo.setCurrentIndex(max(0, engine_combo.findData(self.get_setting("download_engine", "native"))))
+        engine_combo.currentIndexChanged.connect(
+            lambda index: self.set_setting("download_engine", engine_combo.itemData(index)))
+        basic_layout.addRow("下载引擎:", engine_combo)
+        
+        # 每个流的并行连接数
+        connections_spin = QSpinBox()
+        connections_spin.setRange(1, 16)
+        connections_spin.setValue(self.get_setting("dash_connections", 4))
+        connections_spin.valueChanged.connect(lambda value: self.set_setting("dash_connections", value))
+        basic_layout.addRow("并行连接数:", connections_spin)
+        
+        # 弹幕
+        danmaku_check = QCheckBox("同时下载弹幕 (XML + ASS)")
+        danmaku_check.setChecked(self.get_setting("download_danmaku", False))
+        danmaku_check.toggled.connect(lambda checked: self.set_setting("download_danmaku", checked))
+        basic_layout.addRow("", danmaku_check)
+        
+        # 进度刷新频率
+        progress_hz_spin = QSpinBox()
+        progress_hz_spin.setRange(1, 30)
+        progress_hz_spin.setSuffix(" 次/秒")
+        progress_hz_spin.setValue(self.get_setting("progress_update_hz", 5))
+        progress_hz_spin.valueChanged.connect(self.on_progress_rate_changed)
+        basic_layout.addRow("进度刷新频率:", progress_hz_spin)
+        
         # 账号设置
         account_group = QGroupBox("账号设置 (可选)")
         account_layout = QFormLayout(account_group)
@@ -606,7 +3020,39 @@ class BilibiliDownloaderPlugin(PluginBase):
         self.bilibili_cookie.textChanged.connect(lambda text: self.set_setting("bilibili_cookie", text))
         account_layout.addRow("B站Cookie:", self.bilibili_cookie)
         
+        # 带宽设置，所有下载插件共用
+        bandwidth = get_bandwidth_manager(self.app)
+        bandwidth_group = QGroupBox("带宽限制 (KB/s，0 为不限)")
+        bandwidth_layout = QFormLayout(bandwidth_group)
+        
+        global_spin = QSpinBox()
+        global_spin.setRange(0, 1024 * 1024)
+        global_spin.setValue(bandwidth.config.get("global_kbps", 0))
+        global_spin.valueChanged.connect(lambda value: bandwidth.save_config(global_kbps=value))
+        bandwidth_layout.addRow("全局上限:", global_spin)
+        
+        def site_limit_changed(site, value):
+            sites = dict(bandwidth.config.get("sites") or {})
+            sites[site] = value
+            bandwidth.save_config(sites=sites)
+        
+        for site, label in (("bilibili", "B站上限:"), ("acfun", "A站上限:"), ("tiktok", "TikTok上限:")):
+            site_spin = QSpinBox()
+            site_spin.setRange(0, 1024 * 1024)
+            site_spin.setValue((bandwidth.config.get("sites") or {}).get(site, 0))
+            site_spin.valueChanged.connect(lambda value, site=site: site_limit_changed(site, value))
+            bandwidth_layout.addRow(label, site_spin)
+        
+        schedule_input = QPlainTextEdit()
+        schedule_input.setFixedHeight(60)
+        schedule_input.setPlaceholderText("按时间段限速，每行一条，例如:\n08:00-23:00 global=2048 bilibili=1024")
+        schedule_input.setPlainText(format_bandwidth_schedule(bandwidth.config.get("schedule")))
+        schedule_input.textChanged.connect(
+            lambda: bandwidth.save_config(schedule=parse_bandwidth_schedule(schedule_input.toPlainText())))
+        bandwidth_layout.addRow("时间段方案:", schedule_input)
+        
         layout.addWidget(basic_group)
+        layout.addWidget(bandwidth_group)
         layout.addWidget(account_group)
         
         # 关于信息
@@ -664,4 +3110,51 @@ class BilibiliDownloaderPlugin(PluginBase):
             with open(settings_file, "w", encoding="utf-8") as f:
                 json.dump(self.settings, f, ensure_ascii=False, indent=4)
         except Exception as e:
-            print(f"保存B站下载器插件设置失败: {e}")
\ No newline at end of file
+            print(f"保存B站下载器插件设置失败: {e}")
+
+
+def main(argv=None):
+    """命令行入口，不需要图形界面: python -m bilibili_downloader [链接 ...] [-i 任务文件]"""
+    from types import SimpleNamespace
+    
+    parser = build_headless_parser("python -m bilibili_downloader", "无界面批量下载B站视频，进度以JSON行输出到标准输出")
+    parser.add_argument("-q", "--quality", type=int, default=80, choices=sorted(QUALITY_NAMES),
+                        help="清晰度代码qn (默认 80 即1080P)")
+    parser.add_argument("--codec", choices=sorted(CODEC_IDS), help="优先的视频编码")
+    parser.add_argument("--engine", choices=["native", "ytdlp"], help="下载引擎")
+    parser.add_argument("--connections", type=int, help="内置下载器每个流的并行连接数")
+    parser.add_argument("--danmaku", action="store_true", help="同时下载弹幕")
+    parser.add_argument("--time-budget", type=int, metavar="MINUTES",
+                        help="自适应画质：每个视频的下载时限(分钟)，按实测网速选择能按时下完的最高画质")
+    parser.add_argument("--audio-only", action="store_true", help="只下载音频流，保存为带标签和封面的音频文件")
+    parser.add_argument("--audio-format", choices=sorted(AUDIO_FORMATS), help="仅音频模式的输出格式")
+    parser.add_argument("--cookie", help="B站Cookie字符串，默认使用插件设置中的Cookie")
+    args = parser.parse_args(argv)
+    
+    # 复用插件的设置和下载线程创建逻辑，命令行参数只覆盖本次运行，不写回设置文件
+    plugin = BilibiliDownloaderPlugin(SimpleNamespace(download_dir=args.output_dir) if args.output_dir else None)
+    overrides = {"download_engine": args.engine, "dash_connections": args.connections,
+                 "bilibili_cookie": args.cookie, "download_danmaku": args.danmaku or None,
+                 "skip_downloaded": False if args.no_skip else None, "time_budget_minutes": args.time_budget,
+                 "audio_only": args.audio_only or None, "audio_format": args.audio_format}
+    plugin.settings.update({key: value for key, value in overrides.items() if value is not None})
+    
+    journal_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings", "cli_journal.json")
+    # 下载选项随任务记入断点续传日志，--resume 时按原来的选项继续
+    options = {"quality": args.quality, "codec": args.codec or plugin.get_setting("preferred_codec", "hevc"),
+               "audio_only": plugin.get_setting("audio_only", False),
+               "audio_format": plugin.get_setting("audio_format", "m4a")}
+    exit_code = run_headless(
+        args,
+        plugin.create_download_thread,
+        video_key_from_url,
+        journal=DownloadJournal(journal_file, "bilibili"),
+        options=options,
+        # 完成信号的参数: 成功状态, 消息（成功时为标题，失败时为错误信息）, 文件路径
+        result_fields=lambda result: ({"path": result[2], "title": result[1]} if result[0]
+                                      else {"error": result[1]})
+    )
+    # 接口请求统计写到标准错误，标准输出只有JSON行
+    if _http_client is not None:
+        _http_client.log_metrics()
+    return exit_code
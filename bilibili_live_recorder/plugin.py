@@ -6,10 +6,10 @@ import time
 import uuid
 import shutil
 import datetime
+import threading
 import subprocess
 import select
 from urllib.parse import urlparse, parse_qs
-from threading import Timer
 
 from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QFormLayout, QLabel, 
                             QLineEdit, QPushButton, QMessageBox, QProgressBar, 
@@ -20,6 +20,12 @@ from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QFormLayout, QLa
 from PyQt5.QtCore import QThread, pyqtSignal, Qt, QSize, QTimer, QDateTime, QUrl
 from PyQt5.QtGui import QIcon, QFont, QColor, QDesktopServices
 
+# 各插件共用的组件在插件目录下的 downloader_common 包中，先把插件目录加入路径
+PLUGINS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PLUGINS_DIR not in sys.path:
+    sys.path.append(PLUGINS_DIR)
+from downloader_common import (ProcessSupervisor, BilibiliHttpClient)
+
 # 导入插件基类
 try:
     from youtube_downloader import PluginBase
@@ -30,6 +36,146 @@ except ImportError:
             self.app = app_instance
 
 
+LIVE_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.110 Safari/537.36',
+    'Accept': 'application/json, text/plain, */*',
+    'Accept-Language': 'zh-CN,zh;q=0.9',
+    'Origin': 'https://live.bilibili.com',
+    'Referer': 'https://live.bilibili.com'
+}
+
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """获取插件共享的B站HTTP客户端"""
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = BilibiliHttpClient(LIVE_HEADERS)
+        return _http_client
+
+
+ROOM_STATUS_INTERVAL = 5  # 轮询直播间状态的间隔（秒）
+ROOM_STATUS_BATCH_SIZE = 50  # 批量接口每次查询的房间数
+
+
+def fetch_room_statuses(room_ids):
+    """用批量接口查询多个直播间的开播状态、标题、主播名和封面
+
+    每 ROOM_STATUS_BATCH_SIZE 个房间只需一次请求。返回 {房间号: 信息}，
+    短号和真实房间号都能对应回查询时使用的房间号；查询失败时抛出异常。
+    """
+    room_ids = [str(room_id) for room_id in room_ids]
+    results = {}
+    for start in range(0, len(room_ids), ROOM_STATUS_BATCH_SIZE):
+        batch = room_ids[start:start + ROOM_STATUS_BATCH_SIZE]
+        params = [("req_biz", "web_room_componet")] + [("room_ids", room_id) for room_id in batch]
+        response = get_http_client().get(
+            "https://api.live.bilibili.com/xlive/web-room/v1/index/getRoomBaseInfo", params=params)
+        data = response.json()
+        if data.get('code') != 0:
+            raise RuntimeError(f"{data.get('message')} ({data.get('code')})")
+        for room in ((data.get('data') or {}).get('by_room_ids') or {}).values():
+            info = {
+                'live_status': room.get('live_status'),
+                'title': room.get('title', ''),
+                'streamer_name': room.get('uname', ''),
+                'cover_url': room.get('cover', '')
+            }
+            for room_id in (str(room.get('room_id')), str(room.get('short_id'))):
+                if room_id in batch:
+                    results[room_id] = info
+    return results
+
+
+class RoomStatusPoller:
+    """所有录制共用的直播间状态轮询器
+
+    一个后台线程每隔 interval 秒用批量接口查询全部关注的直播间，只在状态变化时
+    回调 callback(房间号, 信息)；接口请求数与房间数无关，也不再为每个录制创建定时器线程。
+    """
+    
+    def __init__(self, interval=ROOM_STATUS_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.watchers = {}  # 房间号 -> [callback]
+        self.last_status = {}  # 房间号 -> 上次分发的信息
+        self.thread = None
+    
+    def watch(self, room_id, callback):
+        """关注直播间，第一次查询到的状态也会回调
+
+        房间已被其他录制关注时，轮询器只在状态变化时才分发，因此先在调用线程中把已知的状态回调一次。
+        """
+        room_id = str(room_id)
+        with self.lock:
+            self.watchers.setdefault(room_id, []).append(callback)
+            cached = self.last_status.get(room_id)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="RoomStatusPoller", daemon=True)
+                self.thread.start()
+        if cached is not None:
+            try:
+                callback(room_id, cached)
+            except Exception as e:
+                print(f"分发房间 {room_id} 的状态出错: {e}")
+    
+    def unwatch(self, room_id, callback):
+        """取消关注，没有录制关注的房间不再查询"""
+        room_id = str(room_id)
+        with self.lock:
+            callbacks = self.watchers.get(room_id, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if not callbacks:
+                self.watchers.pop(room_id, None)
+                self.last_status.pop(room_id, None)
+    
+    def _run(self):
+        while True:
+            with self.lock:
+                room_ids = list(self.watchers)
+                if not room_ids:
+                    # 没有关注的房间时退出，下次 watch 再启动新线程
+                    self.thread = None
+                    return
+            started = time.monotonic()
+            try:
+                statuses = fetch_room_statuses(room_ids)
+            except Exception as e:
+                print(f"批量查询直播间状态失败: {e}")
+                statuses = {}
+            
+            for room_id, info in statuses.items():
+                with self.lock:
+                    if self.last_status.get(room_id) == info or room_id not in self.watchers:
+                        continue
+                    self.last_status[room_id] = info
+                    callbacks = list(self.watchers[room_id])
+                for callback in callbacks:
+                    try:
+                        callback(room_id, info)
+                    except Exception as e:
+                        print(f"分发房间 {room_id} 的状态出错: {e}")
+            time.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+
+_room_status_poller = None
+_room_status_poller_lock = threading.Lock()
+
+
+def get_room_status_poller():
+    """获取插件共享的直播间状态轮询器"""
+    global _room_status_poller
+    with _room_status_poller_lock:
+        if _room_status_poller is None:
+            _room_status_poller = RoomStatusPoller()
+        return _room_status_poller
+
+
 class LiveRecordingThread(QThread):
     """B站直播录制线程"""
     progress_updated = pyqtSignal(str, int, str)  # 房间ID, 进度, 状态消息
@@ -51,8 +197,7 @@ class LiveRecordingThread(QThread):
         self.stream_url = stream_url
         self.cover_url = cover_url
         self.streamer_name = streamer_name
-        self.check_interval = 5  # 检查直播状态的间隔（秒）
-        self.heartbeat_timer = None
+        self.heartbeat_active = False
         self.current_file = None
         self.signal_sent = False
         
@@ -106,9 +251,8 @@ class LiveRecordingThread(QThread):
             # 下载封面
             if self.cover_url:
                 try:
-                    import requests
                     cover_path = os.path.splitext(self.file_path)[0] + ".jpg"
-                    response = requests.get(self.cover_url, stream=True, timeout=10)
+                    response = get_http_client().get(self.cover_url, stream=True)
                     with open(cover_path, 'wb') as f:
                         for chunk in response.iter_content(chunk_size=1024):
                             if chunk:
@@ -156,22 +300,15 @@ class LiveRecordingThread(QThread):
     def get_stream_info(self):
         """获取直播流信息"""
         try:
-            import requests
-            
-            # 设置请求头，模拟浏览器行为
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.110 Safari/537.36',
-                'Referer': f'https://live.bilibili.com/{self.room_id}',
-                'Accept': 'application/json, text/plain, */*',
-                'Accept-Language': 'zh-CN,zh;q=0.9',
-                'Origin': 'https://live.bilibili.com'
-            }
+            # 共享的HTTP客户端复用连接，并在被限流时自动退避重试
+            client = get_http_client()
+            headers = {'Referer': f'https://live.bilibili.com/{self.room_id}'}
             
             print(f"开始获取房间 {self.room_id} 的信息...")
             
             # 尝试获取真实房间号
             room_init_url = f"https://api.live.bilibili.com/room/v1/Room/room_init?id={self.room_id}"
-            response = requests.get(room_init_url, headers=headers, timeout=10)
+            response = client.get(room_init_url, headers=headers)
             
             # 检查响应状态码
             if response.status_code != 200:
@@ -204,7 +341,7 @@ class LiveRecordingThread(QThread):
             
             # 获取播放信息
             try:
-                response = requests.get(room_url, headers=headers, timeout=10)
+                response = client.get(room_url, headers=headers)
                 if response.status_code != 200:
                     print(f"获取播放信息失败，状态码: {response.status_code}")
                     return None
@@ -220,7 +357,7 @@ class LiveRecordingThread(QThread):
             
             # 获取房间基本信息
             try:
-                response = requests.get(room_info_url, headers=headers, timeout=10)
+                response = client.get(room_info_url, headers=headers)
                 if response.status_code != 200:
                     print(f"获取房间基本信息失败，状态码: {response.status_code}")
                     return None
@@ -245,7 +382,7 @@ class LiveRecordingThread(QThread):
                 # 尝试从另一个API获取主播信息
                 try:
                     anchor_info_url = f"https://api.live.bilibili.com/live_user/v1/UserInfo/get_anchor_in_room?roomid={real_room_id}"
-                    response = requests.get(anchor_info_url, headers=headers, timeout=10)
+                    response = client.get(anchor_info_url, headers=headers)
                     if response.status_code == 200:
                         anchor_data = response.json()
                         if anchor_data.get('code') == 0 and anchor_data.get('data') and 'info' in anchor_data['data']:
@@ -369,16 +506,9 @@ class LiveRecordingThread(QThread):
             print(f"FFmpeg命令: {' '.join(debug_cmd)}")
             
             try:
-                # 启动录制进程
-                self.process = subprocess.Popen(
-                    cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    encoding='utf-8',
-                    errors='replace',
-                    bufsize=1
-                )
+                # 启动录制进程，由监督器同时排空stdout和stderr
+                supervisor = ProcessSupervisor(cmd, bufsize=1)
+                self.process = supervisor.process
             except Exception as e:
                 error_msg = f"启动FFmpeg进程失败: {str(e)}"
                 print(error_msg)
@@ -391,38 +521,31 @@ class LiveRecordingThread(QThread):
             # 启动心跳检测
             self.start_heartbeat()
             
-            # 监控进程输出
-            while self.process.poll() is None:
-                if not self.is_running:
-                    self.process.terminate()
-                    self.progress_updated.emit(self.room_id, 0, "录制已停止")
-                    return
+            # 监控进程输出（FFmpeg的进度信息写在stderr）
+            for stream, line in supervisor.iter_lines(should_stop=lambda: not self.is_running):
+                line = line.strip()
+                if stream != "stderr" or not line:
+                    continue
                 
-                # 读取一行输出，设置超时
-                try:
-                    line = self.process.stderr.readline().strip()
-                    if line:
-                        # 输出调试信息
-                        if "error" in line.lower() or "fail" in line.lower():
-                            print(f"FFmpeg警告/错误: {line}")
-                        
-                        # 提取时间信息
-                        time_match = re.search(r'time=(\d+:\d+:\d+\.\d+)', line)
-                        if time_match:
-                            time_str = time_match.group(1)
-                            # 更新进度
-                            self.progress_updated.emit(self.room_id, 50, f"正在录制: {time_str}")
-                    else:
-                        # 睡眠一小段时间，避免CPU占用过高
-                        time.sleep(0.1)
-                except Exception as e:
-                    # 读取过程中出错，记录错误
-                    print(f"读取FFmpeg输出错误: {e}")
-                    time.sleep(0.5)  # 出错后等待一段时间
+                # 输出调试信息
+                if "error" in line.lower() or "fail" in line.lower():
+                    print(f"FFmpeg警告/错误: {line}")
+                
+                # 提取时间信息
+                time_match = re.search(r'time=(\d+:\d+:\d+\.\d+)', line)
+                if time_match:
+                    time_str = time_match.group(1)
+                    # 更新进度
+                    self.progress_updated.emit(self.room_id, 50, f"正在录制: {time_str}")
+            
+            if not self.is_running:
+                self.progress_updated.emit(self.room_id, 0, "录制已停止")
+                return
             
             # 检查是否成功
+            supervisor.wait(5)
             if self.process.returncode != 0 and self.is_running:
-                error = self.process.stderr.read()
+                error = supervisor.stderr_text()
                 self.progress_updated.emit(self.room_id, 0, f"录制意外停止")
                 
                 # 检查文件是否存在且有内容
@@ -516,43 +639,30 @@ class LiveRecordingThread(QThread):
             print(f"弹幕录制出错: {e}")
     
     def start_heartbeat(self):
-        """开始心跳检测"""
-        self.check_stream_status()
+        """开始心跳检测，由共享的轮询器批量查询直播状态"""
+        if not self.heartbeat_active:
+            self.heartbeat_active = True
+            get_room_status_poller().watch(self.room_id, self.check_stream_status)
         
-    def check_stream_status(self):
-        """检查直播流状态"""
+    def check_stream_status(self, room_id, stream_info):
+        """直播状态变化时由轮询器回调"""
         if not self.is_running:
             return
-            
-        try:
-            stream_info = self.get_stream_info()
-            
-            if stream_info and stream_info.get('live_status') != 1:
-                print("直播已结束")
-                if self.process and self.process.poll() is None:
-                    self.process.terminate()
-                return
-            
-            # 更新流信息
-            self.stream_info_updated.emit(self.room_id, stream_info or {})
-            
-            # 设置下一次检查
-            self.heartbeat_timer = Timer(self.check_interval, self.check_stream_status)
-            self.heartbeat_timer.daemon = True
-            self.heartbeat_timer.start()
-            
-        except Exception as e:
-            print(f"检查直播状态出错: {e}")
-            # 设置下一次检查
-            self.heartbeat_timer = Timer(self.check_interval, self.check_stream_status)
-            self.heartbeat_timer.daemon = True
-            self.heartbeat_timer.start()
+        
+        if stream_info.get('live_status') != 1:
+            print("直播已结束")
+            if self.process and self.process.poll() is None:
+                self.process.terminate()
+            return
+        
+        # 更新流信息
+        self.stream_info_updated.emit(self.room_id, stream_info)
     
     def stop_heartbeat(self):
         """停止心跳检测"""
-        if self.heartbeat_timer:
-            self.heartbeat_timer.cancel()
-            self.heartbeat_timer = None
+        if self.heartbeat_active:
+            self.heartbeat_active = False
+            get_room_status_poller().unwatch(self.room_id, self.check_stream_status)
     
     def stop(self):
         """安全停止录制"""
@@ -3619,6 +3729,14 @@ class BilibiliLiveRecorderPlugin(PluginBase):
         # 记录需要录制的房间
         rooms_to_record = []
         
+        # 先用批量接口一次查询全部房间，只为正在直播的房间获取直播流
+        room_ids = [room_info if isinstance(room_info, str) else room_info.get('room_id', '') for room_info in auto_rooms]
+        try:
+            statuses = fetch_room_statuses([room_id for room_id in room_ids if room_id])
+        except Exception as e:
+            print(f"批量查询直播间状态失败，逐个检查: {e}")
+            statuses = None
+        
         for room_info in auto_rooms:
             if isinstance(room_info, str):
                 room_id = room_info
@@ -3632,6 +3750,9 @@ class BilibiliLiveRecorderPlugin(PluginBase):
             if hasattr(self, 'recording_threads') and room_id in self.recording_threads:
                 print(f"房间 {room_id} 已在录制中，跳过检查")
                 continue
+            
+            if statuses is not None and (statuses.get(str(room_id)) or {}).get('live_status') != 1:
+                continue
                 
             # 检查是否正在直播
             try:
@@ -3768,6 +3889,9 @@ class BilibiliLiveRecorderPlugin(PluginBase):
         if hasattr(self, 'live_recorder_button'):
             self.live_recorder_button = None
         
+        if _http_client is not None:
+            _http_client.log_metrics("B站直播接口请求统计")
+        
         # 刷新UI
         QApplication.processEvents()
         print("B站直播录制插件UI资源清理完成")
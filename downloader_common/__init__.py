@@ -0,0 +1,36 @@
+"""各下载插件共用的组件
+
+B站、AcFun、TikTok下载插件和B站直播录制插件都从这里导入，不再各自保存一份副本。
+插件目录需要在 sys.path 中，各插件在导入本包之前自行添加。
+"""
+from .process import ProcessSupervisor
+from .ytdlp import YTDLP_WORKER_SCRIPT, ytdlp_cli_args, YtdlpWorker, YtdlpWorkerPool, get_ytdlp_pool
+from .progress import format_size, format_duration, format_progress_message, ProgressAggregator
+from .journal import DownloadJournal, remove_partial_files
+from .bandwidth import (TokenBucket, BandwidthManager, get_bandwidth_manager, ADAPTIVE_PROBE_SECONDS,
+                        get_measured_throughput, set_measured_throughput, ThroughputMeter, choose_within_budget,
+                        parse_bandwidth_schedule, format_bandwidth_schedule)
+from .postprocess import PostProcessPool, get_postprocess_pool
+from .archive import (ARCHIVE_MEDIA_EXTENSIONS, ARCHIVE_ID_PATTERNS, file_sha256, DownloadArchive,
+                      get_download_archive, ArchiveScanThread)
+from .download_queue import parse_url_list, DownloadQueue
+from .prefetch import PREFETCH_LIMIT, describe_prefetched_metadata, MetadataPrefetcher
+from .headless import JsonLinesReporter, iter_job_urls, build_headless_parser, run_headless
+from .http_client import BilibiliHttpClient
+
+__all__ = [
+    'ProcessSupervisor',
+    'YTDLP_WORKER_SCRIPT', 'ytdlp_cli_args', 'YtdlpWorker', 'YtdlpWorkerPool', 'get_ytdlp_pool',
+    'format_size', 'format_duration', 'format_progress_message', 'ProgressAggregator',
+    'DownloadJournal', 'remove_partial_files',
+    'TokenBucket', 'BandwidthManager', 'get_bandwidth_manager', 'ADAPTIVE_PROBE_SECONDS',
+    'get_measured_throughput', 'set_measured_throughput', 'ThroughputMeter', 'choose_within_budget',
+    'parse_bandwidth_schedule', 'format_bandwidth_schedule',
+    'PostProcessPool', 'get_postprocess_pool',
+    'ARCHIVE_MEDIA_EXTENSIONS', 'ARCHIVE_ID_PATTERNS', 'file_sha256', 'DownloadArchive',
+    'get_download_archive', 'ArchiveScanThread',
+    'parse_url_list', 'DownloadQueue',
+    'PREFETCH_LIMIT', 'describe_prefetched_metadata', 'MetadataPrefetcher',
+    'JsonLinesReporter', 'iter_job_urls', 'build_headless_parser', 'run_headless',
+    'BilibiliHttpClient',
+]
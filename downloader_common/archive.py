@@ -0,0 +1,155 @@
+"""已下载视频记录（SQLite），用于跳过已经下载过的视频"""
+import os
+import re
+import time
+import threading
+from PyQt5.QtCore import QThread, pyqtSignal
+
+
+ARCHIVE_MEDIA_EXTENSIONS = ('.mp4', '.mkv', '.flv', '.webm', '.m4a', '.mp3', '.mov')
+
+# 从文件名中识别视频ID，用于批量索引已有的下载目录
+ARCHIVE_ID_PATTERNS = (
+    ("bilibili", re.compile(r'(?<![0-9A-Za-z])(BV[0-9A-Za-z]{10})(?![0-9A-Za-z])')),
+    ("bilibili", re.compile(r'(?<![0-9A-Za-z])(av\d+)(?![0-9A-Za-z])', re.IGNORECASE)),
+    ("acfun", re.compile(r'(?<![0-9A-Za-z])(ac\d+)(?![0-9A-Za-z])', re.IGNORECASE)),
+    ("tiktok", re.compile(r'[\[(](\d{15,20})[\])]')),
+)
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """分块计算文件的SHA-256"""
+    import hashlib
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DownloadArchive:
+    """跨站点的已下载记录
+
+    用SQLite保存 (站点, 视频ID, 清晰度) -> 文件路径、大小、SHA-256，所有下载插件共用同一个数据库，
+    下载线程在访问网络之前先按主键查询，已下载且文件仍然存在的视频直接跳过。
+    批量索引得到的记录清晰度为空，表示任意清晰度都视为已下载。
+    """
+    
+    def __init__(self, db_file):
+        import sqlite3
+        
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False, timeout=30)
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS downloads (
+                    site TEXT NOT NULL,
+                    video_id TEXT NOT NULL,
+                    quality TEXT NOT NULL DEFAULT '',
+                    path TEXT NOT NULL,
+                    size INTEGER,
+                    sha256 TEXT,
+                    title TEXT,
+                    downloaded_at REAL,
+                    PRIMARY KEY (site, video_id, quality)
+                )
+            """)
+    
+    def lookup(self, site, video_id, quality=''):
+        """查询视频是否已下载，返回记录字典；文件已被删除或大小变化时清除记录并返回None"""
+        if not video_id:
+            return None
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT site, video_id, quality, path, size, sha256, title FROM downloads "
+                "WHERE site = ? AND video_id = ? AND quality IN (?, '') ORDER BY quality DESC LIMIT 1",
+                (site, video_id, str(quality or ''))
+            ).fetchone()
+        if row is None:
+            return None
+        entry = dict(zip(("site", "video_id", "quality", "path", "size", "sha256", "title"), row))
+        try:
+            size_matches = os.path.getsize(entry["path"]) == entry["size"]
+        except OSError:
+            size_matches = False
+        if not size_matches:
+            self.remove(site, video_id, entry["quality"])
+            return None
+        return entry
+    
+    def record(self, site, video_id, quality, path, title=None, sha256=None):
+        """记录一个下载完成的文件"""
+        if not video_id or not path or not os.path.exists(path):
+            return
+        try:
+            size = os.path.getsize(path)
+            if sha256 is None:
+                sha256 = file_sha256(path)
+        except OSError as e:
+            print(f"读取已下载文件失败: {e}")
+            return
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO downloads (site, video_id, quality, path, size, sha256, title, downloaded_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (site, video_id, str(quality or ''), os.path.abspath(path), size, sha256, title, time.time())
+            )
+    
+    def remove(self, site, video_id, quality=''):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM downloads WHERE site = ? AND video_id = ? AND quality = ?",
+                              (site, video_id, str(quality or '')))
+    
+    def scan_directory(self, directory, hash_files=True):
+        """批量索引已有目录：从文件名中识别视频ID并登记，返回 (登记数, 扫描的媒体文件数)"""
+        indexed = scanned = 0
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if not name.lower().endswith(ARCHIVE_MEDIA_EXTENSIONS):
+                    continue
+                scanned += 1
+                for site, pattern in ARCHIVE_ID_PATTERNS:
+                    match = pattern.search(name)
+                    if match:
+                        video_id = match.group(1)
+                        if site == "bilibili" and video_id[:2].lower() == "av":
+                            video_id = "av" + video_id[2:]
+                        elif site == "acfun":
+                            video_id = video_id.lower()
+                        path = os.path.join(root, name)
+                        self.record(site, video_id, '', path, os.path.splitext(name)[0],
+                                    sha256=None if hash_files else '')
+                        indexed += 1
+                        break
+        return indexed, scanned
+
+
+_download_archive = None
+_download_archive_lock = threading.Lock()
+
+
+def get_download_archive():
+    """获取已下载记录，数据库位于插件目录上一级，所有下载插件共用"""
+    global _download_archive
+    with _download_archive_lock:
+        if _download_archive is None:
+            plugins_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            _download_archive = DownloadArchive(os.path.join(plugins_dir, "download_archive.db"))
+        return _download_archive
+
+
+class ArchiveScanThread(QThread):
+    """在后台批量索引已有下载目录"""
+    scan_complete = pyqtSignal(int, int)  # 登记数, 扫描的媒体文件数
+    
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+    
+    def run(self):
+        try:
+            indexed, scanned = get_download_archive().scan_directory(self.directory)
+        except Exception as e:
+            print(f"索引下载目录失败: {e}")
+            indexed, scanned = 0, 0
+        self.scan_complete.emit(indexed, scanned)
@@ -0,0 +1,299 @@
+"""令牌桶限速、各下载插件共用的带宽管理器，以及自适应画质用的吞吐量测量"""
+import os
+import re
+import json
+import time
+import threading
+
+
+class TokenBucket:
+    """令牌桶限速器，rate 为每秒字节数，0 表示不限速
+
+    取令牌时允许透支，透支的部分换算成调用方需要等待的秒数，
+    这样多个线程同时取令牌时总速率仍然不超过 rate。
+    capacity 为最多积攒的令牌数，默认1秒的流量（至少64KB）；按请求数限速时设为允许的突发请求数。
+    """
+    
+    def __init__(self, rate=0, capacity=None):
+        self.lock = threading.Lock()
+        self.rate = 0
+        self.burst = capacity
+        self.capacity = 0
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.set_rate(rate)
+    
+    def set_rate(self, rate):
+        with self.lock:
+            self.rate = max(0, int(rate or 0))
+            self.capacity = self.burst or max(self.rate, 64 * 1024)  # 最多积攒1秒的流量
+            self.tokens = min(self.tokens, self.capacity)
+    
+    def reserve(self, amount):
+        """取走 amount 个令牌，返回需要等待的秒数"""
+        with self.lock:
+            if not self.rate:
+                return 0.0
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+
+class BandwidthManager:
+    """全局带宽管理器
+
+    配置包含全局上限、各站点上限（KB/s，0为不限）以及按时间段生效的限速方案，
+    保存在插件目录上一级的 bandwidth.json 中，所有下载插件共用同一份配置。
+    内置下载器按字节从令牌桶取令牌；yt-dlp任务拿到上限按任务数平分后的份额，
+    有任务开始或结束时份额会重新计算。两类任务同时存在时，令牌桶的速率只占
+    内置下载任务对应的那部分，保证总速率不超过上限。
+    """
+    REFRESH_INTERVAL = 10  # 重新检查时间段方案的间隔（秒）
+    
+    def __init__(self, config_file):
+        self.config_file = config_file
+        self.lock = threading.Lock()
+        self.config = {"global_kbps": 0, "sites": {}, "schedule": []}
+        self.global_bucket = TokenBucket()
+        self.site_buckets = {}
+        self.jobs = {}  # 任务编号 -> (站点, 是否内置下载器)
+        self.job_counter = 0
+        self.limits = (0, {})
+        self.last_refresh = 0
+        self.load_config()
+    
+    def load_config(self):
+        """从磁盘加载带宽配置"""
+        try:
+            if os.path.exists(self.config_file):
+                with open(self.config_file, 'r', encoding='utf-8') as f:
+                    self.config.update(json.load(f))
+        except Exception as e:
+            print(f"加载带宽配置失败: {e}")
+        self.refresh(force=True)
+    
+    def save_config(self, **changes):
+        """修改并保存带宽配置，立即生效"""
+        with self.lock:
+            self.config.update(changes)
+            data = dict(self.config)
+        try:
+            with open(self.config_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=4)
+        except Exception as e:
+            print(f"保存带宽配置失败: {e}")
+        self.refresh(force=True)
+    
+    @staticmethod
+    def _in_period(period, minutes):
+        try:
+            start_h, start_m = map(int, period["start"].split(":"))
+            end_h, end_m = map(int, period["end"].split(":"))
+        except (KeyError, ValueError):
+            return False
+        start, end = start_h * 60 + start_m, end_h * 60 + end_m
+        if start <= end:
+            return start <= minutes < end
+        return minutes >= start or minutes < end  # 跨越午夜的时间段
+    
+    def current_limits(self, now=None):
+        """返回当前生效的 (全局上限, {站点: 上限})，单位字节/秒"""
+        with self.lock:
+            config = dict(self.config)
+        local = time.localtime(now)
+        minutes = local.tm_hour * 60 + local.tm_min
+        global_kbps = config.get("global_kbps", 0)
+        sites = dict(config.get("sites") or {})
+        for period in config.get("schedule") or []:
+            if self._in_period(period, minutes):
+                global_kbps = period.get("global_kbps", global_kbps)
+                sites.update(period.get("sites") or {})
+                break
+        return int(global_kbps or 0) * 1024, {site: int(kbps or 0) * 1024 for site, kbps in sites.items()}
+    
+    def refresh(self, force=False):
+        """按当前时间段更新限速，并重新分配各任务的份额"""
+        now = time.time()
+        if not force and now - self.last_refresh < self.REFRESH_INTERVAL:
+            return
+        self.last_refresh = now
+        limits = self.current_limits(now)
+        with self.lock:
+            self.limits = limits
+            self._rebalance()
+    
+    def _rebalance(self):
+        """令牌桶速率 = 上限 × 内置下载任务数 / 总任务数（调用时需持有锁）"""
+        global_limit, site_limits = self.limits
+        total = len(self.jobs)
+        native = sum(1 for _, is_native in self.jobs.values() if is_native)
+        self.global_bucket.set_rate(global_limit * native // total if total and native else global_limit)
+        for site in set(site_limits) | set(self.site_buckets):
+            site_jobs = [is_native for job_site, is_native in self.jobs.values() if job_site == site]
+            site_native = sum(1 for is_native in site_jobs if is_native)
+            limit = site_limits.get(site, 0)
+            rate = limit * site_native // len(site_jobs) if site_jobs and site_native else limit
+            self.site_buckets.setdefault(site, TokenBucket()).set_rate(rate)
+    
+    def register(self, site, native=False):
+        """登记一个开始下载的任务，返回任务编号"""
+        self.refresh()
+        with self.lock:
+            self.job_counter += 1
+            self.jobs[self.job_counter] = (site, native)
+            self._rebalance()
+            return self.job_counter
+    
+    def unregister(self, job_id):
+        """任务结束，其余任务的份额随之增加"""
+        with self.lock:
+            self.jobs.pop(job_id, None)
+            self._rebalance()
+    
+    def job_rate(self, job_id):
+        """yt-dlp任务当前可用的速率（字节/秒），0 表示不限速"""
+        self.refresh()
+        with self.lock:
+            if job_id not in self.jobs:
+                return 0
+            site = self.jobs[job_id][0]
+            global_limit, site_limits = self.limits
+            shares = []
+            if global_limit:
+                shares.append(global_limit // len(self.jobs))
+            if site_limits.get(site):
+                site_jobs = sum(1 for job_site, _ in self.jobs.values() if job_site == site)
+                shares.append(site_limits[site] // site_jobs)
+            return max(1024, min(shares)) if shares else 0
+    
+    def throttle(self, site, amount, should_stop=None):
+        """内置下载器每写入 amount 字节调用一次，超出速率时在这里等待"""
+        self.refresh()
+        with self.lock:
+            site_bucket = self.site_buckets.setdefault(site, TokenBucket())
+        delay = max(self.global_bucket.reserve(amount), site_bucket.reserve(amount))
+        deadline = time.monotonic() + delay
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (should_stop and should_stop()):
+                return
+            time.sleep(min(remaining, 0.5))
+
+
+_bandwidth_manager = None
+_bandwidth_manager_lock = threading.Lock()
+
+
+def get_bandwidth_manager(app=None):
+    """获取带宽管理器
+
+    管理器挂在主程序实例上，使各个下载插件共用同一个全局上限；没有主程序实例时使用模块级单例。
+    """
+    global _bandwidth_manager
+    manager = getattr(app, 'bandwidth_manager', None) if app is not None else None
+    if manager is None:
+        with _bandwidth_manager_lock:
+            if _bandwidth_manager is None:
+                plugins_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+                _bandwidth_manager = BandwidthManager(os.path.join(plugins_dir, "bandwidth.json"))
+        manager = _bandwidth_manager
+        if app is not None:
+            try:
+                app.bandwidth_manager = manager
+            except Exception:
+                pass
+    return manager
+
+
+# 自适应画质：任务开始后先测量这么多秒的实际吞吐量，再决定画质
+ADAPTIVE_PROBE_SECONDS = 5
+
+# 各站点最近一次测得的总吞吐量（字节/秒），作为下一个任务初选画质的依据
+_measured_throughput = {}
+
+
+def get_measured_throughput(site):
+    """站点最近一次测得的总吞吐量，还没有测过时返回 None"""
+    return _measured_throughput.get(site)
+
+
+def set_measured_throughput(site, rate):
+    """记录站点本次测得的总吞吐量"""
+    _measured_throughput[site] = rate
+
+
+class ThroughputMeter:
+    """测量下载开始后一段时间内的实际吞吐量
+
+    按调用线程（即下载连接）分别累计字节数，得到总吞吐量和每个连接的平均吞吐量。
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.total = 0
+        self.per_connection = {}  # 线程ID -> 字节数
+    
+    def add(self, count):
+        ident = threading.get_ident()
+        with self.lock:
+            self.total += count
+            self.per_connection[ident] = self.per_connection.get(ident, 0) + count
+    
+    def elapsed(self):
+        return time.time() - self.start
+    
+    def snapshot(self):
+        """返回 (总吞吐量, 每个连接的平均吞吐量, 连接数)，吞吐量单位为字节/秒"""
+        elapsed = max(self.elapsed(), 0.001)
+        with self.lock:
+            connections = len(self.per_connection) or 1
+            return self.total / elapsed, self.total / connections / elapsed, connections
+
+
+def choose_within_budget(options, rate, budget):
+    """从按画质从高到低排列的 [(选项, 还需下载的字节数)] 中选出预计能在 budget 秒内下完的最高画质
+
+    速率未知时选最高画质，都来不及时选最低画质。
+    """
+    if not rate:
+        return options[0][0]
+    for option, remaining in options:
+        if remaining / rate <= budget:
+            return option
+    return options[-1][0]
+
+
+def parse_bandwidth_schedule(text):
+    """解析时间段限速方案，每行形如 "23:00-07:00 global=0 bilibili=4096"（单位KB/s），无效行被忽略"""
+    schedule = []
+    for line in text.splitlines():
+        parts = line.split()
+        match = re.match(r'^(\d{1,2}:\d{2})-(\d{1,2}:\d{2})$', parts[0]) if parts else None
+        if not match:
+            continue
+        period = {"start": match.group(1), "end": match.group(2), "sites": {}}
+        for item in parts[1:]:
+            name, _, value = item.partition("=")
+            if not value.isdigit():
+                continue
+            if name == "global":
+                period["global_kbps"] = int(value)
+            else:
+                period["sites"][name] = int(value)
+        schedule.append(period)
+    return schedule
+
+
+def format_bandwidth_schedule(schedule):
+    """把时间段限速方案转换回文本，与 parse_bandwidth_schedule 互逆"""
+    lines = []
+    for period in schedule or []:
+        items = [f"{period['start']}-{period['end']}"]
+        if "global_kbps" in period:
+            items.append(f"global={period['global_kbps']}")
+        items.extend(f"{site}={kbps}" for site, kbps in (period.get("sites") or {}).items())
+        lines.append(" ".join(items))
+    return "\n".join(lines)
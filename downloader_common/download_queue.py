@@ -0,0 +1,171 @@
+"""批量下载队列：去重、限制并发数、转发进度和完成信号"""
+import re
+from collections import deque
+from urllib.parse import urlparse
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from .journal import remove_partial_files
+
+
+def parse_url_list(text):
+    """从粘贴的文本或文件内容中提取所有链接，保持原有顺序"""
+    return re.findall(r'https?://[^\s"\'<>]+', text or "")
+
+
+class DownloadQueue(QObject):
+    """批量下载队列
+
+    接收多个链接，自动去除与队列中未完成任务重复的链接，并以有限的并发数同时运行多个下载线程；
+    失败或取消的链接可以重新加入队列。
+    线程由 thread_factory(url, **options) 创建，必须提供 progress_updated 和
+    download_complete(成功状态, 消息, 文件路径) 信号，参数会原样转发到 item_complete。
+    提供 progress_bus 时，线程的进度改为上报给该 ProgressAggregator，不再逐条发信号。
+    提供 journal 时，任务会记录到该 DownloadJournal，成功或取消后才删除记录。
+    线程结束时 postprocessing 属性为True表示收尾工作已交给后处理线程池，下载名额立即释放，
+    之后由后处理线程发出 download_complete。
+    """
+    item_added = pyqtSignal(str, str)  # 任务键, 链接
+    item_progress = pyqtSignal(str, int, str)  # 任务键, 进度, 状态消息
+    item_complete = pyqtSignal(str, bool, str, str)  # 任务键, 成功状态, 消息, 文件路径
+    queue_finished = pyqtSignal(int, int)  # 成功数, 失败数
+    
+    def __init__(self, thread_factory, max_concurrent=3, key_func=None, progress_bus=None, journal=None, parent=None):
+        super().__init__(parent)
+        self.thread_factory = thread_factory
+        self.progress_bus = progress_bus
+        self.journal = journal
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.key_func = key_func or self.normalize_url
+        self.pending = deque()  # 等待中的 (任务键, 链接, 下载选项)
+        self.active = {}  # 任务键 -> 下载线程
+        self.postprocessing = {}  # 任务键 -> 已下载完、正在后处理线程池中收尾的下载线程
+        self.results = {}  # 任务键 -> 是否成功
+        self.is_cancelled = False
+    
+    @staticmethod
+    def normalize_url(url):
+        """规范化链接，去掉锚点、跟踪参数和末尾斜杠，作为去重依据"""
+        parsed = urlparse(url.strip())
+        query = "&".join(part for part in parsed.query.split("&")
+                         if part and not part.startswith(("spm_id_from", "vd_source", "share_")))
+        path = parsed.path.rstrip("/")
+        return f"{parsed.netloc.lower()}{path}" + (f"?{query}" if query else "")
+    
+    def set_max_concurrent(self, value):
+        """修改并发数，新的限制会在下一次调度时生效"""
+        self.max_concurrent = max(1, int(value))
+        self._schedule()
+    
+    def add_urls(self, urls, options=None):
+        """添加链接到队列，返回实际加入的任务键列表（与未完成任务重复的链接会被忽略）
+
+        options 是传给 thread_factory 的关键字参数，在加入队列时固定下来，
+        之后修改界面上的选项不会影响已排队的任务。
+        """
+        self.is_cancelled = False
+        added = []
+        for url in urls:
+            url = url.strip()
+            if not url:
+                continue
+            key = self.key_func(url)
+            if self.has_job(key):
+                continue
+            self.pending.append((key, url, dict(options or {})))
+            if self.journal is not None:
+                self.journal.add(key, url, options)
+            added.append(key)
+            self.item_added.emit(key, url)
+        self._schedule()
+        return added
+    
+    def _schedule(self):
+        """在并发限制内启动等待中的任务"""
+        while self.pending and len(self.active) < self.max_concurrent and not self.is_cancelled:
+            key, url, options = self.pending.popleft()
+            try:
+                thread = self.thread_factory(url, **options)
+            except Exception as e:
+                print(f"创建下载线程失败: {e}")
+                self.results[key] = False
+                self.item_complete.emit(key, False, str(e), "")
+                continue
+            thread.job_key = key
+            thread.journal = self.journal
+            if self.progress_bus is not None:
+                thread.progress_bus = self.progress_bus
+            else:
+                thread.progress_updated.connect(
+                    lambda value, message, key=key: self.item_progress.emit(key, value, message))
+            thread.download_complete.connect(
+                lambda *args, key=key: self._on_item_complete(key, *args))
+            # 必须等线程真正结束后再释放引用，否则QThread会在运行中被销毁
+            thread.finished.connect(lambda key=key: self._on_thread_finished(key))
+            self.active[key] = thread
+            thread.start()
+        self._check_finished()
+    
+    def _on_item_complete(self, key, success, *args):
+        if self.progress_bus is not None:
+            self.progress_bus.discard(key)
+        if self.journal is not None:
+            if success:
+                self.journal.remove(key)
+            elif self.is_cancelled:
+                # 用户主动取消，不再续传，顺便清理未完成的临时文件
+                entry = self.journal.get(key) or {}
+                remove_partial_files(entry.get("partial_files"))
+                self.journal.remove(key)
+            else:
+                self.journal.mark_failed(key, next((str(arg) for arg in args if arg), ""))
+        self.results[key] = bool(success)
+        thread = self.postprocessing.pop(key, None)
+        if thread is not None:
+            thread.deleteLater()
+        self.item_complete.emit(key, bool(success), *args)
+        self._check_finished()
+    
+    def _on_thread_finished(self, key):
+        thread = self.active.pop(key, None)
+        if thread is not None:
+            if getattr(thread, 'postprocessing', False) and key not in self.results:
+                # 网络传输已完成，后处理期间保留线程对象，等它发出完成信号
+                self.postprocessing[key] = thread
+            else:
+                thread.deleteLater()
+        if key not in self.results and key not in self.postprocessing:
+            # 线程异常退出而没有发出完成信号
+            self.results[key] = False
+            self.item_complete.emit(key, False, "下载线程意外退出", "")
+        self._schedule()
+    
+    def _check_finished(self):
+        if not self.pending and not self.active and not self.postprocessing and self.results:
+            succeeded = sum(1 for ok in self.results.values() if ok)
+            failed = len(self.results) - succeeded
+            self.results = {}
+            self.queue_finished.emit(succeeded, failed)
+    
+    def has_job(self, key):
+        """任务是否还在等待、下载或后处理中，用于去重"""
+        return key in self.active or key in self.postprocessing or any(item[0] == key for item in self.pending)
+    
+    def is_busy(self):
+        """队列中是否还有未完成的任务"""
+        return bool(self.pending or self.active or self.postprocessing)
+    
+    def cancel_all(self):
+        """清空等待中的任务并停止正在运行的下载"""
+        self.is_cancelled = True
+        while self.pending:
+            key = self.pending.popleft()[0]
+            self.results[key] = False
+            if self.journal is not None:
+                self.journal.remove(key)
+            self.item_complete.emit(key, False, "已取消", "")
+        for thread in list(self.active.values()) + list(self.postprocessing.values()):
+            # 告诉线程这是用户取消，不必为续传保留临时文件
+            thread.user_cancelled = True
+            if hasattr(thread, 'stop'):
+                thread.stop()
+        self._check_finished()
@@ -0,0 +1,225 @@
+"""无界面的命令行下载入口：JSON行输出、任务文件和中断后续传"""
+import sys
+import json
+import time
+import queue
+import threading
+from PyQt5.QtCore import Qt
+
+from .ytdlp import get_ytdlp_pool
+
+
+class JsonLinesReporter:
+    """命令行模式的输出：每个事件一行JSON，写到标准输出便于脚本解析
+
+    提供与 ProgressAggregator 相同的 report/discard 接口，可以直接作为下载线程的 progress_bus；
+    同一任务的进度最多每 interval 秒输出一行。
+    """
+    
+    def __init__(self, stream, interval=1.0):
+        self.stream = stream
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.last_report = {}  # 任务键 -> 上次输出进度的时间
+    
+    def emit(self, event, **fields):
+        line = json.dumps(dict(event=event, time=round(time.time(), 3), **fields), ensure_ascii=False)
+        with self.lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+    
+    def report(self, job_key, percent=None, message=None, **fields):
+        now = time.time()
+        with self.lock:
+            if now - self.last_report.get(job_key, 0) < self.interval and not message:
+                return
+            self.last_report[job_key] = now
+        fields = {key: value for key, value in fields.items() if value is not None}
+        self.emit("progress", job=job_key, percent=round(percent, 1) if percent is not None else None,
+                  message=message, **fields)
+    
+    def discard(self, job_key):
+        with self.lock:
+            self.last_report.pop(job_key, None)
+
+
+def iter_job_urls(urls, input_file=None):
+    """依次产出命令行参数和任务文件中的链接，"-" 表示标准输入
+
+    标准输入逐行读取，通过管道持续写入链接时会一直接收新任务。
+    """
+    for url in urls:
+        yield url
+    if not input_file:
+        return
+    stream = sys.stdin if input_file == "-" else open(input_file, "r", encoding="utf-8", errors="replace")
+    try:
+        for line in stream:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def build_headless_parser(prog, description):
+    """命令行模式的通用参数，各插件再添加自己的下载选项"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(prog=prog, description=description)
+    parser.add_argument("urls", nargs="*", help="视频链接")
+    parser.add_argument("-i", "--input", help="任务文件，每行一个链接；- 表示从标准输入读取")
+    parser.add_argument("-o", "--output-dir", help="下载目录")
+    parser.add_argument("-j", "--jobs", type=int, default=3, help="同时下载数 (默认 3)")
+    parser.add_argument("--no-skip", action="store_true", help="不跳过已下载过的视频")
+    parser.add_argument("--resume", action="store_true", help="先继续上次未完成的任务")
+    parser.add_argument("--progress-interval", type=float, default=1.0, help="同一任务进度输出的最小间隔秒数")
+    return parser
+
+
+def run_headless(args, thread_factory, key_func, journal=None, result_fields=None, options=None):
+    """不依赖Qt事件循环运行下载任务，进度以JSON行输出，返回退出码
+
+    下载线程由 thread_factory(url, **options) 创建，options 是本次命令行的下载选项，随任务记入
+    断点续传日志；--resume 恢复的任务使用日志中记录的选项，不受本次命令行参数影响。
+    每个工作线程直接调用下载线程对象的 run()，完成信号以直连方式在发出它的线程中处理；
+    下载线程把收尾工作交给后处理线程池时，工作线程不等待，直接领取下一个任务。
+    退出码: 0 全部成功（含已下载过而跳过的），1 有任务失败，2 没有任务，130 被中断。
+    中断时未完成的任务和已下载的部分文件都保留，下次加 --resume 继续。
+    """
+    import signal
+    
+    # 下载代码中的 print 改写到标准错误，标准输出只保留JSON行
+    reporter = JsonLinesReporter(sys.stdout, args.progress_interval)
+    sys.stdout = sys.stderr
+    # 服务器上常用SIGTERM结束进程，按Ctrl+C同样处理
+    def on_sigterm(signum, frame):
+        raise KeyboardInterrupt()
+    signal.signal(signal.SIGTERM, on_sigterm)
+    
+    input_file = args.input
+    if not args.urls and not input_file and not sys.stdin.isatty():
+        input_file = "-"
+    options = dict(options or {})
+    resumed = ([(entry["url"], entry.get("options") or {}) for key, entry in journal.unfinished()]
+               if journal is not None and args.resume else [])
+    
+    concurrency = max(1, args.jobs)
+    jobs = queue.Queue(maxsize=concurrency)  # 有界队列，标准输入的读取速度跟随下载进度
+    active = {}  # 任务键 -> 下载线程（下载中或后处理中），尚未创建时为None
+    counts = {"succeeded": 0, "failed": 0}
+    lock = threading.Lock()
+    interrupted = threading.Event()
+    all_done = threading.Event()
+    remaining_workers = [concurrency]
+    
+    def check_done():
+        # 调用方需持有 lock
+        if not remaining_workers[0] and not active:
+            all_done.set()
+    
+    def worker():
+        try:
+            run_jobs()
+        finally:
+            with lock:
+                remaining_workers[0] -= 1
+                check_done()
+    
+    def finish(key, url, result):
+        # 每个任务只处理第一次完成信号
+        with lock:
+            if key not in active:
+                return
+        success = bool(result[0])
+        reporter.discard(key)
+        if journal is not None and not interrupted.is_set():
+            if success:
+                journal.remove(key)
+            else:
+                journal.mark_failed(key, next((str(arg) for arg in result[1:] if arg), ""))
+        fields = result_fields(result) if result_fields else {"result": [str(arg) for arg in result[1:]]}
+        reporter.emit("finished", job=key, url=url, success=success, **fields)
+        with lock:
+            counts["succeeded" if success else "failed"] += 1
+            active.pop(key, None)
+            check_done()
+    
+    def run_jobs():
+        while True:
+            item = jobs.get()
+            if item is None:
+                return
+            key, url, job_options = item
+            with lock:
+                active[key] = None
+            thread = None
+            try:
+                thread = thread_factory(url, **job_options)
+                thread.job_key = key
+                thread.journal = journal
+                thread.progress_bus = reporter
+                thread.download_complete.connect(lambda *result, key=key, url=url: finish(key, url, result), Qt.DirectConnection)
+                with lock:
+                    active[key] = thread
+                reporter.emit("started", job=key, url=url)
+                thread.run()
+            except Exception as e:
+                finish(key, url, (False, str(e)))
+            if not getattr(thread, 'postprocessing', False):
+                finish(key, url, (False, "下载线程意外退出"))
+    
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in workers:
+        thread.start()
+    
+    seen = set()
+    
+    def put_job(url, job_options):
+        key = key_func(url)
+        if key in seen:
+            return
+        seen.add(key)
+        if journal is not None:
+            journal.add(key, url, job_options)
+        jobs.put((key, url, job_options))
+    
+    try:
+        for url, job_options in resumed:
+            put_job(url, job_options)
+        for url in iter_job_urls(args.urls, input_file):
+            put_job(url, options)
+        for _ in workers:
+            jobs.put(None)
+        # 不用 Thread.join 等待：join 被Ctrl+C打断后线程状态会出错
+        while not all_done.wait(0.5):
+            pass
+    except KeyboardInterrupt:
+        interrupted.set()
+        reporter.emit("interrupted")
+        with lock:
+            running = [thread for thread in active.values() if thread is not None]
+        # 只停止下载，不当作用户取消：已下载的部分文件留给 --resume 续传
+        for thread in running:
+            thread.stop()
+        while True:
+            try:
+                jobs.get_nowait()
+            except queue.Empty:
+                break
+        for _ in workers:
+            jobs.put(None)
+        all_done.wait(30)
+    finally:
+        if journal is not None:
+            journal.save()
+        get_ytdlp_pool().shutdown()
+    
+    reporter.emit("summary", succeeded=counts["succeeded"], failed=counts["failed"])
+    if interrupted.is_set():
+        return 130
+    if not seen:
+        print("没有要下载的链接")
+        return 2
+    return 1 if counts["failed"] else 0
@@ -0,0 +1,116 @@
+"""线程安全的B站HTTP客户端，B站视频下载和直播录制插件共用"""
+import time
+import random
+import threading
+from urllib.parse import urlparse
+import requests
+
+from .bandwidth import TokenBucket
+
+
+class BilibiliHttpClient:
+    """线程安全的B站HTTP客户端
+
+    所有线程共享一个 requests.Session（连接池 + keep-alive），统一默认请求头和超时；
+    对连接错误、5xx以及B站风控返回的412/429按指数退避重试（优先遵循Retry-After），
+    并按接口路径记录请求次数、失败次数和耗时。
+    api_rate 大于0时，所有线程发往 api.bilibili.com 的请求共用一个令牌桶，每秒最多 api_rate 个，
+    批量同步订阅等并发请求不会触发风控；视频流等CDN请求不受限制。
+    """
+    RETRY_STATUSES = (412, 429, 500, 502, 503, 504)
+    API_HOST = "api.bilibili.com"
+    
+    def __init__(self, headers=None, pool_size=32, max_retries=3, backoff=1.0, timeout=10, api_rate=0):
+        from requests.adapters import HTTPAdapter
+        
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(headers or {})
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.metrics = {}  # 接口路径 -> {"count", "errors", "retries", "total_time", "max_time"}
+        self.metrics_lock = threading.Lock()
+        self.api_bucket = TokenBucket(api_rate, capacity=api_rate) if api_rate else None
+    
+    def set_cookies(self, cookies):
+        """设置之后所有请求默认携带的Cookie"""
+        self.session.cookies.update(cookies or {})
+    
+    def _record(self, url, elapsed, error=False, retried=False):
+        path = urlparse(url).path
+        with self.metrics_lock:
+            stat = self.metrics.setdefault(path, {"count": 0, "errors": 0, "retries": 0,
+                                                  "total_time": 0.0, "max_time": 0.0})
+            stat["count"] += 1
+            stat["errors"] += int(error)
+            stat["retries"] += int(retried)
+            stat["total_time"] += elapsed
+            stat["max_time"] = max(stat["max_time"], elapsed)
+    
+    def _retry_delay(self, attempt, response=None):
+        if response is not None:
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                return min(int(retry_after), 60)
+        return self.backoff * (2 ** attempt) + random.uniform(0, self.backoff)
+    
+    def request(self, method, url, max_retries=None, **kwargs):
+        """发送请求，按重试策略处理网络错误和限流，返回最后一次的响应
+
+        max_retries 覆盖本次请求的重试次数，例如还有备用镜像时出错直接换镜像，不在原地重试。
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        max_retries = self.max_retries if max_retries is None else max_retries
+        for attempt in range(max_retries + 1):
+            if self.api_bucket is not None and urlparse(url).netloc == self.API_HOST:
+                wait = self.api_bucket.reserve(1)
+                if wait:
+                    time.sleep(wait)
+            start = time.time()
+            retry = attempt < max_retries
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record(url, time.time() - start, error=True, retried=retry)
+                if not retry:
+                    raise
+                print(f"请求 {urlparse(url).path} 失败，准备重试: {e}")
+                time.sleep(self._retry_delay(attempt))
+                continue
+            
+            failed = response.status_code in self.RETRY_STATUSES
+            self._record(url, time.time() - start, error=response.status_code >= 400, retried=failed and retry)
+            if failed and retry:
+                delay = self._retry_delay(attempt, response)
+                print(f"请求 {urlparse(url).path} 返回 {response.status_code}，{delay:.1f} 秒后重试")
+                response.close()
+                time.sleep(delay)
+                continue
+            return response
+    
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+    
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+    
+    def get_metrics(self):
+        """返回各接口的请求统计（含平均耗时）"""
+        with self.metrics_lock:
+            return {
+                path: dict(stat, avg_time=stat["total_time"] / stat["count"] if stat["count"] else 0.0)
+                for path, stat in self.metrics.items()
+            }
+    
+    def log_metrics(self, title="B站接口请求统计"):
+        """把各接口的请求统计打印到日志，按总耗时从高到低排列，便于排查慢接口和限流"""
+        metrics = self.get_metrics()
+        if not metrics:
+            return
+        print(f"{title}:")
+        for path, stat in sorted(metrics.items(), key=lambda item: item[1]["total_time"], reverse=True):
+            print(f"  {path}: {stat['count']} 次，失败 {stat['errors']} 次，重试 {stat['retries']} 次，"
+                  f"平均 {stat['avg_time'] * 1000:.0f}ms，最长 {stat['max_time'] * 1000:.0f}ms")
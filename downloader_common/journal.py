@@ -0,0 +1,127 @@
+"""断点续传任务日志：记录未完成的任务和已下载的部分，重启后继续"""
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+
+
+class DownloadJournal:
+    """断点续传任务日志
+
+    把每个下载任务的链接、下载选项、目标路径、已完成字节数和状态持久化到JSON文件，
+    任务成功或被用户取消后才删除记录。程序中途退出时未完成的任务仍留在日志里，
+    下次打开下载窗口时重新排队，借助已有的部分文件继续下载。
+    写文件使用临时文件加替换并在锁内完成，进度更新最多每 SAVE_INTERVAL 秒落盘一次。
+    """
+    SAVE_INTERVAL = 2.0
+    MAX_FAILURES = 3  # 连续失败这么多次的任务不再自动恢复
+    
+    def __init__(self, journal_file, site):
+        self.journal_file = journal_file
+        self.site = site
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+        self.last_save = 0
+        self.load()
+    
+    def load(self):
+        """从磁盘加载任务日志"""
+        if not os.path.exists(self.journal_file):
+            return
+        try:
+            with open(self.journal_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.jobs = OrderedDict(data.get("jobs", {}))
+        except Exception as e:
+            print(f"加载下载任务日志失败: {e}")
+            self.jobs = OrderedDict()
+    
+    def save(self, force=True):
+        """把任务日志写回磁盘，force为False时按 SAVE_INTERVAL 限制写入频率"""
+        with self.lock:
+            now = time.time()
+            if not force and now - self.last_save < self.SAVE_INTERVAL:
+                return
+            self.last_save = now
+            # 写临时文件和替换都在锁内完成，避免多个线程同时写同一个临时文件
+            try:
+                os.makedirs(os.path.dirname(self.journal_file), exist_ok=True)
+                temp_file = self.journal_file + ".tmp"
+                with open(temp_file, 'w', encoding='utf-8') as f:
+                    json.dump({"jobs": self.jobs}, f, ensure_ascii=False, indent=2)
+                os.replace(temp_file, self.journal_file)
+            except Exception as e:
+                print(f"保存下载任务日志失败: {e}")
+    
+    def add(self, key, url, options=None):
+        """记录一个新加入队列的任务，已有记录（恢复的任务）保留原来的进度"""
+        with self.lock:
+            entry = self.jobs.get(key)
+            if entry is None:
+                entry = self.jobs[key] = {
+                    "url": url,
+                    "site": self.site,
+                    "options": dict(options or {}),
+                    "path": None,
+                    "bytes_done": 0,
+                    "total_bytes": None,
+                    "created": time.time()
+                }
+            entry["state"] = "queued"
+            entry["updated"] = time.time()
+        self.save()
+    
+    def get(self, key):
+        """返回任务记录的副本，不存在时返回None"""
+        with self.lock:
+            entry = self.jobs.get(key)
+            return json.loads(json.dumps(entry)) if entry is not None else None
+    
+    def update(self, key, force=False, **fields):
+        """更新任务的下载状态（目标路径、已完成字节数等）"""
+        with self.lock:
+            entry = self.jobs.get(key)
+            if entry is None:
+                return
+            entry.update(fields)
+            entry["state"] = fields.get("state", "downloading")
+            entry["updated"] = time.time()
+        self.save(force)
+    
+    def mark_failed(self, key, error):
+        """标记任务失败，记录保留到下次启动时重试"""
+        with self.lock:
+            entry = self.jobs.get(key)
+            failures = entry.get("failures", 0) + 1 if entry else 0
+        self.update(key, force=True, state="failed", error=error, failures=failures)
+    
+    def remove(self, key):
+        """任务成功或被取消，删除记录"""
+        with self.lock:
+            if self.jobs.pop(key, None) is None:
+                return
+        self.save()
+    
+    def unfinished(self):
+        """返回需要恢复的未完成任务 (任务键, 记录) 列表，丢弃多次失败的任务"""
+        with self.lock:
+            given_up = [key for key, entry in self.jobs.items()
+                        if entry.get("failures", 0) >= self.MAX_FAILURES]
+            for key in given_up:
+                print(f"下载任务多次失败，不再自动恢复: {self.jobs.pop(key)['url']}")
+            jobs = [(key, dict(entry)) for key, entry in self.jobs.items()]
+        if given_up:
+            self.save()
+        return jobs
+
+
+def remove_partial_files(paths):
+    """删除yt-dlp留下的 .part/.ytdl 临时文件"""
+    for path in paths or []:
+        for suffix in (".part", ".ytdl"):
+            if os.path.exists(path + suffix):
+                try:
+                    os.remove(path + suffix)
+                except OSError as e:
+                    print(f"删除临时文件失败: {e}")
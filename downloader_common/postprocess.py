@@ -0,0 +1,56 @@
+"""下载后处理线程池，合并、封装和校验和计算不占用下载名额"""
+import os
+import threading
+
+
+class PostProcessPool:
+    """下载后处理线程池
+
+    合并音视频、封装、重新编码和计算校验和都是CPU/磁盘密集的工作，交给这里执行后
+    下载线程立即结束并释放下载名额，网络传输和后处理可以同时进行。
+    工作线程数默认等于CPU核数：ffmpeg本身是独立进程，计算校验和时hashlib会释放GIL，
+    所以线程池即可让各核并行工作。
+    """
+    
+    def __init__(self, max_workers=None):
+        from concurrent.futures import ThreadPoolExecutor
+        
+        self.max_workers = max_workers or os.cpu_count() or 2
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="postprocess")
+    
+    def submit(self, func):
+        """提交后处理任务，func 需要自行处理异常并发出完成信号"""
+        def task():
+            try:
+                func()
+            except Exception:
+                import traceback
+                traceback.print_exc()
+        return self.executor.submit(task)
+    
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+_postprocess_pool = None
+_postprocess_pool_lock = threading.Lock()
+
+
+def get_postprocess_pool(app=None):
+    """获取后处理线程池
+
+    和带宽管理器一样挂在主程序实例上，所有下载插件共用同一组CPU名额；没有主程序实例时使用模块级单例。
+    """
+    global _postprocess_pool
+    pool = getattr(app, 'postprocess_pool', None) if app is not None else None
+    if pool is None:
+        with _postprocess_pool_lock:
+            if _postprocess_pool is None:
+                _postprocess_pool = PostProcessPool()
+        pool = _postprocess_pool
+        if app is not None:
+            try:
+                app.postprocess_pool = pool
+            except Exception:
+                pass
+    return pool
@@ -0,0 +1,88 @@
+"""粘贴链接后在后台预先解析视频信息"""
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from .progress import format_size, format_duration
+
+
+# 粘贴大量链接时只预解析前面几个，避免一次发出过多请求
+PREFETCH_LIMIT = 10
+
+
+def describe_prefetched_metadata(result):
+    """把预解析结果格式化为一行：标题 · 时长 · 预计大小 · 可选画质"""
+    parts = [result.get("title") or ""]
+    if result.get("duration"):
+        parts.append(format_duration(result["duration"]))
+    if result.get("size"):
+        parts.append(f"约{format_size(result['size'])}")
+    if result.get("qualities"):
+        parts.append("可选 " + "/".join(result["qualities"]))
+    return " · ".join(part for part in parts if part)
+
+
+class MetadataPrefetcher(QObject):
+    """粘贴链接后在后台预先解析视频信息
+
+    resolve(url) 在线程池中执行，返回的字典通过 metadata_ready 信号交给界面显示，并缓存 ttl 秒；
+    开始下载时下载线程用 result() 取回，省去重复的解析请求。解析尚未完成时 result() 等待它，
+    而不是再发一次请求。播放地址会过期，所以 ttl 不宜太长。
+    """
+    metadata_ready = pyqtSignal(str, object)  # 任务键, 解析结果（失败时只含 error）
+    
+    def __init__(self, resolve, key_func, max_workers=3, ttl=600, parent=None):
+        super().__init__(parent)
+        self.resolve = resolve
+        self.key_func = key_func
+        self.ttl = ttl
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self.lock = threading.Lock()
+        self.futures = {}  # 任务键 -> (提交时间, Future)
+    
+    def prefetch(self, urls):
+        """提交尚未解析或已过期的链接，返回新提交的数量"""
+        now = time.time()
+        submitted = 0
+        with self.lock:
+            for key in [key for key, (started, _) in self.futures.items() if now - started >= self.ttl]:
+                del self.futures[key]
+            for url in urls:
+                key = self.key_func(url)
+                if key in self.futures:
+                    continue
+                self.futures[key] = (now, self.executor.submit(self._resolve, key, url))
+                submitted += 1
+        return submitted
+    
+    def _resolve(self, key, url):
+        try:
+            result = self.resolve(url) or {"error": "解析失败"}
+        except Exception as e:
+            result = {"error": str(e)}
+        self.metadata_ready.emit(key, result)
+        return result
+    
+    def peek(self, url):
+        """已完成的解析结果，未解析或尚未完成时返回None，不等待"""
+        with self.lock:
+            entry = self.futures.get(self.key_func(url))
+        if not entry or not entry[1].done():
+            return None
+        return entry[1].result()
+    
+    def result(self, url, timeout=60):
+        """取回可复用的解析结果，必要时等待解析完成；没有预解析、已过期或解析失败时返回None"""
+        with self.lock:
+            entry = self.futures.get(self.key_func(url))
+        if not entry or time.time() - entry[0] >= self.ttl:
+            return None
+        try:
+            result = entry[1].result(timeout)
+        except Exception:
+            return None
+        return None if result.get("error") else result
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
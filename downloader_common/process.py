@@ -0,0 +1,125 @@
+"""子进程监督：同时排空stdout和stderr，支持按行读取、超时和取消"""
+import sys
+import time
+import queue
+import threading
+import subprocess
+from collections import deque
+
+
+class ProcessSupervisor:
+    """子进程监督器
+
+    用两个读取线程同时排空标准输出和标准错误，避免任何一个管道写满后子进程阻塞；
+    标准错误只保留最近的若干行用于错误报告。取消时先terminate，超时后再kill。
+    """
+    
+    def __init__(self, cmd, stdin=False, stderr_lines=200, **popen_kwargs):
+        startupinfo = None
+        if sys.platform == "win32":
+            # 在Windows下隐藏控制台窗口
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        self.process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE if stdin else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding='utf-8',
+            errors='replace',
+            startupinfo=startupinfo,
+            **popen_kwargs
+        )
+        self.lines = queue.Queue()  # (流名称, 行)，两个流都关闭后放入None
+        self.stderr_tail = deque(maxlen=stderr_lines)
+        self.open_streams = 2
+        self.lock = threading.Lock()
+        threading.Thread(target=self._pump, args=(self.process.stdout, "stdout"), daemon=True).start()
+        threading.Thread(target=self._pump, args=(self.process.stderr, "stderr"), daemon=True).start()
+    
+    def _pump(self, stream, name):
+        try:
+            for line in stream:
+                line = line.rstrip("\r\n")
+                if name == "stderr":
+                    self.stderr_tail.append(line)
+                self.lines.put((name, line))
+        except (OSError, ValueError):
+            pass
+        with self.lock:
+            self.open_streams -= 1
+            if self.open_streams == 0:
+                self.lines.put(None)
+    
+    def iter_lines(self, should_stop=None, idle_timeout=None, poll_interval=0.2):
+        """逐行产出 (流名称, 行)，直到子进程的两个输出流都关闭
+
+        should_stop() 返回True时取消子进程并结束迭代；超过 idle_timeout 秒没有任何输出
+        视为子进程挂起，同样取消。子进程退出后管道仍被孙进程占用时，最多再等待2秒。
+        """
+        last_output = time.time()
+        exited_at = None
+        while True:
+            if should_stop and should_stop():
+                self.cancel()
+                return
+            try:
+                item = self.lines.get(timeout=poll_interval)
+            except queue.Empty:
+                now = time.time()
+                if idle_timeout and now - last_output > idle_timeout:
+                    print(f"子进程超过 {idle_timeout} 秒没有输出，视为挂起并终止")
+                    self.cancel()
+                    return
+                if self.process.poll() is not None:
+                    exited_at = exited_at or now
+                    if now - exited_at > 2:
+                        return
+                continue
+            if item is None:
+                return
+            last_output = time.time()
+            yield item
+    
+    def send(self, text):
+        """写入一行到子进程的标准输入"""
+        self.process.stdin.write(text + "\n")
+        self.process.stdin.flush()
+    
+    def close_stdin(self):
+        try:
+            self.process.stdin.close()
+        except Exception:
+            pass
+    
+    def is_alive(self):
+        return self.process.poll() is None
+    
+    def wait(self, timeout=None):
+        """等待子进程退出并返回退出码，超时返回None"""
+        try:
+            return self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return None
+    
+    @property
+    def returncode(self):
+        return self.process.poll()
+    
+    def cancel(self, timeout=5):
+        """终止子进程，超过timeout秒仍未退出则强制结束"""
+        if self.process.poll() is not None:
+            return
+        try:
+            self.process.terminate()
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.wait(2)
+        except Exception as e:
+            print(f"终止子进程失败: {e}")
+    
+    def stderr_text(self):
+        """最近的标准错误输出，用于错误报告"""
+        return "\n".join(self.stderr_tail)
@@ -0,0 +1,78 @@
+"""下载进度的格式化和按固定频率批量刷新界面的汇总器"""
+import threading
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+
+def format_size(num_bytes):
+    """把字节数格式化为易读的大小"""
+    size = float(num_bytes or 0)
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TB"
+
+
+def format_duration(seconds):
+    """把秒数格式化为 时:分:秒 或 分:秒"""
+    seconds = int(seconds or 0)
+    hours, rest = divmod(seconds, 3600)
+    return f"{hours}:{rest // 60:02d}:{rest % 60:02d}" if hours else f"{rest // 60}:{rest % 60:02d}"
+
+
+def format_progress_message(progress):
+    """把结构化的进度字段格式化为状态文字"""
+    if progress.get("message"):
+        return progress["message"]
+    percent = progress.get("percent")
+    parts = [f"下载中... {percent:.1f}%" if percent is not None else "下载中..."]
+    if progress.get("total_bytes"):
+        parts.append(f"{format_size(progress.get('downloaded_bytes'))}/{format_size(progress['total_bytes'])}")
+    if progress.get("speed"):
+        parts.append(f"{format_size(progress['speed'])}/s")
+    if progress.get("eta") is not None:
+        parts.append(f"剩余 {int(progress['eta'])} 秒")
+    if progress.get("quality"):
+        parts.append(progress["quality"])
+    return "  ".join(parts)
+
+
+class ProgressAggregator(QObject):
+    """下载进度汇总器
+
+    下载线程可以任意频繁地调用 report()，汇总器只保留每个任务最新的一次进度，
+    按固定频率在界面线程中通过 progress_batch 一次性发出所有有变化的任务。
+    """
+    progress_batch = pyqtSignal(dict)  # 任务键 -> 进度字段(percent, message, downloaded_bytes, total_bytes, speed, eta)
+    
+    def __init__(self, rate_hz=5, parent=None):
+        super().__init__(parent)
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.flush)
+        self.set_rate(rate_hz)
+        self.timer.start()
+    
+    def set_rate(self, rate_hz):
+        """设置每秒最多向界面发送的批次数"""
+        self.timer.setInterval(int(1000 / max(0.5, float(rate_hz))))
+    
+    def report(self, job_key, percent=None, message=None, **fields):
+        """上报一个任务的最新进度，可在任意线程调用"""
+        fields.update(percent=percent, message=message)
+        with self.lock:
+            self.pending[job_key] = fields
+    
+    def flush(self):
+        """把积累的进度作为一个批次发送到界面"""
+        with self.lock:
+            if not self.pending:
+                return
+            batch, self.pending = self.pending, {}
+        self.progress_batch.emit(batch)
+    
+    def discard(self, job_key):
+        """丢弃任务尚未发送的进度，任务结束后调用，避免旧进度覆盖完成状态"""
+        with self.lock:
+            self.pending.pop(job_key, None)
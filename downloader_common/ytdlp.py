@@ -0,0 +1,421 @@
+"""常驻yt-dlp工作进程池，以及工作进程不可用时回退到命令行所用的参数转换"""
+import sys
+import json
+import time
+import queue
+import threading
+
+from .process import ProcessSupervisor
+
+
+# 常驻yt-dlp工作进程执行的脚本：启动时导入一次yt_dlp，之后通过标准输入逐行接收
+# JSON任务，通过标准输出逐行返回JSON事件（ready/progress/postprocess/entry/log/finished）。
+# action为"list"的任务只列出播放列表条目，不下载；action为"info"的任务只提取视频信息和可用格式，
+# 结果可作为之后下载任务的 info 复用，下载时不再重新解析网页
+YTDLP_WORKER_SCRIPT = r'''
+import sys
+import json
+import queue
+import threading
+
+_write_lock = threading.Lock()
+
+def emit(event):
+    line = json.dumps(event, ensure_ascii=False, default=str)
+    with _write_lock:
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+try:
+    import yt_dlp
+except Exception as e:
+    emit({"type": "ready", "ok": False, "error": str(e)})
+    sys.exit(0)
+
+emit({"type": "ready", "ok": True, "version": yt_dlp.version.__version__})
+
+jobs = queue.Queue()
+cancelled = set()
+ratelimits = {}  # job_id -> 字节/秒，由主进程随时调整
+active = {}  # job_id -> 正在执行的YoutubeDL实例
+
+def read_commands():
+    for line in sys.stdin:
+        try:
+            message = json.loads(line)
+        except ValueError:
+            continue
+        if message.get("type") == "cancel":
+            cancelled.add(message.get("job_id"))
+        elif message.get("type") == "ratelimit":
+            job_id = message.get("job_id")
+            ratelimits[job_id] = message.get("ratelimit") or None
+            if job_id in active:
+                active[job_id].params["ratelimit"] = ratelimits[job_id]
+        else:
+            jobs.put(message)
+    jobs.put(None)
+
+threading.Thread(target=read_commands, daemon=True).start()
+
+class JobCancelled(Exception):
+    pass
+
+class JobLogger:
+    def __init__(self, job_id):
+        self.job_id = job_id
+    def debug(self, msg):
+        if not msg.startswith("[debug]"):
+            emit({"type": "log", "job_id": self.job_id, "level": "info", "message": msg})
+    def info(self, msg):
+        emit({"type": "log", "job_id": self.job_id, "level": "info", "message": msg})
+    def warning(self, msg):
+        emit({"type": "log", "job_id": self.job_id, "level": "warning", "message": msg})
+    def error(self, msg):
+        emit({"type": "log", "job_id": self.job_id, "level": "error", "message": msg})
+
+while True:
+    job = jobs.get()
+    if job is None:
+        break
+    job_id = job["job_id"]
+
+    def progress_hook(d, job_id=job_id):
+        if job_id in cancelled:
+            raise JobCancelled("cancelled")
+        emit({
+            "type": "progress",
+            "job_id": job_id,
+            "status": d.get("status"),
+            "downloaded_bytes": d.get("downloaded_bytes"),
+            "total_bytes": d.get("total_bytes") or d.get("total_bytes_estimate"),
+            "speed": d.get("speed"),
+            "eta": d.get("eta"),
+            "filename": d.get("filename"),
+        })
+
+    def postprocessor_hook(d, job_id=job_id):
+        emit({"type": "postprocess", "job_id": job_id,
+              "status": d.get("status"), "postprocessor": d.get("postprocessor")})
+
+    options = dict(job.get("options") or {})
+    options.update({
+        "quiet": True,
+        "noprogress": True,
+        "logger": JobLogger(job_id),
+        "progress_hooks": [progress_hook],
+        "postprocessor_hooks": [postprocessor_hook],
+    })
+    if job_id in ratelimits:
+        options["ratelimit"] = ratelimits[job_id]
+    try:
+        with yt_dlp.YoutubeDL(options) as ydl:
+            active[job_id] = ydl
+            if job.get("action") == "list":
+                # 条目按需逐页获取，收到取消后不再请求下一页
+                info = ydl.extract_info(job["url"], download=False, process=False) or {}
+                for entry in info.get("entries") or []:
+                    if job_id in cancelled:
+                        break
+                    emit({"type": "entry", "job_id": job_id, "id": entry.get("id"),
+                          "url": entry.get("url") or entry.get("webpage_url"),
+                          "title": entry.get("title"), "timestamp": entry.get("timestamp")})
+                result = {"type": "finished", "job_id": job_id, "ok": True,
+                          "cancelled": job_id in cancelled, "title": info.get("title")}
+            elif job.get("action") == "info":
+                info = ydl.sanitize_info(ydl.extract_info(job["url"], download=False) or {})
+                result = {"type": "finished", "job_id": job_id, "ok": True,
+                          "title": info.get("title"), "info": info}
+            else:
+                info = None
+                if job.get("info"):
+                    try:
+                        info = ydl.process_ie_result(job["info"], download=True)
+                    except yt_dlp.utils.DownloadError as e:
+                        # 预先提取的地址可能已失效，重新解析网页
+                        if job_id in cancelled:
+                            raise
+                        emit({"type": "log", "job_id": job_id, "level": "warning",
+                              "message": f"复用预先提取的信息失败，重新解析: {e}"})
+                if info is None:
+                    info = ydl.extract_info(job["url"], download=True)
+                info = info or {}
+                filepath = None
+                for item in info.get("requested_downloads") or []:
+                    filepath = item.get("filepath") or filepath
+                if not filepath and info:
+                    filepath = ydl.prepare_filename(info)
+                result = {"type": "finished", "job_id": job_id, "ok": True,
+                          "filepath": filepath, "title": info.get("title")}
+        emit(result)
+    except Exception as e:
+        emit({"type": "finished", "job_id": job_id, "ok": False,
+              "cancelled": job_id in cancelled, "error": str(e)})
+    cancelled.discard(job_id)
+    ratelimits.pop(job_id, None)
+    active.pop(job_id, None)
+'''
+
+
+def ytdlp_cli_args(url, options):
+    """把yt-dlp API选项转换成命令行参数，工作进程不可用时回退为单独的yt-dlp进程"""
+    cmd = ["yt-dlp", url]
+    if options.get("outtmpl"):
+        cmd.extend(["-o", options["outtmpl"]])
+    if options.get("format"):
+        cmd.extend(["-f", options["format"]])
+    if options.get("format_sort"):
+        cmd.extend(["-S", ",".join(options["format_sort"])])
+    if options.get("noplaylist"):
+        cmd.append("--no-playlist")
+    if options.get("merge_output_format"):
+        cmd.extend(["--merge-output-format", options["merge_output_format"]])
+    if options.get("nocheckcertificate"):
+        cmd.append("--no-check-certificate")
+    if options.get("continuedl"):
+        cmd.append("--continue")
+    if options.get("ratelimit"):
+        cmd.extend(["--limit-rate", str(int(options["ratelimit"]))])
+    if options.get("cookiefile"):
+        cmd.extend(["--cookies", options["cookiefile"]])
+    headers = options.get("http_headers") or {}
+    if headers.get("User-Agent"):
+        cmd.extend(["--user-agent", headers["User-Agent"]])
+    if headers.get("Referer"):
+        cmd.extend(["--referer", headers["Referer"]])
+    for postprocessor in options.get("postprocessors") or []:
+        if postprocessor.get("key") == "FFmpegVideoRemuxer":
+            cmd.extend(["--remux-video", postprocessor["preferedformat"]])
+        elif postprocessor.get("key") == "FFmpegExtractAudio":
+            cmd.extend(["--extract-audio", "--audio-format", postprocessor["preferredcodec"]])
+        elif postprocessor.get("key") == "FFmpegMetadata":
+            cmd.append("--embed-metadata")
+        elif postprocessor.get("key") == "EmbedThumbnail":
+            cmd.append("--embed-thumbnail")
+        elif postprocessor.get("key"):
+            cmd.extend(["--use-postprocessor", postprocessor["key"]])
+    for name, args in (options.get("postprocessor_args") or {}).items():
+        cmd.extend(["--postprocessor-args", f"{name}:{' '.join(args)}"])
+    return cmd
+
+
+class YtdlpWorker:
+    """一个常驻的yt-dlp工作进程，同一时间只执行一个任务"""
+    START_TIMEOUT = 30  # 等待工作进程导入yt-dlp的秒数
+    
+    def __init__(self):
+        self.supervisor = ProcessSupervisor([sys.executable, "-u", "-c", YTDLP_WORKER_SCRIPT],
+                                            stdin=True, stderr_lines=100)
+        self.events = queue.Queue()
+        self.ready = threading.Event()
+        self.available = False
+        self.import_failed = False  # 工作进程报告无法导入yt_dlp，重试也不会成功
+        self.error = ""
+        self.job_counter = 0
+        threading.Thread(target=self._dispatch, daemon=True).start()
+    
+    def _dispatch(self):
+        for stream, line in self.supervisor.iter_lines():
+            if stream != "stdout":
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if event.get("type") == "ready":
+                self.available = bool(event.get("ok"))
+                self.import_failed = not self.available
+                self.error = event.get("error", "")
+                self.ready.set()
+            else:
+                self.events.put(event)
+        # 进程已退出，唤醒所有等待者
+        self.ready.set()
+        self.events.put(None)
+    
+    def is_alive(self):
+        return self.supervisor.is_alive()
+    
+    def _send(self, message):
+        self.supervisor.send(json.dumps(message, ensure_ascii=False))
+    
+    def run(self, url, options, on_event=None, should_stop=None, cancel_timeout=10, get_ratelimit=None,
+            action="download", info=None):
+        """执行一个下载任务并阻塞直到完成，返回finished事件
+
+        提供 get_ratelimit 时定期调用它，速率变化后立即通知工作进程调整限速；
+        提供 info（action为"info"的任务返回的信息）时直接用它下载，不再解析网页。
+        """
+        if not self.ready.wait(self.START_TIMEOUT):
+            return {"type": "finished", "ok": False, "error": "yt-dlp工作进程启动超时"}
+        if not self.available:
+            return {"type": "finished", "ok": False, "error": self.error or "yt-dlp工作进程启动失败"}
+        
+        self.job_counter += 1
+        job_id = self.job_counter
+        try:
+            self._send({"type": "job", "job_id": job_id, "url": url, "options": options, "action": action,
+                        "info": info})
+        except OSError as e:
+            return {"type": "finished", "ok": False, "error": f"yt-dlp工作进程已退出: {e}"}
+        
+        cancel_sent_at = None
+        ratelimit = options.get("ratelimit")
+        while True:
+            if get_ratelimit is not None and cancel_sent_at is None:
+                new_ratelimit = get_ratelimit() or None
+                if new_ratelimit != ratelimit:
+                    ratelimit = new_ratelimit
+                    try:
+                        self._send({"type": "ratelimit", "job_id": job_id, "ratelimit": ratelimit})
+                    except OSError:
+                        pass
+            if should_stop and should_stop() and cancel_sent_at is None:
+                try:
+                    self._send({"type": "cancel", "job_id": job_id})
+                except OSError:
+                    pass
+                cancel_sent_at = time.time()
+            if cancel_sent_at and time.time() - cancel_sent_at > cancel_timeout:
+                # 工作进程没有及时响应取消，直接结束它
+                self.kill()
+                return {"type": "finished", "ok": False, "cancelled": True, "error": "下载已取消"}
+            
+            try:
+                event = self.events.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            if event is None:
+                error = self.supervisor.stderr_text() or "yt-dlp工作进程意外退出"
+                return {"type": "finished", "ok": False, "cancelled": cancel_sent_at is not None, "error": error}
+            if event.get("job_id") != job_id:
+                continue
+            if event.get("type") == "finished":
+                return event
+            if on_event:
+                on_event(event)
+    
+    def close(self):
+        """关闭标准输入，工作进程处理完当前任务后自行退出"""
+        self.supervisor.close_stdin()
+    
+    def kill(self):
+        self.supervisor.cancel(timeout=1)
+
+
+class YtdlpWorkerPool:
+    """常驻yt-dlp工作进程池
+
+    每个工作进程只在启动时付出一次解释器启动和提取器导入的开销，
+    之后通过管道接收任务，并以结构化事件返回进度。
+    无法导入yt_dlp时整个进程池停用；启动超时或进程意外退出时只暂停一段时间，
+    期间的任务改用命令行方式，之后再尝试工作进程，连续失败时暂停时间逐次加倍。
+    """
+    RETRY_DELAY = 30  # 启动失败后第一次暂停的秒数
+    MAX_RETRY_DELAY = 600
+    
+    def __init__(self, max_workers=8):
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.idle = []
+        self.worker_count = 0
+        self.slot_released = threading.Condition(self.lock)
+        self.unavailable_reason = None
+        self.start_failures = 0  # 连续启动失败的次数
+        self.retry_at = 0  # 暂停到这个时间（time.monotonic）
+        if getattr(sys, 'frozen', False):
+            # 打包后的程序没有可用的Python解释器来运行工作进程
+            self.unavailable_reason = "打包环境不支持yt-dlp工作进程"
+    
+    def is_available(self):
+        return self.unavailable_reason is None and time.monotonic() >= self.retry_at
+    
+    def prewarm(self, count=1):
+        """预先启动工作进程，使第一个任务无需等待yt-dlp导入"""
+        if not self.is_available():
+            return
+        with self.lock:
+            while len(self.idle) < count and self.worker_count < self.max_workers:
+                self.idle.append(YtdlpWorker())
+                self.worker_count += 1
+    
+    def _acquire(self):
+        with self.lock:
+            while True:
+                while self.idle:
+                    worker = self.idle.pop()
+                    if worker.is_alive():
+                        return worker
+                    self.worker_count -= 1
+                if self.worker_count < self.max_workers:
+                    self.worker_count += 1
+                    break
+                self.slot_released.wait()
+        try:
+            return YtdlpWorker()
+        except Exception:
+            with self.lock:
+                self.worker_count -= 1
+                self.slot_released.notify()
+            raise
+    
+    def _release(self, worker):
+        with self.lock:
+            if worker.is_alive() and self.unavailable_reason is None:
+                self.idle.append(worker)
+            else:
+                worker.kill()
+                self.worker_count -= 1
+            self.slot_released.notify()
+    
+    def run_job(self, url, options, on_event=None, should_stop=None, get_ratelimit=None, action="download",
+                info=None):
+        """在空闲的工作进程中执行下载任务（action为"list"时只列出条目，为"info"时只提取信息），返回finished事件
+
+        工作进程无法导入yt_dlp时返回 None，调用方应回退到命令行方式。
+        """
+        if not self.is_available():
+            return None
+        worker = self._acquire()
+        try:
+            result = worker.run(url, options, on_event, should_stop, get_ratelimit=get_ratelimit, action=action,
+                                info=info)
+            if worker.import_failed:
+                self.unavailable_reason = worker.error or "yt_dlp模块不可用"
+                print(f"yt-dlp工作进程不可用，改用命令行方式: {self.unavailable_reason}")
+                return None
+            if not worker.available:
+                # 启动超时（如冷启动导入太慢）或进程意外退出：可能只是暂时的，暂停一段时间后再试。
+                # 仍在启动的进程留在空闲列表中，恢复后可以直接使用
+                with self.lock:
+                    self.start_failures += 1
+                    delay = min(self.RETRY_DELAY * 2 ** (self.start_failures - 1), self.MAX_RETRY_DELAY)
+                    self.retry_at = time.monotonic() + delay
+                print(f"{result.get('error')}，{delay} 秒内改用命令行方式")
+                return None
+            with self.lock:
+                self.start_failures = 0
+            return result
+        finally:
+            self._release(worker)
+    
+    def shutdown(self):
+        """关闭所有空闲的工作进程"""
+        with self.lock:
+            for worker in self.idle:
+                worker.close()
+            self.worker_count -= len(self.idle)
+            self.idle = []
+
+
+_ytdlp_pool = None
+_ytdlp_pool_lock = threading.Lock()
+
+
+def get_ytdlp_pool():
+    """获取插件共享的yt-dlp工作进程池"""
+    global _ytdlp_pool
+    with _ytdlp_pool_lock:
+        if _ytdlp_pool is None:
+            _ytdlp_pool = YtdlpWorkerPool()
+        return _ytdlp_pool
@@ -1,3 +1,11 @@
+import os
+import sys
+
+# python -m tiktok_downloader 启动命令行模式时，本包在 __main__ 之前导入（此时 sys.argv[0] 为 "-m"），
+# 这种情况下插件模块不导入QtWidgets
+if sys.argv[:1] == ["-m"]:
+    os.environ.setdefault("DOWNLOADER_HEADLESS", "1")
+
 from .plugin import TiktokDownloaderPlugin
 
 __all__ = ['TiktokDownloaderPlugin']
\ No newline at end of file
@@ -1,12 +1,33 @@
 import re
 import os
-import subprocess
+import sys
 import json
-from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QFormLayout, QLabel, 
-                            QLineEdit, QPushButton, QMessageBox, QProgressBar, 
-                            QGroupBox, QDialog, QHBoxLayout, QCheckBox)
-from PyQt5.QtCore import QThread, pyqtSignal, Qt, QSize
-from PyQt5.QtGui import QIcon
+import time
+import threading
+import shutil
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QThread, QTimer, pyqtSignal, Qt, QSize
+
+# 以命令行方式运行（python -m tiktok_downloader）时不导入界面模块，没有图形环境的服务器上也能启动
+if not os.environ.get("DOWNLOADER_HEADLESS"):
+    from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QFormLayout, QLabel, 
+                                QLineEdit, QPushButton, QMessageBox, QProgressBar, 
+                                QGroupBox, QDialog, QHBoxLayout, QCheckBox,
+                                QPlainTextEdit, QSpinBox, QTableWidget, QTableWidgetItem,
+                                QHeaderView, QAbstractItemView, QListWidget)
+    from PyQt5.QtGui import QIcon
+
+# 各插件共用的组件在插件目录下的 downloader_common 包中，先把插件目录加入路径
+PLUGINS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PLUGINS_DIR not in sys.path:
+    sys.path.append(PLUGINS_DIR)
+from downloader_common import (ProcessSupervisor, ytdlp_cli_args, get_ytdlp_pool, format_progress_message,
+                               ProgressAggregator, DownloadJournal, get_bandwidth_manager,
+                               get_postprocess_pool, file_sha256, get_download_archive, ArchiveScanThread,
+                               parse_url_list, DownloadQueue, PREFETCH_LIMIT, describe_prefetched_metadata,
+                               MetadataPrefetcher, build_headless_parser, run_headless)
 
 # 导入插件基类
 try:
@@ -16,128 +37,542 @@ except ImportError:
     class PluginBase:
         def __init__(self, app_instance=None):
             self.app = app_instance
-            
+
+
+def video_key_from_url(url):
+    """用TikTok视频ID作为去重键，同一视频的不同链接形式视为重复"""
+    match = re.search(r'tiktok\.com/.*?/video/(\d+)', url)
+    if match:
+        return match.group(1)
+    return DownloadQueue.normalize_url(url)
+
+
+# 可以直接封装进MP4容器的编码，遇到其他编码（如字节自研的bytevc2）才需要重新编码
+MP4_VIDEO_CODECS = ("h264", "hevc", "av1", "vp9")
+MP4_AUDIO_CODECS = ("aac", "mp3", "opus", "alac", "flac")
+
+
+def probe_codecs(path):
+    """用ffprobe读取文件第一路视频和音频的编码名，无法读取时返回 (None, None)"""
+    if not shutil.which("ffprobe"):
+        return None, None
+    codecs = {}
+    for stream_type in ("v", "a"):
+        supervisor = ProcessSupervisor([
+            "ffprobe", "-v", "error", "-select_streams", f"{stream_type}:0",
+            "-show_entries", "stream=codec_name", "-of", "default=noprint_wrappers=1:nokey=1", path
+        ])
+        lines = [line.strip() for stream, line in supervisor.iter_lines(idle_timeout=30) if stream == "stdout"]
+        supervisor.wait(5)
+        codecs[stream_type] = next((line.lower() for line in lines if line), None)
+    return codecs["v"], codecs["a"]
+
+
+# 订阅同步时连续遇到这么多个不比游标新的视频就停止翻页（主页最多置顶3个旧视频）
+SUBSCRIPTION_SEEN_STREAK = 5
+
+
+def normalize_subscription_source(text):
+    """把 @用户名、#话题 或主页/话题链接规范为订阅地址，无法识别时返回 None"""
+    text = text.strip()
+    if text.startswith("@") and len(text) > 1:
+        return f"https://www.tiktok.com/{text}"
+    if text.startswith("#") and len(text) > 1:
+        return f"https://www.tiktok.com/tag/{text[1:]}"
+    match = re.match(r'https?://(?:www\.)?tiktok\.com/(@[\w.-]+|tag/[^/?#]+)/?(?:[?#].*)?$', text)
+    if match:
+        return f"https://www.tiktok.com/{match.group(1)}"
+    return None
+
+
+def tiktok_id_value(video_id):
+    """TikTok视频ID随发布时间递增，转成整数后可直接比较新旧"""
+    try:
+        return int(video_id)
+    except (TypeError, ValueError):
+        return 0
+
+
+def list_feed_entries(url, on_entry, should_stop=None):
+    """按从新到旧的顺序逐个列出主页或话题中的视频，on_entry(id, url, timestamp)
+
+    条目按需逐页获取，should_stop 返回 True 后不再请求下一页。返回是否成功列出。
+    """
+    def on_event(event):
+        if event.get("type") == "entry":
+            on_entry(event.get("id"), event.get("url"), event.get("timestamp"))
+    
+    options = {"extract_flat": "in_playlist", "lazy_playlist": True, "quiet": True, "nocheckcertificate": True}
+    result = get_ytdlp_pool().run_job(url, options, on_event, should_stop, action="list")
+    if result is not None:
+        if not result.get("ok") and not result.get("cancelled"):
+            print(f"列出订阅视频失败: {result.get('error')}")
+        return bool(result.get("ok") or result.get("cancelled"))
+    
+    # 工作进程不可用，回退到命令行
+    supervisor = ProcessSupervisor([
+        "yt-dlp", "--flat-playlist", "--lazy-playlist", "--no-warnings", "--no-check-certificate",
+        "--print", "%(id)s\t%(url)s\t%(timestamp)s", url
+    ])
+    for stream, line in supervisor.iter_lines(should_stop=should_stop):
+        if stream != "stdout":
+            continue
+        parts = line.rstrip("\n").split("\t")
+        if len(parts) == 3:
+            timestamp = int(parts[2]) if parts[2].isdigit() else None
+            on_entry(parts[0], parts[1], timestamp)
+    if should_stop and should_stop():
+        # 提前停止翻页属于正常结束
+        supervisor.cancel()
+        return True
+    supervisor.wait(5)
+    if supervisor.returncode != 0:
+        print(f"列出订阅视频失败: {supervisor.stderr_text()}")
+        return False
+    return True
+
+
+class SubscriptionStore:
+    """订阅列表，记录每个主页/话题已同步到的最新视频（游标），保存在JSON文件中"""
+    
+    def __init__(self, store_file):
+        self.store_file = store_file
+        self.lock = threading.Lock()
+        self.sources = OrderedDict()
+        self.load()
+    
+    def load(self):
+        try:
+            if os.path.exists(self.store_file):
+                with open(self.store_file, "r", encoding="utf-8") as f:
+                    self.sources = OrderedDict(json.load(f).get("sources", {}))
+        except Exception as e:
+            print(f"读取订阅列表失败: {e}")
+            self.sources = OrderedDict()
+    
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.store_file), exist_ok=True)
+            tmp_file = self.store_file + ".tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump({"sources": self.sources}, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, self.store_file)
+        except Exception as e:
+            print(f"保存订阅列表失败: {e}")
+    
+    def add(self, source, options=None):
+        """添加订阅，options 为新视频加入下载队列时使用的下载选项"""
+        with self.lock:
+            if source in self.sources:
+                return False
+            self.sources[source] = {
+                "kind": "hashtag" if "/tag/" in source else "profile",
+                "options": options or {},
+                "cursor_id": None,
+                "cursor_timestamp": None,
+                "last_sync": None
+            }
+            self.save()
+            return True
+    
+    def remove(self, source):
+        with self.lock:
+            if self.sources.pop(source, None) is not None:
+                self.save()
+    
+    def get(self, source):
+        with self.lock:
+            entry = self.sources.get(source)
+            return dict(entry) if entry else None
+    
+    def list_sources(self):
+        with self.lock:
+            return list(self.sources.keys())
+    
+    def advance(self, source, cursor_id=None, cursor_timestamp=None):
+        """把游标推进到 cursor_id，不传时只更新同步时间"""
+        with self.lock:
+            entry = self.sources.get(source)
+            if entry is None:
+                return
+            if cursor_id and tiktok_id_value(cursor_id) > tiktok_id_value(entry.get("cursor_id")):
+                entry["cursor_id"] = str(cursor_id)
+                entry["cursor_timestamp"] = cursor_timestamp or entry.get("cursor_timestamp")
+            entry["last_sync"] = int(time.time())
+            self.save()
+
+
+class SubscriptionSyncThread(QThread):
+    """增量同步订阅：只取比游标新的视频，遇到已见过的视频就停止翻页"""
+    new_videos = pyqtSignal(str, list)  # 订阅地址, 新视频（从旧到新），加入下载队列后由接收方推进游标
+    sync_complete = pyqtSignal(int)  # 新视频总数
+    
+    def __init__(self, store, sources=None, max_workers=3, first_sync_limit=0):
+        super().__init__()
+        self.store = store
+        self.sources = sources or store.list_sources()
+        self.max_workers = max_workers
+        self.first_sync_limit = first_sync_limit  # 首次同步最多取多少个视频，0为不限
+        self.is_running = True
+    
+    def sync_source(self, source):
+        """同步单个订阅，返回新视频数"""
+        entry = self.store.get(source)
+        if entry is None:
+            return 0
+        cursor = tiktok_id_value(entry.get("cursor_id"))
+        limit = self.first_sync_limit if not cursor else 0
+        found = []  # (id值, 视频ID, 链接, 时间戳)
+        seen_streak = [0]
+        
+        def on_entry(video_id, url, timestamp):
+            value = tiktok_id_value(video_id)
+            if cursor and value <= cursor:
+                # 置顶视频会排在最前面，连续多个旧视频才说明已经到达上次同步的位置
+                seen_streak[0] += 1
+                return
+            seen_streak[0] = 0
+            if not url or not url.startswith("http"):
+                url = f"{source.rstrip('/')}/video/{video_id}"
+            found.append((value, str(video_id), url, timestamp))
+        
+        def should_stop():
+            return (not self.is_running
+                    or seen_streak[0] >= SUBSCRIPTION_SEEN_STREAK
+                    or (limit and len(found) >= limit))
+        
+        if not list_feed_entries(source, on_entry, should_stop) or not self.is_running:
+            return 0
+        found.sort()
+        # 游标不在这里推进：新视频加入下载队列后才推进
+        self.store.advance(source)
+        if found:
+            self.new_videos.emit(source, [{"id": video_id, "url": url, "timestamp": timestamp}
+                                          for value, video_id, url, timestamp in found])
+        print(f"订阅 {source} 同步完成，新视频 {len(found)} 个")
+        return len(found)
+    
+    def run(self):
+        total = 0
+        # 各订阅互不依赖，并行列出
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for count in executor.map(self.sync_source, self.sources):
+                total += count
+        self.sync_complete.emit(total)
+    
+    def stop(self):
+        self.is_running = False
+
+
+# 无水印：直接选择不带水印的源格式，不再整段重新编码
+NO_WATERMARK_FORMAT = "b[format_note!*=watermarked][format_note!*=UNPLAYABLE]/bv*[format_note!*=watermarked]+ba/b"
+
+
+def prefetch_video_metadata(url, no_watermark=True):
+    """粘贴链接后用yt-dlp工作进程预先提取视频信息和可用格式
+
+    返回的 info 在开始下载时交给工作进程复用，不再重新解析网页。
+    """
+    options = {"noplaylist": True, "nocheckcertificate": True}
+    if no_watermark:
+        options["format"] = NO_WATERMARK_FORMAT
+    result = get_ytdlp_pool().run_job(url, options, action="info")
+    if result is None:
+        return {"error": "yt-dlp工作进程不可用"}
+    if not result.get("ok"):
+        return {"error": result.get("error") or "解析失败"}
+    info = result.get("info") or {}
+    selected = info.get("requested_formats") or [info]
+    heights = sorted({f.get("height") for f in info.get("formats") or [] if f.get("height")}, reverse=True)
+    return {
+        "title": info.get("title"),
+        "duration": info.get("duration"),
+        "size": sum(f.get("filesize") or f.get("filesize_approx") or 0 for f in selected),
+        "qualities": [f"{height}P" for height in heights],
+        "info": info
+    }
+
+
 class TiktokDownloadThread(QThread):
     """TikTok视频下载线程"""
     progress_updated = pyqtSignal(int, str)
     download_complete = pyqtSignal(bool, str, str)  # 成功状态, 消息, 文件路径
     
-    def __init__(self, url, output_dir, no_watermark=True):
+    def __init__(self, url, output_dir, no_watermark=True, bandwidth=None, archive=None, skip_downloaded=True,
+                 reencode_preset="veryfast", reencode_threads=0, postprocessor=None, prefetcher=None):
         super().__init__()
         
         self.url = url
         self.output_dir = output_dir
         self.no_watermark = no_watermark
+        self.reencode_preset = reencode_preset  # 必须重新编码时使用的x264预设
+        self.reencode_threads = reencode_threads  # 重新编码的线程数，0为自动
         self.is_running = True
+        self.bandwidth = bandwidth  # BandwidthManager，为None时不限速
+        self.archive = archive  # DownloadArchive，为None时不记录已下载的视频
+        self.skip_downloaded = skip_downloaded  # 已下载过的视频直接跳过
+        self.postprocessor = postprocessor  # PostProcessPool，为None时在下载线程中直接转码和计算校验和
+        self.postprocessing = False  # 收尾工作已交给后处理线程池
+        self.prefetcher = prefetcher  # MetadataPrefetcher，粘贴链接时已提取的信息直接用于下载
+        self.progress_bus = None  # 由下载队列设置的ProgressAggregator
+        self.journal = None  # 由下载队列设置的DownloadJournal
+        self.partial_files = []  # yt-dlp写入过的文件，用于清理 .part 临时文件
+        self.job_key = url
         self.file_path = ""
         
     def run(self):
         try:
+            video_id = video_key_from_url(self.url)
+            # 已下载过且文件仍然存在时直接跳过，不再访问网络
+            archived = self.archive.lookup("tiktok", video_id, '') if self.archive and self.skip_downloaded else None
+            if archived:
+                self.report_progress(100, "已下载过，跳过")
+                self.download_complete.emit(True, "已下载过，跳过", archived["path"])
+                return
+            
             # 确保输出目录存在
             os.makedirs(self.output_dir, exist_ok=True)
             
             # 设置输出文件模板
             output_template = os.path.join(self.output_dir, "%(title)s.%(ext)s")
             
-            # 设置yt-dlp命令
-            cmd = [
-                "yt-dlp", 
-                self.url, 
-                "-o", output_template,
-                "--newline",  # 确保进度实时显示
-                "--progress",  # 显示进度条
-                "--no-colors", # 移除颜色代码，便于解析输出
-                "--no-playlist", # 不下载播放列表
-                "--no-check-certificate"  # 不检查证书
-            ]
+            # 设置yt-dlp选项
+            options = {
+                "outtmpl": output_template,
+                "noplaylist": True,  # 不下载播放列表
+                "nocheckcertificate": True,  # 不检查证书
+                "continuedl": True  # 从已有的 .part 文件继续下载
+            }
             
-            # 添加无水印选项
+            # 无水印：提取时直接选择不带水印的源格式，不再整段重新编码
             if self.no_watermark:
-                cmd.append("--remux-video")
-                cmd.append("mp4")
-                cmd.append("--postprocessor-args")
-                cmd.append("ffmpeg:-c:v libx264 -c:a aac -movflags +faststart")
+                options["format"] = NO_WATERMARK_FORMAT
+                if shutil.which("ffmpeg"):
+                    # 流复制重新封装，yt-dlp调用ffmpeg输出时会自动加上 -movflags +faststart
+                    options["postprocessors"] = [{"key": "FFmpegCopyStream"}]
             
-            self.progress_updated.emit(5, "正在连接TikTok...")
+            self.report_progress(5, "正在连接TikTok...")
+            prefetched = self.prefetcher.result(self.url) if self.prefetcher else None
             
-            # 启动下载进程
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                encoding='utf-8',
-                errors='replace'
-            )
+            # 优先交给常驻的yt-dlp工作进程，不可用时启动单独的yt-dlp进程
+            # 按带宽管理器分配的份额限速，其他任务开始或结束时份额会重新计算
+            bandwidth_job = self.bandwidth.register("tiktok") if self.bandwidth else None
+            get_ratelimit = (lambda: self.bandwidth.job_rate(bandwidth_job)) if bandwidth_job else None
+            try:
+                if get_ratelimit:
+                    options["ratelimit"] = get_ratelimit() or None
+                result = get_ytdlp_pool().run_job(self.url, options, self.on_ytdlp_event, lambda: not self.is_running,
+                                                  get_ratelimit=get_ratelimit,
+                                                  info=prefetched["info"] if prefetched else None)
+                if result is None:
+                    result = self.run_ytdlp_command(options)
+            finally:
+                if bandwidth_job is not None:
+                    self.bandwidth.unregister(bandwidth_job)
             
-            # 捕获文件名
-            downloaded_file = ""
-            
-            # 监控进度
-            while process.poll() is None:
-                if not self.is_running:
-                    process.terminate()
-                    self.progress_updated.emit(0, "下载已取消")
-                    self.download_complete.emit(False, "取消下载", "")
-                    return
-                
-                line = process.stdout.readline().strip()
-                if not line:
-                    continue
-                    
-                print(f"yt-dlp输出: {line}")
-                
-                # 检测下载进度
-                if '[download]' in line and '%' in line:
-                    try:
-                        # 提取百分比
-                        percent_str = line.split('%')[0].split()[-1]
-                        percent = float(percent_str)
-                        self.progress_updated.emit(int(percent), f"下载中... {percent:.1f}%")
-                    except:
-                        pass
-                
-                # 检测下载文件名
-                elif 'Destination:' in line:
-                    try:
-                        downloaded_file = line.split('Destination:')[1].strip()
-                        self.file_path = downloaded_file
-                        print(f"下载文件: {downloaded_file}")
-                        self.progress_updated.emit(2, f"准备下载: {os.path.basename(downloaded_file)}")
-                    except:
-                        pass
-                
-                # 检测下载速度等信息
-                elif 'ETA' in line:
-                    try:
-                        eta_parts = line.split('ETA')[1].strip()
-                        self.progress_updated.emit(50, f"下载中... ETA: {eta_parts}")
-                    except:
-                        pass
-                        
-                # 检测去水印处理
-                elif '[ffmpeg]' in line:
-                    self.progress_updated.emit(80, "正在去除水印...")
+            if not self.is_running or result.get("cancelled"):
+                self.report_progress(0, "下载已取消")
+                self.download_complete.emit(False, "取消下载", "")
+                return
             
             # 检查是否成功
-            if process.returncode == 0:
-                self.progress_updated.emit(100, "下载完成!")
-                self.download_complete.emit(True, "下载完成", self.file_path)
+            if result.get("ok"):
+                if result.get("filepath"):
+                    self.file_path = result["filepath"]
+                file_path = self.file_path
+                self.run_postprocess(lambda: self.finish_download(video_id, file_path))
             else:
-                error = process.stderr.read()
-                self.progress_updated.emit(0, f"下载失败")
+                error = result.get("error", "")
+                self.report_progress(0, f"下载失败")
                 self.download_complete.emit(False, f"下载失败: {error[:100]}...", "")
                 
         except Exception as e:
             import traceback
             traceback.print_exc()
-            self.progress_updated.emit(0, f"下载出错")
+            self.report_progress(0, f"下载出错")
             self.download_complete.emit(False, str(e), "")
     
+    def on_ytdlp_event(self, event):
+        """处理yt-dlp工作进程返回的结构化进度事件"""
+        if event.get("type") == "progress" and event.get("status") == "downloading":
+            if event.get("filename") and event["filename"] != self.file_path:
+                self.file_path = event["filename"]
+                self.record_partial_file(self.file_path)
+            total = event.get("total_bytes")
+            downloaded = event.get("downloaded_bytes") or 0
+            self.journal_update(bytes_done=downloaded, total_bytes=total)
+            self.report_progress(
+                downloaded * 100 / total if total else None,
+                downloaded_bytes=downloaded,
+                total_bytes=total,
+                speed=event.get("speed"),
+                eta=event.get("eta")
+            )
+        elif event.get("type") == "postprocess" and event.get("status") == "started":
+            self.report_progress(80, "正在封装视频...")
+        elif event.get("type") == "log" and event.get("level") == "error":
+            print(f"yt-dlp错误: {event.get('message')}")
+    
+    def archive_download(self, video_ids, path, title=None):
+        """把下载完成的文件登记到已下载记录，失败不影响下载结果"""
+        if self.archive is None:
+            return
+        try:
+            sha256 = file_sha256(path) if path and os.path.exists(path) else None
+            for video_id in dict.fromkeys(filter(None, video_ids)):
+                self.archive.record("tiktok", video_id, '', path, title, sha256)
+        except Exception as e:
+            print(f"登记已下载记录失败: {e}")
+    
+    def journal_update(self, force=False, **fields):
+        """把下载状态写入断点续传日志"""
+        if self.journal is not None:
+            self.journal.update(self.job_key, force=force, **fields)
+    
+    def record_partial_file(self, path):
+        """记录yt-dlp正在写入的文件，取消下载时据此清理 .part 临时文件"""
+        if path and path not in self.partial_files:
+            self.partial_files.append(path)
+            self.journal_update(force=True, path=path, partial_files=list(self.partial_files))
+    
+    def report_progress(self, percent, message=None, **fields):
+        """上报进度：有进度汇总器时交给它合并限频，否则直接发信号"""
+        if self.progress_bus is not None:
+            self.progress_bus.report(self.job_key, percent, message, **fields)
+        else:
+            fields.update(percent=percent, message=message)
+            self.progress_updated.emit(int(percent or 0), format_progress_message(fields))
+    
+    def run_ytdlp_command(self, options):
+        """以单独的yt-dlp进程执行下载，返回与工作进程相同格式的结果"""
+        cmd = ytdlp_cli_args(self.url, options) + [
+            "--newline",  # 确保进度实时显示
+            "--progress",  # 显示进度条
+            "--no-colors"  # 移除颜色代码，便于解析输出
+        ]
+        
+        # 启动下载进程，同时排空stdout和stderr，避免stderr写满管道导致yt-dlp卡死
+        supervisor = ProcessSupervisor(cmd)
+        
+        # 监控进度
+        for stream, line in supervisor.iter_lines(should_stop=lambda: not self.is_running, idle_timeout=300):
+            line = line.strip()
+            if stream != "stdout" or not line:
+                continue
+            
+            # 检测下载进度
+            if '[download]' in line and '%' in line:
+                try:
+                    # 提取百分比
+                    percent_str = line.split('%')[0].split()[-1]
+                    percent = float(percent_str)
+                    self.report_progress(percent)
+                except:
+                    pass
+                continue
+            
+            print(f"yt-dlp输出: {line}")
+            
+            # 检测下载文件名
+            if 'Destination:' in line:
+                try:
+                    downloaded_file = line.split('Destination:')[1].strip()
+                    self.file_path = downloaded_file
+                    self.record_partial_file(downloaded_file)
+                    print(f"下载文件: {downloaded_file}")
+                    self.report_progress(2, f"准备下载: {os.path.basename(downloaded_file)}")
+                except:
+                    pass
+            
+            # 检测下载速度等信息
+            elif 'ETA' in line:
+                try:
+                    eta_parts = line.split('ETA')[1].strip()
+                    self.report_progress(50, f"下载中... ETA: {eta_parts}")
+                except:
+                    pass
+                    
+            # 检测封装处理
+            elif '[ffmpeg]' in line or '[CopyStream]' in line:
+                self.report_progress(80, "正在封装视频...")
+        
+        if not self.is_running:
+            return {"ok": False, "cancelled": True, "error": "下载已取消"}
+        if supervisor.wait(5) == 0:
+            return {"ok": True}
+        supervisor.cancel()
+        return {"ok": False, "error": supervisor.stderr_text() or "yt-dlp没有正常退出"}
+    
+    def run_postprocess(self, func):
+        """执行下载后的收尾工作（转码、计算校验和），func 负责发出完成信号
+
+        设置了后处理线程池时交给线程池执行，下载线程随即结束、释放下载名额；否则在当前线程中执行。
+        """
+        def task():
+            try:
+                func()
+            except Exception as e:
+                self.report_progress(0, "后处理出错")
+                self.download_complete.emit(False, f"后处理出错: {str(e)}", "")
+        
+        if self.postprocessor is None:
+            task()
+            return
+        self.postprocessing = True
+        self.report_progress(99, "等待后处理...")
+        self.postprocessor.submit(task)
+    
+    def finish_download(self, video_id, path):
+        """后处理：必要时转码为MP4，计算校验和并登记已下载记录，然后发出完成信号"""
+        if self.no_watermark:
+            path = self.reencode_if_needed(path)
+        self.file_path = path
+        self.archive_download([video_id], path)
+        self.report_progress(100, "下载完成!")
+        self.download_complete.emit(True, "下载完成", path)
+    
+    def reencode_if_needed(self, path):
+        """只有编码不能直接放进MP4时才重新编码，返回最终的文件路径"""
+        if not path or not os.path.exists(path) or not shutil.which("ffmpeg"):
+            return path
+        video_codec, audio_codec = probe_codecs(path)
+        if video_codec is None or (video_codec in MP4_VIDEO_CODECS
+                                   and audio_codec in MP4_AUDIO_CODECS + (None,)
+                                   and path.lower().endswith(".mp4")):
+            return path
+        
+        self.report_progress(90, f"正在转换为MP4 (视频编码 {video_codec})...")
+        output_path = os.path.splitext(path)[0] + ".mp4"
+        temp_path = os.path.splitext(path)[0] + ".reencode.mp4"
+        cmd = ["ffmpeg", "-y", "-i", path]
+        if video_codec in MP4_VIDEO_CODECS:
+            cmd.extend(["-c:v", "copy"])
+        else:
+            cmd.extend(["-c:v", "libx264", "-preset", self.reencode_preset, "-threads", str(self.reencode_threads)])
+        cmd.extend(["-c:a", "copy" if audio_codec in MP4_AUDIO_CODECS else "aac"])
+        cmd.extend(["-movflags", "+faststart", temp_path])
+        
+        supervisor = ProcessSupervisor(cmd)
+        for _ in supervisor.iter_lines(should_stop=lambda: not self.is_running):
+            pass
+        if supervisor.wait(10) != 0:
+            print(f"转码失败，保留原文件: {supervisor.stderr_text()[-500:]}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return path
+        os.replace(temp_path, output_path)
+        if output_path != path:
+            os.remove(path)
+        return output_path
+    
     def stop(self):
         """安全停止下载过程"""
         self.is_running = False
 
+# 命令行模式下多个工作线程会同时创建下载线程，预解析器在锁内创建，避免建出两个
+_metadata_prefetcher_lock = threading.Lock()
+
+
 class TiktokDownloaderPlugin(PluginBase):
     """TikTok短视频下载插件 - 使用yt-dlp下载TikTok视频"""
     
@@ -148,6 +583,14 @@ class TiktokDownloaderPlugin(PluginBase):
         self.description = "使用yt-dlp命令下载TikTok视频，支持去除水印，界面美观，使用简单"
         self.author = "YT下载器团队"
         self.app = app_instance
+        self.max_concurrent_downloads = 3  # 同时运行的下载线程数
+        self.progress_update_hz = 5  # 每秒刷新下载进度的次数
+        self.skip_downloaded = True  # 跳过已下载记录中存在的视频
+        self.reencode_preset = "veryfast"  # 视频编码无法直接封装时使用的x264预设
+        self.reencode_threads = 0  # 重新编码的线程数，0为自动
+        self.subscription_first_sync_limit = 0  # 新订阅首次同步最多下载的视频数，0为全部
+        self.download_queue = None
+        self.prefetch_urls = []  # 输入框中正在预解析的链接
         
     def initialize(self):
         """初始化插件"""
@@ -264,10 +707,13 @@ class TiktokDownloaderPlugin(PluginBase):
                 "无法找到yt-dlp，这是下载TikTok视频所必需的。\n\n"
                 "请安装yt-dlp: pip install yt-dlp -U")
             return
+        
+        # 提前启动yt-dlp工作进程，第一个下载无需等待yt-dlp导入
+        get_ytdlp_pool().prewarm(1)
             
         dialog = QDialog(self.app)
         dialog.setWindowTitle("TikTok视频下载")
-        dialog.resize(520, 350)
+        dialog.resize(620, 720)
         # 去除右上角的问号按钮
         dialog.setWindowFlags(dialog.windowFlags() & ~Qt.WindowContextHelpButtonHint)
         # 设置窗口样式
@@ -344,36 +790,116 @@ class TiktokDownloaderPlugin(PluginBase):
         form_layout.setSpacing(10)
         
         # URL输入框
-        self.url_input = QLineEdit()
-        self.url_input.setText("")
-        self.url_input.setPlaceholderText("请输入TikTok视频链接")
+        self.url_input = QPlainTextEdit()
+        self.url_input.setPlaceholderText("请输入TikTok视频链接，每行一个，可一次粘贴多个")
         self.url_input.setStyleSheet("""
-            QLineEdit {
+            QPlainTextEdit {
                 border: 1px solid #CCCCCC;
                 border-radius: 4px;
                 padding: 5px;
                 background-color: white;
                 selection-background-color: #FE2C55;  /* TikTok红色 */
             }
-            QLineEdit:focus {
+            QPlainTextEdit:focus {
                 border: 1px solid #FE2C55;  /* TikTok红色 */
             }
         """)
-        self.url_input.setMinimumHeight(28)
+        self.url_input.setFixedHeight(80)
         form_layout.addRow("视频链接:", self.url_input)
         
+        # 粘贴链接后稍等片刻再预解析，输入过程中不重复请求
+        self.metadata_label = QLabel()
+        self.metadata_label.setWordWrap(True)
+        self.metadata_label.setStyleSheet("color: #666666;")
+        self.metadata_label.setVisible(False)
+        form_layout.addRow("", self.metadata_label)
+        self.prefetch_urls = []
+        self.prefetch_timer = QTimer(dialog)
+        self.prefetch_timer.setSingleShot(True)
+        self.prefetch_timer.setInterval(400)
+        self.prefetch_timer.timeout.connect(self.prefetch_pasted_urls)
+        self.url_input.textChanged.connect(self.prefetch_timer.start)
+        
+        import_btn = QPushButton("从文件导入...")
+        import_btn.setStyleSheet("padding: 4px 10px; font-weight: normal;")
+        import_btn.clicked.connect(self.import_urls_from_file)
+        
+        # 把已有下载目录中的视频登记到已下载记录
+        scan_btn = QPushButton("索引已有目录...")
+        scan_btn.setStyleSheet("padding: 4px 10px; font-weight: normal;")
+        scan_btn.clicked.connect(self.scan_download_archive)
+        
+        import_layout = QHBoxLayout()
+        import_layout.addWidget(import_btn)
+        import_layout.addWidget(scan_btn)
+        form_layout.addRow("", import_layout)
+        
+        self.skip_downloaded_check = QCheckBox("跳过已下载的视频")
+        self.skip_downloaded_check.setChecked(self.skip_downloaded)
+        self.skip_downloaded_check.toggled.connect(lambda checked: setattr(self, "skip_downloaded", checked))
+        form_layout.addRow("", self.skip_downloaded_check)
+        
+        # 同时下载数
+        self.concurrent_spin = QSpinBox()
+        self.concurrent_spin.setRange(1, 16)
+        self.concurrent_spin.setValue(self.max_concurrent_downloads)
+        self.concurrent_spin.valueChanged.connect(self.on_concurrent_changed)
+        form_layout.addRow("同时下载数:", self.concurrent_spin)
+        
         # 去水印选项
-        self.no_watermark_check = QCheckBox("去除视频水印（可能需要额外处理时间）")
+        self.no_watermark_check = QCheckBox("下载无水印版本")
         self.no_watermark_check.setChecked(True)
         form_layout.addRow("", self.no_watermark_check)
         
         layout.addWidget(form_group)
         
+        # 订阅博主主页或话题，同步时只下载上次同步之后发布的视频
+        subscription_group = QGroupBox("订阅")
+        subscription_layout = QVBoxLayout(subscription_group)
+        subscription_layout.setContentsMargins(15, 20, 15, 15)
+        
+        subscription_input_layout = QHBoxLayout()
+        self.subscription_input = QLineEdit()
+        self.subscription_input.setPlaceholderText("@用户名、#话题 或主页链接")
+        subscription_input_layout.addWidget(self.subscription_input)
+        add_subscription_btn = QPushButton("添加订阅")
+        add_subscription_btn.setStyleSheet("padding: 4px 10px; font-weight: normal;")
+        add_subscription_btn.clicked.connect(self.add_subscription)
+        subscription_input_layout.addWidget(add_subscription_btn)
+        remove_subscription_btn = QPushButton("删除所选")
+        remove_subscription_btn.setStyleSheet("padding: 4px 10px; font-weight: normal;")
+        remove_subscription_btn.clicked.connect(self.remove_subscription)
+        subscription_input_layout.addWidget(remove_subscription_btn)
+        self.sync_subscriptions_btn = QPushButton("同步订阅")
+        self.sync_subscriptions_btn.setStyleSheet("padding: 4px 10px; font-weight: normal;")
+        self.sync_subscriptions_btn.clicked.connect(self.sync_subscriptions)
+        subscription_input_layout.addWidget(self.sync_subscriptions_btn)
+        subscription_layout.addLayout(subscription_input_layout)
+        
+        self.subscription_list = QListWidget()
+        self.subscription_list.setFixedHeight(70)
+        subscription_layout.addWidget(self.subscription_list)
+        self.refresh_subscription_list()
+        
+        layout.addWidget(subscription_group)
+        
         # 进度显示
         progress_group = QGroupBox("下载进度")
         progress_layout = QVBoxLayout(progress_group)
         progress_layout.setContentsMargins(15, 20, 15, 15)
         
+        # 下载队列
+        self.queue_table = QTableWidget()
+        self.queue_table.setColumnCount(3)
+        self.queue_table.setHorizontalHeaderLabels(["链接", "进度", "状态"])
+        self.queue_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.queue_table.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeToContents)
+        self.queue_table.horizontalHeader().setSectionResizeMode(2, QHeaderView.Stretch)
+        self.queue_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.queue_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        progress_layout.addWidget(self.queue_table)
+        self.queue_rows = {}
+        
         self.progress_bar = QProgressBar()
         self.progress_bar.setValue(0)
         self.progress_bar.setMinimumHeight(20)
@@ -470,46 +996,324 @@ class TiktokDownloaderPlugin(PluginBase):
         layout.addWidget(version_label)
         
         self.download_dialog = dialog
+        self.resume_unfinished_downloads()
         dialog.exec_()
         
-    def start_download(self):
-        """开始下载TikTok视频"""
-        url = self.url_input.text().strip()
-        if not url:
-            QMessageBox.warning(None, "输入错误", "请输入有效的TikTok视频链接")
+    def import_urls_from_file(self):
+        """从文本文件导入链接列表"""
+        from PyQt5.QtWidgets import QFileDialog
+        
+        file_path, _ = QFileDialog.getOpenFileName(None, "选择链接列表文件", "", "文本文件 (*.txt);;所有文件 (*)")
+        if not file_path:
             return
-            
+        try:
+            with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+                urls = parse_url_list(f.read())
+            if urls:
+                existing = self.url_input.toPlainText().strip()
+                self.url_input.setPlainText("\n".join(([existing] if existing else []) + urls))
+            self.status_label.setText(f"已从文件导入 {len(urls)} 个链接")
+        except Exception as e:
+            QMessageBox.warning(None, "导入失败", f"读取链接文件失败: {e}")
+    
+    def get_metadata_prefetcher(self):
+        """获取链接预解析器，不存在时创建"""
+        with _metadata_prefetcher_lock:
+            if getattr(self, 'metadata_prefetcher', None) is None:
+                self.metadata_prefetcher = MetadataPrefetcher(prefetch_video_metadata, video_key_from_url)
+                self.metadata_prefetcher.metadata_ready.connect(self.on_metadata_ready)
+            return self.metadata_prefetcher
+    
+    def prefetch_pasted_urls(self):
+        """在后台预解析输入框中的前几个TikTok链接"""
+        self.prefetch_urls = [url for url in parse_url_list(self.url_input.toPlainText())
+                              if 'tiktok.com' in url][:PREFETCH_LIMIT]
+        if self.prefetch_urls:
+            self.get_metadata_prefetcher().prefetch(self.prefetch_urls)
+        self.refresh_metadata_label()
+    
+    def on_metadata_ready(self, key, result):
+        """预解析完成，刷新输入框下方的视频信息"""
+        if any(video_key_from_url(url) == key for url in self.prefetch_urls):
+            self.refresh_metadata_label()
+    
+    def refresh_metadata_label(self):
+        """在输入框下方逐行显示预解析到的标题、时长、预计大小和可选画质"""
+        lines = []
+        for url in self.prefetch_urls:
+            result = self.get_metadata_prefetcher().peek(url)
+            if result is None:
+                lines.append(f"正在解析 {url} ...")
+            elif result.get("error"):
+                lines.append(f"解析失败 {url}: {result['error'][:80]}")
+            else:
+                lines.append(describe_prefetched_metadata(result))
+        try:
+            self.metadata_label.setText("\n".join(lines))
+            self.metadata_label.setVisible(bool(lines))
+        except RuntimeError:
+            pass  # 对话框已关闭
+    
+    def scan_download_archive(self):
+        """选择目录并在后台索引其中已下载的视频"""
+        from PyQt5.QtWidgets import QFileDialog
+        
+        directory = QFileDialog.getExistingDirectory(None, "选择已有的下载目录")
+        if not directory:
+            return
+        self.archive_scan_thread = ArchiveScanThread(directory)
+        self.archive_scan_thread.scan_complete.connect(self.on_archive_scan_complete)
+        self.archive_scan_thread.start()
+        self.status_label.setText(f"正在索引 {directory} ...")
+    
+    def on_archive_scan_complete(self, indexed, scanned):
+        """目录索引完成"""
+        self.status_label.setText(f"索引完成: 扫描 {scanned} 个视频文件，登记 {indexed} 个可识别的视频")
+    
+    def get_subscription_store(self):
+        """获取订阅列表，不存在时创建"""
+        if getattr(self, 'subscription_store', None) is None:
+            store_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings", "subscriptions.json")
+            self.subscription_store = SubscriptionStore(store_file)
+        return self.subscription_store
+    
+    def refresh_subscription_list(self):
+        """刷新订阅列表显示"""
+        from datetime import datetime
+        
+        store = self.get_subscription_store()
+        self.subscription_list.clear()
+        for source in store.list_sources():
+            entry = store.get(source)
+            if entry.get("last_sync"):
+                synced = datetime.fromtimestamp(entry["last_sync"]).strftime("%Y-%m-%d %H:%M")
+                text = f"{source}  (上次同步: {synced})"
+            else:
+                text = f"{source}  (尚未同步)"
+            self.subscription_list.addItem(text)
+            self.subscription_list.item(self.subscription_list.count() - 1).setData(Qt.UserRole, source)
+    
+    def add_subscription(self):
+        """添加订阅"""
+        source = normalize_subscription_source(self.subscription_input.text())
+        if not source:
+            QMessageBox.warning(None, "输入错误", "请输入 @用户名、#话题 或TikTok主页/话题链接")
+            return
+        if self.get_subscription_store().add(source, {"no_watermark": self.no_watermark_check.isChecked()}):
+            self.status_label.setText(f"已添加订阅 {source}，点击“同步订阅”下载")
+        else:
+            self.status_label.setText(f"{source} 已在订阅列表中")
+        self.subscription_input.clear()
+        self.refresh_subscription_list()
+    
+    def remove_subscription(self):
+        """删除选中的订阅"""
+        for item in self.subscription_list.selectedItems():
+            self.get_subscription_store().remove(item.data(Qt.UserRole))
+        self.refresh_subscription_list()
+    
+    def sync_subscriptions(self):
+        """在后台同步所有订阅，新视频加入下载队列"""
+        store = self.get_subscription_store()
+        if not store.list_sources():
+            QMessageBox.information(None, "没有订阅", "请先添加要订阅的用户或话题")
+            return
+        self.sync_subscriptions_btn.setEnabled(False)
+        self.subscription_sync_thread = SubscriptionSyncThread(
+            store, first_sync_limit=self.subscription_first_sync_limit)
+        self.subscription_sync_thread.new_videos.connect(self.on_subscription_videos)
+        self.subscription_sync_thread.sync_complete.connect(self.on_subscription_sync_complete)
+        self.subscription_sync_thread.start()
+        self.status_label.setText("正在同步订阅...")
+    
+    def on_subscription_videos(self, source, videos):
+        """订阅中发现新视频，按订阅的选项加入下载队列，游标只推进到队列接受了的视频"""
+        store = self.get_subscription_store()
+        entry = store.get(source) or {}
+        urls = [video["url"] for video in videos]
+        added = self.enqueue_urls(urls, entry.get("options") or None)
+        queue = self.get_download_queue()
+        added_keys = set(added)
+        # 与队列中未完成任务重复而被忽略的链接也算已接受
+        accepted = [video for video in videos
+                    if queue.key_func(video["url"]) in added_keys or queue.has_job(queue.key_func(video["url"]))]
+        if accepted:
+            newest = max(accepted, key=lambda video: tiktok_id_value(video["id"]))
+            store.advance(source, newest["id"], newest["timestamp"])
+        message = f"{source}: 新视频 {len(urls)} 个，已加入 {len(added)} 个下载任务"
+        if self.has_download_dialog():
+            self.status_label.setText(message)
+            self.cancel_btn.setEnabled(queue.is_busy())
+        else:
+            print(message)
+    
+    def on_subscription_sync_complete(self, total):
+        """订阅同步完成"""
+        if not self.has_download_dialog():
+            return
+        self.sync_subscriptions_btn.setEnabled(True)
+        self.refresh_subscription_list()
+        if not total:
+            self.status_label.setText("订阅同步完成，没有新视频")
+    
+    def on_concurrent_changed(self, value):
+        """修改同时下载数"""
+        self.max_concurrent_downloads = value
+        if self.download_queue:
+            self.download_queue.set_max_concurrent(value)
+    
+    def get_download_queue(self):
+        """获取下载队列，不存在时创建"""
+        if self.download_queue is None:
+            # 所有下载线程的进度先汇总，再按固定频率批量刷新界面
+            self.progress_bus = ProgressAggregator(self.progress_update_hz)
+            self.progress_bus.progress_batch.connect(self.on_progress_batch)
+            self.download_queue = DownloadQueue(
+                self.create_download_thread,
+                self.max_concurrent_downloads,
+                key_func=video_key_from_url,
+                progress_bus=self.progress_bus,
+                journal=self.get_download_journal()
+            )
+            self.download_queue.item_added.connect(self.on_queue_item_added)
+            self.download_queue.item_complete.connect(self.on_download_complete)
+            self.download_queue.queue_finished.connect(self.on_queue_finished)
+        return self.download_queue
+    
+    def get_download_journal(self):
+        """获取断点续传任务日志，不存在时创建"""
+        if getattr(self, 'download_journal', None) is None:
+            journal_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings", "download_journal.json")
+            self.download_journal = DownloadJournal(journal_file, "tiktok")
+        return self.download_journal
+    
+    def resume_unfinished_downloads(self):
+        """把上次退出时未完成的任务重新加入队列，已下载的部分会继续使用"""
+        resumed = 0
+        for key, entry in self.get_download_journal().unfinished():
+            resumed += len(self.enqueue_urls([entry["url"]], entry.get("options")))
+        if resumed:
+            self.status_label.setText(f"已恢复 {resumed} 个未完成的下载任务")
+            self.cancel_btn.setEnabled(self.get_download_queue().is_busy())
+    
+    def create_download_thread(self, url, no_watermark=True):
+        """为队列中的单个链接创建下载线程"""
         # 获取输出目录
         output_dir = "downloads"
         if hasattr(self.app, 'download_dir'):
             output_dir = self.app.download_dir
+        return TiktokDownloadThread(
+            url, output_dir, no_watermark,
+            bandwidth=get_bandwidth_manager(self.app),
+            archive=get_download_archive(),
+            skip_downloaded=self.skip_downloaded,
+            reencode_preset=self.reencode_preset,
+            reencode_threads=self.reencode_threads,
+            postprocessor=get_postprocess_pool(self.app),
+            prefetcher=self.get_metadata_prefetcher()
+        )
+        
+    def start_download(self):
+        """开始下载TikTok视频，所有链接加入下载队列"""
+        urls = parse_url_list(self.url_input.toPlainText())
+        if not urls:
+            QMessageBox.warning(None, "输入错误", "请输入有效的TikTok视频链接")
+            return
             
         # 获取去水印选项
         no_watermark = self.no_watermark_check.isChecked()
-            
-        # 创建并启动下载线程
-        self.download_thread = TiktokDownloadThread(url, output_dir, no_watermark)
-        self.download_thread.progress_updated.connect(self.update_progress)
-        self.download_thread.download_complete.connect(self.on_download_complete)
+        
+        queue = self.get_download_queue()
+        added = self.enqueue_urls(urls, {"no_watermark": no_watermark})
+        self.url_input.clear()
         
         # 更新界面状态
-        self.download_btn.setEnabled(False)
-        self.cancel_btn.setEnabled(True)
-        self.progress_bar.setValue(0)
-        self.status_label.setText("准备下载...")
+        skipped = len(urls) - len(added)
+        message = f"已加入 {len(added)} 个下载任务"
+        if skipped:
+            message += f"，忽略 {skipped} 个重复链接"
+        self.status_label.setText(message)
+        self.cancel_btn.setEnabled(queue.is_busy())
         
-        self.download_thread.start()
+    def has_download_dialog(self):
+        """下载对话框是否已创建"""
+        return getattr(self, 'download_dialog', None) is not None
+    
+    def enqueue_urls(self, urls, options=None):
+        """把链接加入下载队列，队列空闲时先清空上一批的显示，返回加入的任务键"""
+        queue = self.get_download_queue()
+        if not queue.is_busy():
+            # 新的一批下载，清空上一批的显示
+            if self.has_download_dialog():
+                self.queue_table.setRowCount(0)
+                self.progress_bar.setValue(0)
+            self.queue_rows = {}
+            self.batch_total = 0
+            self.batch_done = 0
+            self.active_percents = {}
+        added = queue.add_urls(urls, options)
+        self.batch_total += len(added)
+        return added
+    
+    def on_queue_item_added(self, key, url):
+        """在队列表格中添加一行"""
+        row = self.queue_table.rowCount()
+        self.queue_table.insertRow(row)
+        self.queue_table.setItem(row, 0, QTableWidgetItem(url))
+        self.queue_table.setItem(row, 1, QTableWidgetItem("0%"))
+        self.queue_table.setItem(row, 2, QTableWidgetItem("等待中"))
+        self.queue_rows[key] = row
         
-    def update_progress(self, value, message):
-        """更新下载进度"""
-        self.progress_bar.setValue(value)
-        self.status_label.setText(message)
+    def on_progress_batch(self, batch):
+        """按批次刷新所有正在下载任务的进度"""
+        for key, progress in batch.items():
+            if progress.get("percent") is not None:
+                self.active_percents[key] = progress["percent"]
+            row = self.queue_rows.get(key)
+            if row is None:
+                continue
+            if progress.get("percent") is not None:
+                self.queue_table.item(row, 1).setText(f"{progress['percent']:.0f}%")
+            self.queue_table.item(row, 2).setText(format_progress_message(progress))
+        self.update_total_progress()
         
-    def on_download_complete(self, success, message, file_path):
-        """下载完成处理"""
-        self.download_btn.setEnabled(True)
+    def update_total_progress(self):
+        """总体进度 = 已完成任务 + 正在下载任务的部分进度"""
+        if self.batch_total:
+            partial = sum(self.active_percents.values()) / 100
+            self.progress_bar.setValue(int((self.batch_done + partial) * 100 / self.batch_total))
+        
+    def on_download_complete(self, key, success, message, file_path):
+        """单个任务下载完成处理"""
+        self.batch_done += 1
+        self.active_percents.pop(key, None)
+        self.update_total_progress()
+        self.status_label.setText(f"已完成 {self.batch_done}/{self.batch_total}")
+        
+        row = self.queue_rows.get(key)
+        if row is not None:
+            self.queue_table.item(row, 1).setText("100%" if success else "-")
+            if success and file_path:
+                self.queue_table.item(row, 2).setText(f"完成: {os.path.basename(file_path)}")
+            else:
+                self.queue_table.item(row, 2).setText(message)
+        self.last_result = (success, message, file_path)
+        
+    def on_queue_finished(self, succeeded, failed):
+        """整个队列完成处理"""
         self.cancel_btn.setEnabled(False)
         
+        if succeeded + failed == 1:
+            self.show_single_result(*self.last_result)
+        elif failed:
+            QMessageBox.warning(None, "下载完成", f"批量下载结束: 成功 {succeeded} 个，失败 {failed} 个")
+            self.status_label.setText(f"下载结束: 成功 {succeeded} 个，失败 {failed} 个")
+        else:
+            QMessageBox.information(None, "下载完成", f"批量下载结束: {succeeded} 个视频已全部下载成功")
+            self.status_label.setText(f"全部下载完成: {succeeded} 个")
+            
+    def show_single_result(self, success, message, file_path):
+        """只有一个任务时显示详细的下载结果"""
         if success:
             # 如果下载成功且有文件路径
             if file_path and os.path.exists(file_path):
@@ -549,10 +1353,9 @@ class TiktokDownloaderPlugin(PluginBase):
             self.progress_bar.setValue(0)
             
     def cancel_download(self):
-        """取消正在进行的下载"""
-        if hasattr(self, 'download_thread') and self.download_thread:
-            self.download_thread.stop()
-            self.download_btn.setEnabled(True)
+        """取消队列中所有下载"""
+        if self.download_queue:
+            self.download_queue.cancel_all()
             self.cancel_btn.setEnabled(False)
             self.status_label.setText("下载已取消")
 
@@ -588,4 +1391,30 @@ class TiktokDownloaderPlugin(PluginBase):
     def on_disable(self):
         """插件被禁用时执行"""
         print("TikTok下载插件被禁用")
-        self.cleanup_ui()
\ No newline at end of file
+        self.cleanup_ui()
+        # 关闭空闲的yt-dlp工作进程
+        get_ytdlp_pool().shutdown()
+
+
+def main(argv=None):
+    """命令行入口，不需要图形界面: python -m tiktok_downloader [链接 ...] [-i 任务文件]"""
+    from types import SimpleNamespace
+    
+    parser = build_headless_parser("python -m tiktok_downloader", "无界面批量下载TikTok视频，进度以JSON行输出到标准输出")
+    parser.add_argument("--watermark", action="store_true", help="下载带水印的版本")
+    args = parser.parse_args(argv)
+    
+    # 复用插件的下载线程创建逻辑
+    plugin = TiktokDownloaderPlugin(SimpleNamespace(download_dir=args.output_dir) if args.output_dir else None)
+    plugin.skip_downloaded = not args.no_skip
+    
+    journal_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings", "cli_journal.json")
+    return run_headless(
+        args,
+        plugin.create_download_thread,
+        video_key_from_url,
+        journal=DownloadJournal(journal_file, "tiktok"),
+        options={"no_watermark": not args.watermark},
+        # 完成信号的参数: 成功状态, 消息, 文件路径
+        result_fields=lambda result: {"message": result[1], "path": result[2] if len(result) > 2 else ""}
+    )